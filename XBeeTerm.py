@@ -16,7 +16,7 @@
         baudrate <rate>     set the baud rate at which you will communicate with the XBee radio
         serial <device>     set the serial device that the XBee radio is attached
         term                wait for the arrive serial data, prints it, and sends keyboard input as serial data
-        watch               wait for the arrival of a XBee data packet, print it, wait for the next
+        watch [fast] [escaped]  wait for the arrival of a XBee data packet, print it, wait for the next
         shell or !          pause the interpreter and invoke command in Linux shell
         exit or EOF         exit the XBeeTerm
         help or ?           prints out short discription of the commands (similar to the above)
@@ -25,6 +25,9 @@
         AT+ASCII_Command+Space+Optional_Parameter+Carriage_Return
         Example: ATDL 1F<CR>
 
+    Provisioning many radios at once (each device gets the whole script, see Provisioner):
+        XBeeTerm.py -b 9600 -d /dev/ttyUSB0 -d /dev/ttyUSB1 -d /dev/ttyUSB2 config.txt
+
     Example Session:
         baudrate 9600        # (XBeeTerm command) set the baudrate used to comm. with the XBee
         serial /dev/ttyUSB0  # (XBeeTerm command) serial device which has the XBee radio
@@ -67,10 +70,15 @@ import os                   # portable way of using operating system dependent f
 import sys                  # provides access to some variables used or maintained by the interpreter
 import time                 # provides various time-related functions
 import cmd                  # provides a simple framework for writing line-oriented command interpreters
+import select               # waits on the serial port and the keyboard at the same time in "term" mode
 import serial               # encapsulates the access for the serial port
 import argparse             # provides easy to write and user-friendly command-line interfaces
+import threading            # worker threads for Dispatch callbacks
+import Queue                # bounded queues feeding the Dispatch worker threads
+import traceback            # formats the exceptions raised by Dispatch callbacks on worker threads
 from xbee import XBee       # implementation of the XBee serial communication API
-from pretty import switchColor, printc  # provides colored text for xterm & VT100 type terminals using ANSI escape sequences
+from xbeeframe import FrameReader   # lean parser for the IO sample frames, used by "watch fast"
+from pretty import switchColor, printc, Console, DEBUG  # provides colored text for xterm & VT100 type terminals using ANSI escape sequences
 
 # authorship information
 __author__ = "Jeff Irland"
@@ -93,6 +101,20 @@ WATCH_OUTPUT_TEXT = 'bright green'
 TERM_OUTPUT_TEXT = 'purple'
 TERM_INPUT_TEXT = 'bright purple'
 
+# seconds to wait for the XBee to answer
+RESPONSE_TIMEOUT = 1.0      # an AT command, the answer normally takes a few milliseconds
+GUARD_TIMEOUT = 3.0         # "+++", the XBee only answers after its 1 second guard time
+READ_POLL = 0.05            # longest a single read waits when nothing has arrived
+
+
+def watch_options(p):
+    """return (fast, escaped) for the arguments of the "watch" command"""
+    words = p.split()
+    unknown = [word for word in words if word not in ('fast', 'escaped')]
+    if unknown:
+        raise ValueError("watch takes [fast] [escaped], not %r" % unknown[0])
+    return 'fast' in words, 'escaped' in words
+
 
 class ArgsParser():
     """Within this object class you should load all the command-line switches, parameters, and arguments to operate this utility"""
@@ -118,6 +140,8 @@ class ArgsParser():
         """optional parameters for the command-line"""
         self.parser.add_argument("-b", "--baudrate", required=False, action="store", metavar="RATE", type=int, default=9600, help="baud rate used to communicate with the XBee radio")
         self.parser.add_argument("-p", "--device", required=False, action="store", metavar="DEV", type=str, default='/dev/ttyUSB0', help="open this serial port or device to communicate with the XBee radio")
+        self.parser.add_argument("-d", "--devices", required=False, action="append", metavar="DEV", type=str, default=None, help="apply the script file to this serial device, repeat for each radio to provision at once")
+        self.parser.add_argument("--no-pipeline", required=False, action="store_true", help="with --devices, send one AT command per line instead of combining them")
 
     def reqParameters(self):
         """required parameters for the command-line"""
@@ -157,22 +181,40 @@ class XBeeShell(cmd.Cmd):
         if not self.serial.isOpen():
             print "You must set a serial port first."
         else:
-            if p == '+++':
-                self.serial.write('+++')
-                time.sleep(2)
-            else:
-                self.serial.write('%s\r' % p)
-                time.sleep(0.5)
-
-            output = ''
-            while self.serial.inWaiting():
-                output += self.serial.read()
+            output = self.at_command(p)
             if output == '':
                 print 'XBee timed out, so reissue "+++". (Or maybe XBee doesn\'t understand "%s".)' % p
             else:
                 switchColor(XBEE_OUTPUT_TEXT)
                 print output.replace('\r', '\n').rstrip()
 
+    def at_command(self, p):
+        """Send an AT command (or "+++") and return the response, as soon as it is complete"""
+        if p == '+++':
+            # the XBee answers OK after its guard time (ATGT, 1 second by default) of silence
+            self.serial.write('+++')
+            return self.read_response(timeout=GUARD_TIMEOUT)
+        self.serial.write('%s\r' % p)
+        return self.read_response()
+
+    def read_response(self, terminator='\r', timeout=None, count=1):
+        """Read whatever the XBee sends until count responses ending with terminator have arrived
+        or timeout seconds pass
+
+        Everything waiting is read at once; when nothing is, read() waits at most READ_POLL."""
+        if timeout is None:
+            timeout = RESPONSE_TIMEOUT
+        deadline = time.time() + timeout
+        saved = self.serial.timeout
+        self.serial.timeout = READ_POLL
+        output = ''
+        try:
+            while not (output.endswith(terminator) and output.count(terminator) >= count) and time.time() < deadline:
+                output += self.serial.read(self.serial.inWaiting() or 1)
+        finally:
+            self.serial.timeout = saved
+        return output
+
     def emptyline(self):
         """method called when an empty line is entered in response to the prompt"""
         return None        # do not repeat the last nonempty command entered
@@ -214,46 +256,53 @@ class XBeeShell(cmd.Cmd):
         else:
             print "Entering \"term\" mode (Ctrl-C to abort)..."
             try:
-                #self.serial.timeout = 0
+                # wait on both the XBee and the keyboard, whichever has data is served first
                 while True:
-                    # read a line from XBee and convert it from b'xxx\r\n' to xxx
-                    switchColor(TERM_OUTPUT_TEXT)
-                    line = self.serial.readline().decode('utf-8')[:-2]
-                    if line:
-                        print line
-                    # read data from the keyboard and send via the XBee modem
-                    switchColor(TERM_INPUT_TEXT)
-                    line = sys.stdin.readline()
-                    self.serial.writelines(line)
-                    self.serial.flush()
-                    """
-                    output = ''
-                    while self.serial.inWaiting():
-                        output += self.serial.read()
-                    if output == '':
-                        print 'XBee timed out, so reissue "+++". (Or maybe XBee doesn\'t understand "%s".)' % p
-                    else:
-                        print output.replace('\r', '\n').rstrip()
-                    """
+                    readable, _, _ = select.select([self.serial, sys.stdin], [], [])
+                    if self.serial in readable:
+                        # print everything the XBee has sent, converting its \r line endings
+                        switchColor(TERM_OUTPUT_TEXT)
+                        sys.stdout.write(self.serial.read(self.serial.inWaiting() or 1).replace('\r', '\n'))
+                        sys.stdout.flush()
+                    if sys.stdin in readable:
+                        # read data from the keyboard and send via the XBee modem
+                        switchColor(TERM_INPUT_TEXT)
+                        line = sys.stdin.readline()
+                        if not line:
+                            break           # end of the script file or Ctrl-D
+                        self.serial.write(line)
+                        self.serial.flush()
             except KeyboardInterrupt:
                 printc("\n*** Ctrl-C keyboard interrupt ***", ERROR_TEXT)
             finally:
                 switchColor(WATCH_OUTPUT_TEXT)
 
     def do_watch(self, p):
-        """Assuming you have set the XBee to data mode, wait for the arrival of a XBee data packet, print it when it arrives, and wait for the next packet."""
+        """Assuming you have set the XBee to data mode, wait for the arrival of a XBee data packet, print it when it arrives, and wait for the next packet.  "watch fast" decodes only IO sample frames, with the built in parser.  Add "escaped" for a radio in API mode 2 (ATAP 2)."""
+        try:
+            fast, escaped = watch_options(p)
+        except ValueError, e:
+            printc(str(e), ERROR_TEXT)
+            return
         if not self.serial.isOpen():
             print "You must set a serial port first."
         else:
             print "Entering \"watch\" mode (Ctrl-C to abort)..."
             ser = serial.Serial(self.serial.port, self.serial.baudrate)     # Open XBee serial port
-            xbee = XBee(ser)                        # Create XBee object to manage packets
+            if fast:
+                xbee = FrameReader(ser, escaped=escaped)    # Only IO sample frames, decoded without python-xbee
+            else:
+                xbee = XBee(ser, escaped=escaped)           # Create XBee object to manage packets
             dispatch = Dispatch(xbee=xbee)          # Start the dispatcher that will call packet handlers
+            dispatch.register('print', self.print_packet, lambda packet: True)
+            self.console = Console(level=DEBUG, interval=0.25)    # packets are written in batches
             switchColor(WATCH_OUTPUT_TEXT)
             try:
                 dispatch.run()    # run() will loop infinitely while waiting for and processing packets which arrive.
             except KeyboardInterrupt:
+                self.console.flush()
                 printc("\n*** Ctrl-C keyboard interrupt ***", ERROR_TEXT)
+            self.console.close()
             ser.close()
             switchColor(WATCH_OUTPUT_TEXT)
             # while 1:
@@ -262,6 +311,10 @@ class XBeeShell(cmd.Cmd):
                     # xb = xbee(packet)
                     # print xb
 
+    def print_packet(self, name, packet):
+        """Dispatch callback for the "watch" command"""
+        self.console.frame(packet, WATCH_OUTPUT_TEXT)
+
     def do_exit(self, p):
         """Exits from the XBee serial terminal"""
         self.serial.close()
@@ -279,7 +332,7 @@ class XBeeShell(cmd.Cmd):
         print 'help\t\t', self.help_help.__doc__
         print 'serial <dev>\t', self.do_serial.__doc__
         print 'baudrate <rate>', self.do_baudrate.__doc__
-        print 'watch\t\t', self.do_watch.__doc__
+        print 'watch [fast] [escaped]', self.do_watch.__doc__
         print 'term\t\t', self.do_term.__doc__
         print 'shell <cmd>\t', self.do_shell.__doc__
         print 'EOF or Ctrl-D\t', self.do_EOF.__doc__
@@ -288,27 +341,66 @@ class XBeeShell(cmd.Cmd):
 
 class Dispatch(object):
     """For the "watch" command, this provides the Dispatch class, which allows one to filter
-    incoming data packets from an XBee device and call an appropriate method when one arrives."""
-    def __init__(self, ser=None, xbee=None):
+    incoming data packets from an XBee device and call an appropriate method when one arrives.
+
+    Handlers registered with a key, e.g. ('source_addr', addr), ('id', 'rx_io_data') or
+    ('channel', 'adc-0'), are kept in a routing table and found with one dict lookup per keyed
+    field, so adding handlers for more radios does not slow down every packet.  Handlers with
+    only a filter function are still checked one by one.
+
+    With workers > 0 callbacks no longer run inside the read loop: every handler gets that many
+    worker threads, each fed by its own bounded queue, and a packet goes to the queue chosen by
+    its source address so one radio's packets reach a handler in order.  When a queue is full
+    overflow decides what happens: 'block' waits for room, 'drop-oldest' throws away the
+    oldest queued packet for that handler.  A callback that raises on a worker thread is counted
+    in stats() and the first exception of each handler is passed to log with its traceback."""
+    KEY_FIELDS = ('id', 'source_addr', 'source_addr_long', 'channel')
+    OVERFLOW_POLICIES = ('block', 'drop-oldest')
+
+    def __init__(self, ser=None, xbee=None, workers=0, queue_size=100, overflow='block', log=None):
         self.xbee = None
         if xbee:
             self.xbee = xbee
         elif ser:
             self.xbee = XBee(ser)
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s, not '%s'" % (', '.join(self.OVERFLOW_POLICIES), overflow))
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.log = log or (lambda message: sys.stderr.write(message + '\n'))
         self.handlers = []
         self.names = set()
+        self.routes = {}            # field -> value -> [handler, ...]
+        self.unrouted = []          # handlers without a key, their filter is called for every packet
 
-    def register(self, name, callback, filter):
-        """register: string, function: string, data -> None, function: data -> boolean -> None
+    def register(self, name, callback, filter=None, key=None):
+        """register: string, function: string, data -> None, function: data -> boolean, (string, value) -> None
 
         Register will save the given name, callback, and filter function for use when a packet arrives.
         When one arrives, the filter function will be called to determine whether to call its associated
         callback function. If the filter method returns true, the callback method will be called
-        with its associated name string and the packet which triggered the call."""
+        with its associated name string and the packet which triggered the call.  With a key, the
+        filter (if any) is only called for packets whose field has that value."""
         if name in self.names:
             raise ValueError("A callback has already been registered with the name '%s'" % name)
-        self.handlers.append({'name': name, 'callback': callback, 'filter': filter})
+        if key is not None and key[0] not in self.KEY_FIELDS:
+            raise ValueError("Packets can only be routed on %s, not '%s'" % (', '.join(self.KEY_FIELDS), key[0]))
+        handler = {'name': name, 'callback': callback, 'filter': filter, 'key': key,
+                   'order': len(self.handlers), 'calls': 0, 'time': 0.0, 'max_time': 0.0,
+                   'errors': 0, 'dropped': 0, 'lock': threading.Lock(), 'lanes': []}
+        for lane in range(self.workers):
+            q = Queue.Queue(self.queue_size)
+            worker = threading.Thread(target=self._worker, args=(handler, q), name='dispatch-%s-%d' % (name, lane))
+            worker.daemon = True
+            worker.start()
+            handler['lanes'].append((q, worker))
+        self.handlers.append(handler)
         self.names.add(name)
+        if key is None:
+            self.unrouted.append(handler)
+        else:
+            self.routes.setdefault(key[0], {}).setdefault(key[1], []).append(handler)
 
     def run(self, oneshot=False):
         """run: boolean -> None
@@ -321,14 +413,212 @@ class Dispatch(object):
             if oneshot:
                 break
 
+    def close(self, timeout=None):
+        """Let the worker threads finish what is queued and stop them"""
+        for handler in self.handlers:
+            for q, worker in handler['lanes']:
+                q.put(None)
+            for q, worker in handler['lanes']:
+                worker.join(timeout)
+            handler['lanes'] = []
+
+    def _values(self, packet, field):
+        """the values of a routing field in a packet, which is a python-xbee dict or an xbeeframe.IOSample"""
+        if field == 'channel':
+            if isinstance(packet, dict):
+                samples = packet.get('samples')
+                return samples[0].keys() if samples else ()
+            return packet.channel_names()
+        value = packet.get(field) if isinstance(packet, dict) else getattr(packet, field, None)
+        return () if value is None else (value, )
+
+    def match(self, packet):
+        """return the handlers whose key and filter accept the packet, in registration order"""
+        matched = []
+        for field, table in self.routes.iteritems():
+            for value in self._values(packet, field):
+                matched.extend(table.get(value, ()))
+        matched.extend(self.unrouted)
+        if len(matched) > 1:
+            matched.sort(key=lambda handler: handler['order'])
+        return [handler for handler in matched if handler['filter'] is None or handler['filter'](packet)]
+
     def dispatch(self, packet):
         """dispatch: XBee data dict -> None
 
-        When called, dispatch checks the given packet against each registered callback
-        method and calls each callback whose filter function returns true."""
-        for handler in self.handlers:
-            if handler['filter'](packet):
-                handler['callback'](handler['name'], packet)    # Call the handler method with its associated name and the packet which passed its filter check
+        When called, dispatch calls each callback whose key and filter function accept the packet,
+        timing each call.  With workers the packet is queued for each callback instead."""
+        lane = None
+        for handler in self.match(packet):
+            if not handler['lanes']:
+                self._call(handler, packet)
+                continue
+            if lane is None:
+                source = self._values(packet, 'source_addr_long') or self._values(packet, 'source_addr')
+                lane = hash(source[0]) % self.workers if source else 0
+            self._enqueue(handler, handler['lanes'][lane][0], packet)
+
+    def _call(self, handler, packet):
+        start = time.time()
+        handler['callback'](handler['name'], packet)    # Call the handler method with its associated name and the packet which passed its filter check
+        elapsed = time.time() - start
+        with handler['lock']:
+            handler['calls'] += 1
+            handler['time'] += elapsed
+            if elapsed > handler['max_time']:
+                handler['max_time'] = elapsed
+
+    def _enqueue(self, handler, q, packet):
+        if self.overflow == 'block':
+            q.put(packet)
+            return
+        while True:
+            try:
+                q.put_nowait(packet)
+                return
+            except Queue.Full:
+                try:
+                    q.get_nowait()          # make room by dropping the oldest packet
+                    with handler['lock']:
+                        handler['dropped'] += 1
+                except Queue.Empty:
+                    pass
+
+    def _worker(self, handler, q):
+        while True:
+            packet = q.get()
+            if packet is None:
+                break
+            try:
+                self._call(handler, packet)
+            except Exception:
+                with handler['lock']:
+                    handler['errors'] += 1
+                    first = handler['errors'] == 1
+                if first:
+                    self.log("dispatch: callback '%s' raised, later errors are only counted in stats()\n%s"
+                             % (handler['name'], traceback.format_exc().rstrip()))
+
+    def stats(self):
+        """return {name: {'calls', 'time', 'avg_time', 'max_time', 'errors', 'dropped', 'queued'}} for
+        every handler, to spot slow callbacks"""
+        return dict((h['name'], {'calls': h['calls'], 'time': h['time'], 'max_time': h['max_time'],
+                                 'avg_time': h['time'] / h['calls'] if h['calls'] else 0.0,
+                                 'errors': h['errors'], 'dropped': h['dropped'],
+                                 'queued': sum(q.qsize() for q, worker in h['lanes'])})
+                    for h in self.handlers)
+
+
+class Provisioner(object):
+    """Applies a script of AT commands to many XBee radios at once, one thread per serial device.
+
+    Consecutive AT commands are pipelined: they are sent as one line, ATID B000,CH 0E,WR, which
+    the XBee executes in order and answers with one response per command, so a script of
+    n commands costs a few round trips rather than n.  Blank lines, # comments and "exit" are
+    ignored, "baudrate <rate>" sets the rate every device is opened at and "serial <device>" is
+    skipped, the devices come from --devices.  Any other XBeeTerm command is not supported in a
+    script run this way."""
+    MAX_LINE = 80               # characters per pipelined line, the XBee's command buffer is small
+
+    def __init__(self, commands, baudrate=9600, pipeline=True):
+        self.commands = commands
+        self.baudrate = baudrate
+        self.pipeline = pipeline
+
+    @staticmethod
+    def load(path):
+        """return the +++ and AT commands of a script file, and the baud rate it sets or None
+
+        Raises ValueError naming the file and line of anything else."""
+        commands = []
+        baudrate = None
+        for number, line in enumerate(open(path, 'rt'), 1):
+            line = line.split('#', 1)[0].strip()
+            if not line or line in ('exit', 'EOF'):
+                continue
+            word = line.split()[0]
+            if word == 'serial':
+                continue
+            if word == 'baudrate':
+                try:
+                    baudrate = int(line.split()[1])
+                except (IndexError, ValueError):
+                    raise ValueError("%s:%d: baudrate needs a number, not '%s'" % (path, number, line))
+                continue
+            if line != '+++' and not line.upper().startswith('AT'):
+                raise ValueError("%s:%d: '%s' is not an AT command, it cannot be used in a parallel script" % (path, number, line))
+            commands.append(line)
+        return commands, baudrate
+
+    def batches(self):
+        """group the commands into lines to send, returns [(line, [command, ...]), ...]"""
+        batches = []
+        for command in self.commands:
+            if command == '+++' or not self.pipeline:
+                batches.append((command, [command]))
+                continue
+            last = batches[-1] if batches else None
+            if last is not None and last[0] != '+++' and len(last[0]) + len(command) - 1 <= self.MAX_LINE:
+                batches[-1] = (last[0] + ',' + command[2:], last[1] + [command])
+            else:
+                batches.append((command, [command]))
+        return batches
+
+    def provision(self, device):
+        """run the script against one device, returns a result dict"""
+        result = {'device': device, 'ok': True, 'responses': [], 'round_trips': 0, 'seconds': 0.0, 'error': None}
+        start = time.time()
+        shell = None
+        try:
+            shell = XBeeShell(baudrate=self.baudrate, device=device)
+            for line, commands in self.batches():
+                if line == '+++':
+                    output = shell.at_command(line)
+                else:
+                    shell.serial.write('%s\r' % line)
+                    output = shell.read_response(count=len(commands))
+                result['round_trips'] += 1
+                answers = output.split('\r')
+                for n, command in enumerate(commands):
+                    answer = answers[n] if n < len(answers) else ''
+                    result['responses'].append((command, answer))
+                    if answer in ('', 'ERROR'):
+                        result['ok'] = False
+                if not result['ok']:
+                    break                   # do not carry on configuring a radio that is not answering
+        except Exception, e:
+            result['ok'] = False
+            result['error'] = str(e)
+        finally:
+            if shell is not None:
+                shell.serial.close()
+        result['seconds'] = time.time() - start
+        return result
+
+    def run(self, devices):
+        """provision every device concurrently, returns their results in the order given"""
+        results = {}
+
+        def worker(device):
+            results[device] = self.provision(device)
+
+        threads = [threading.Thread(target=worker, args=(device, ), name='provision-' + device) for device in devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [results[device] for device in devices]
+
+    @staticmethod
+    def report(results):
+        """print a summary line per device, then the responses of any that failed"""
+        printc("%-20s %-6s %9s %11s %9s" % ('device', 'status', 'commands', 'round trips', 'seconds'), CMD_OUTPUT_TEXT)
+        for r in results:
+            printc("%-20s %-6s %9d %11d %9.2f" % (r['device'], 'ok' if r['ok'] else 'FAILED', len(r['responses']),
+                                                 r['round_trips'], r['seconds']), CMD_OUTPUT_TEXT if r['ok'] else ERROR_TEXT)
+        for r in results:
+            if not r['ok']:
+                printc("%s: %s" % (r['device'], r['error'] or ', '.join('%s=%r' % pair for pair in r['responses'])), ERROR_TEXT)
 
 
 # Enter into XBee command-line processor
@@ -341,7 +631,23 @@ if __name__ == '__main__':
         print os.path.basename(__file__), "command-line arguments =", args.__dict__
 
     # process the command-line arguments (i.e. script file) and start the command shell
-    if len(args.inputs) == 0:       # there is no script file
+    if args.devices:                # apply the script file to many radios in parallel
+        if len(args.inputs) != 1:
+            print os.path.basename(__file__), "needs exactly one script file with --devices."
+        elif not os.path.exists(args.inputs[0]):
+            print 'File "%s" doesn\'t exist. Program terminated.' % args.inputs[0]
+        else:
+            try:
+                commands, baudrate = Provisioner.load(args.inputs[0])
+            except ValueError, e:
+                printc(str(e), ERROR_TEXT)
+                sys.exit(2)
+            provisioner = Provisioner(commands, baudrate=baudrate or args.baudrate, pipeline=not args.no_pipeline)
+            results = provisioner.run(args.devices)
+            Provisioner.report(results)
+            switchColor(CMD_INPUT_TEXT)
+            sys.exit(0 if all(r['ok'] for r in results) else 1)
+    elif len(args.inputs) == 0:     # there is no script file
         shell = XBeeShell(baudrate=args.baudrate, device=args.device)
         shell.cmdloop()
     else:                           # there is a script file on the command-line
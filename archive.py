@@ -0,0 +1,270 @@
+"""archive.py rolls closed days of tempature_log out into compact columnar files
+
+    Each UTC day of each zone becomes one file, <root>/<zone>/<YYYY-MM-DD>.tca:
+
+        header      magic 'TCA1', scale, readings, first timestamp, first tempature
+                    (in 1/scale degrees), compressed size of each column
+        column 1    zlib of the gaps between timestamps, uint32
+        column 2    zlib of the change in tempature, int32 in 1/scale degrees
+
+    A day of readings every few seconds shrinks to a few kilobytes, against a few
+    hundred for the same rows in sqlite.  log_temp.py archives each day once it has
+    closed, one zone-day per second (see Archiver.step), well before retention.py
+    prunes the raw rows, and python archive.py --prune drops archived days from
+    tempature_log straight away.  The webserver reads the files through Archive, which
+    maps them and decodes whole columns with numpy, for raw or finely bucketed
+    /get_temps windows older than the raw rows still in sqlite.
+"""
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import urllib
+import calendar
+import argparse
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, fall back to pure python
+    np = None
+
+MAGIC = 'TCA1'
+SCALE = 100             # tempatures are kept to a hundredth of a degree
+DAY = 60*60*24
+SUFFIX = '.tca'
+
+_HEADER = struct.Struct('<4sIIqiII')
+
+
+def encode(timestamps, temps, scale=SCALE):
+    """return the file contents for one zone-day of readings, oldest first"""
+    if np is not None:
+        t = np.asarray(timestamps, np.int64)
+        v = np.rint(np.asarray(temps, float) * scale).astype(np.int64)
+        gaps = np.diff(t).astype('<u4').tostring()
+        changes = np.diff(v).astype('<i4').tostring()
+        first_t, first_v = int(t[0]), int(v[0])
+    else:
+        v = [int(round(temp * scale)) for temp in temps]
+        n = len(timestamps) - 1
+        gaps = struct.pack('<%dI' % n, *[b - a for a, b in zip(timestamps, timestamps[1:])])
+        changes = struct.pack('<%di' % n, *[b - a for a, b in zip(v, v[1:])])
+        first_t, first_v = timestamps[0], v[0]
+    gaps, changes = zlib.compress(gaps, 9), zlib.compress(changes, 9)
+    return _HEADER.pack(MAGIC, scale, len(timestamps), first_t, first_v, len(gaps), len(changes)) + gaps + changes
+
+
+def decode(buf):
+    """return (timestamps, tempatures) from file contents or a mapping of a file,
+    as numpy arrays when numpy is installed"""
+    magic, scale, count, first_t, first_v, gaps_size, changes_size = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("not an archive file")
+    pos = _HEADER.size
+    gaps = zlib.decompress(buf[pos:pos + gaps_size])
+    changes = zlib.decompress(buf[pos + gaps_size:pos + gaps_size + changes_size])
+    if np is not None:
+        t = np.empty(count, np.int64)
+        t[0] = first_t
+        np.cumsum(np.frombuffer(gaps, '<u4'), out=t[1:])
+        t[1:] += first_t
+        v = np.empty(count, np.int64)
+        v[0] = first_v
+        np.cumsum(np.frombuffer(changes, '<i4'), out=v[1:])
+        v[1:] += first_v
+        return t, v / float(scale)
+    t, y = [first_t], [first_v / float(scale)]
+    value = first_v
+    for gap, change in zip(struct.unpack('<%dI' % (count - 1), gaps), struct.unpack('<%di' % (count - 1), changes)):
+        t.append(t[-1] + gap)
+        value += change
+        y.append(value / float(scale))
+    return t, y
+
+
+def day_name(day):
+    return time.strftime('%Y-%m-%d', time.gmtime(day))
+
+
+def day_start(name):
+    return calendar.timegm(time.strptime(name, '%Y-%m-%d'))
+
+
+def zone_dir(root, zone):
+    return os.path.join(root, urllib.quote(zone, safe=''))
+
+
+def day_path(root, zone, day):
+    return os.path.join(zone_dir(root, zone), day_name(day) + SUFFIX)
+
+
+def read_day(path):
+    """decode one file through a read-only mapping"""
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return decode(mapping)
+    finally:
+        mapping.close()
+
+
+class Archive(object):
+    """Read side, used by the webserver"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def zones(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(urllib.unquote(name) for name in os.listdir(self.root))
+
+    def days(self, zone):
+        """return the start of every archived day of zone, oldest first"""
+        path = zone_dir(self.root, zone)
+        if not os.path.isdir(path):
+            return []
+        return sorted(day_start(name[:-len(SUFFIX)]) for name in os.listdir(path) if name.endswith(SUFFIX))
+
+    def newest_day(self):
+        """return the start of the newest day archived for any zone, None if there is none"""
+        days = [days[-1] for days in (self.days(zone) for zone in self.zones()) if days]
+        return max(days) if days else None
+
+    def archived_until(self, zone):
+        """return the end of the newest day archived for zone, 0 if none is"""
+        days = self.days(zone)
+        return days[-1] + DAY if days else 0
+
+    def window(self, zone, start, end, inclusive=False):
+        """return the archived (timestamps, tempatures) of zone after start (from start if
+        inclusive) up to end"""
+        parts = []
+        for day in self.days(zone):
+            if day + DAY <= start or day > end:
+                continue
+            t, y = read_day(day_path(self.root, zone, day))
+            parts.append((t, y))
+        if np is not None:
+            if not parts:
+                return np.empty(0, np.int64), np.empty(0, float)
+            t = np.concatenate([p[0] for p in parts])
+            y = np.concatenate([p[1] for p in parts])
+            keep = ((t >= start) if inclusive else (t > start)) & (t <= end)
+            return t[keep], y[keep]
+        t, y = [], []
+        for pt, py in parts:
+            for timestamp, temp in zip(pt, py):
+                if (timestamp >= start if inclusive else timestamp > start) and timestamp <= end:
+                    t.append(timestamp)
+                    y.append(temp)
+        return t, y
+
+
+class Archiver(object):
+    """Write side, writes every closed zone-day that is not archived yet"""
+
+    def __init__(self, conn, root):
+        self.conn = conn
+        self.root = root
+        self.pending = None             # (day, zone) still to archive this pass
+        self.last_pass = None
+        self.days_archived = 0
+        self.rows_archived = 0
+        self.bytes_written = 0
+
+    def due(self, interval=60*60):
+        return bool(self.pending) or self.last_pass is None or time.time() - self.last_pass >= interval
+
+    def start_pass(self, now=None, grace=5*60):
+        """List the closed zone-days in sqlite without a file, from the daily rollup.  A day
+        closes grace seconds after midnight, once its last readings have been flushed."""
+        if now is None:
+            now = int(time.time())
+        today = (now - grace) - (now - grace) % DAY
+        rows = self.conn.execute("SELECT bucket, room FROM tempature_rollup_1d WHERE bucket < ? ORDER BY bucket, room",
+                                 (today, )).fetchall()
+        self.pending = [(day, zone) for day, zone in rows if not os.path.exists(day_path(self.root, zone, day))]
+
+    def step(self):
+        """Archive one zone-day, returns the rows archived, 0 when the pass is over"""
+        if self.pending is None:
+            self.start_pass()
+        while self.pending:
+            day, zone = self.pending.pop(0)
+            rows = self.conn.execute("SELECT timestamp, tempature FROM tempature_log WHERE room = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+                                     (zone, day, day + DAY)).fetchall()
+            if not rows:
+                continue                # already pruned from sqlite before it could be archived
+            data = encode([row[0] for row in rows], [row[1] for row in rows])
+            path = day_path(self.root, zone, day)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.rename(path + '.tmp', path)          # readers never see half a file
+            self.days_archived += 1
+            self.rows_archived += len(rows)
+            self.bytes_written += len(data)
+            return len(rows)
+        self.pending = None
+        self.last_pass = time.time()
+        return 0
+
+    def run(self, now=None):
+        """Archive everything that is due, returns the rows archived"""
+        before = self.rows_archived
+        self.start_pass(now)
+        while self.step():
+            pass
+        return self.rows_archived - before
+
+    def prune(self, batch_rows=500):
+        """Delete the raw rows of every archived day from tempature_log, batch_rows per
+        transaction, returns the rows deleted"""
+        deleted = 0
+        archive = Archive(self.root)
+        for zone in archive.zones():
+            for day in archive.days(zone):
+                while True:
+                    with self.conn:
+                        row = self.conn.execute("SELECT timestamp FROM tempature_log WHERE room = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp LIMIT 1 OFFSET ?",
+                                                (zone, day, day + DAY, batch_rows)).fetchone()
+                        upto = day + DAY if row is None else row[0]
+                        count = self.conn.execute("DELETE FROM tempature_log WHERE room = ? AND timestamp >= ? AND timestamp < ?",
+                                                  (zone, day, upto)).rowcount
+                    deleted += count
+                    if row is None:
+                        break
+        return deleted
+
+    def stats(self):
+        return {
+            'days_archived': self.days_archived,
+            'rows_archived': self.rows_archived,
+            'bytes_written': self.bytes_written,
+        }
+
+    def __str__(self):
+        return ' '.join('{0}={1}'.format(k, v) for k, v in sorted(self.stats().items()))
+
+
+if __name__ == '__main__':
+    import sqlite3
+    import schema
+    parser = argparse.ArgumentParser(description="Archive closed days of tempature_log into compressed columnar files")
+    parser.add_argument("database", nargs="?", default='tempature.db')
+    parser.add_argument("-a", "--archive", default='archive', help="directory of the archive files")
+    parser.add_argument("--prune", action="store_true", help="then delete the archived days from tempature_log")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    schema.migrate(conn)
+    archiver = Archiver(conn, args.archive)
+    archiver.run()
+    print "archived: {0}".format(archiver)
+    if args.prune:
+        print "pruned {0} rows from tempature_log".format(archiver.prune())
+    conn.close()
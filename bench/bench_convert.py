@@ -0,0 +1,36 @@
+"""bench_convert.py compares converting frames one at a time against convert_batch
+
+    Usage: python bench/bench_convert.py [frames] [samples per frame]
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import convert
+
+
+def make_frames(count, samples):
+    return [[{'adc-0': random.randint(220, 260)} for _ in range(samples)] for _ in range(count)]
+
+
+def main(count=10000, samples=5, repeat=5):
+    frames = make_frames(count, samples)
+    zones = ['Room%d' % (i % 4) for i in range(count)]
+
+    scalar = lambda: [convert.get_tempature(f, format="F", zone=z) for f, z in zip(frames, zones)]
+    batch = lambda: convert.convert_batch(frames, format="F", zones=zones)
+
+    expected, got = scalar(), batch()
+    assert max(abs(a - b) for a, b in zip(expected, got)) < 1e-9, "batch and scalar results differ"
+
+    print "{0} frames x {1} samples, numpy {2}".format(count, samples, "on" if convert.np is not None else "off")
+    for name, fn in (('scalar', scalar), ('batch', batch)):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        print "{0:>8}: {1:8.2f} ms  {2:12.0f} frames/sec".format(name, best * 1000, count / best)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,251 @@
+"""bench_suite.py benchmarks the ingest, query and render paths against a synthetic database
+
+    A database of days x zones readings, one every interval seconds per zone, is built in
+    a scratch directory through BufferedWriter (the ingest benchmark).  Next to it go the
+    fixtures a running logger keeps: a ring buffer holding the newest readings of every
+    zone, and an archive of the closed days, with tempature_log pruned to keep_days as
+    log_temp.py --keep-days does.  Then every webserver endpoint in ENDPOINTS is requested
+    through the Flask test client, reading all three, and its latency percentiles and
+    response size recorded.  The ADC conversion is timed too.
+
+    Results are written as JSON so two runs can be compared:
+        python bench/bench_suite.py --days 30 --zones 4 -o bench/results/new.json
+        python bench/bench_suite.py --compare bench/results/old.json bench/results/new.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import schema
+import convert
+from temp_writer import BufferedWriter
+from ringbuf import RingWriter
+from archive import Archiver
+from retention import Retention
+
+# (name, url) of the requests timed against the webserver
+ENDPOINTS = [
+    ('index', '/'),
+    ('current', '/current'),
+    ('temps_24h', '/get_temps'),
+    ('temps_24h_540', '/get_temps?max_points=540'),
+    ('temps_24h_zone', '/get_temps?zone=Zone0'),
+    ('temps_7d', '/get_temps?range=604800'),
+    ('temps_30d_540', '/get_temps?range=2592000&max_points=540'),
+    ('temps_1h_raw', '/get_temps?range=3600&raw=1'),
+    ('temps_3d_raw_zone', '/get_temps?range=259200&raw=1&zone=Zone0'),
+    ('temps_24h_stream', '/get_temps?raw=1&stream=1'),
+]
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    samples = sorted(samples)
+    result = dict(('p%d' % p, samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]) for p in points)
+    result['max'] = samples[-1]
+    result['mean'] = sum(samples) / len(samples)
+    return result
+
+
+def build_database(path, days, zones, interval, flush_rows):
+    """fill a fresh database through BufferedWriter, returns the ingest measurements"""
+    conn = sqlite3.connect(path)
+    schema.migrate(conn)
+    writer = BufferedWriter(conn, max_rows=flush_rows, max_age=float('inf'))
+    end = int(time.time())
+    start = end - days * 60*60*24
+    temps = [72.0] * zones
+    rows = 0
+    began = time.time()
+    for timestamp in xrange(start, end, interval):
+        for zone in range(zones):
+            temps[zone] += random.uniform(-0.1, 0.1)
+            writer.add('Zone%d' % zone, temps[zone], timestamp)
+            rows += 1
+    writer.close()
+    elapsed = time.time() - began
+    conn.close()
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed,
+        'avg_flush_latency': writer.stats()['avg_flush_latency'],
+        'db_bytes': os.path.getsize(path),
+    }
+
+
+def build_ring(path, ring_path):
+    """fill a ring buffer with the newest readings of every zone, as log_temp.py keeps it"""
+    conn = sqlite3.connect(path)
+    began = time.time()
+    ring = RingWriter(ring_path)
+    rows = 0
+    for (zone, ) in conn.execute("SELECT DISTINCT room FROM tempature_rollup_1d ORDER BY room").fetchall():
+        readings = conn.execute("SELECT timestamp, tempature FROM tempature_log WHERE room = ? ORDER BY timestamp DESC LIMIT ?",
+                                (zone, ring.capacity)).fetchall()
+        for timestamp, temp in reversed(readings):
+            ring.append(str(zone), timestamp, temp)
+        rows += len(readings)
+    ring.close()
+    conn.close()
+    return {'rows': rows, 'seconds': time.time() - began, 'ring_bytes': os.path.getsize(ring_path)}
+
+
+def build_archive(path, root, keep_days):
+    """archive every closed day, then prune tempature_log to keep_days (0 keeps every row)"""
+    conn = sqlite3.connect(path)
+    began = time.time()
+    archiver = Archiver(conn, root)
+    archiver.run()
+    pruned = Retention(conn, keep_days={'tempature_log': keep_days}).run() if keep_days else 0
+    conn.close()
+    return {
+        'rows': archiver.rows_archived,
+        'seconds': time.time() - began,
+        'archive_bytes': archiver.bytes_written,
+        'rows_pruned': pruned,
+    }
+
+
+def bench_endpoints(path, ring_path, archive_root, repeat):
+    """time every endpoint in ENDPOINTS through the Flask test client"""
+    os.environ['TEMPATURE_DB'] = path
+    os.environ['TEMPATURE_RING'] = ring_path
+    os.environ['TEMPATURE_ARCHIVE'] = archive_root
+    sys.path.insert(0, os.path.join(ROOT, 'webserver'))
+    import app
+    client = app.app.test_client()
+
+    results = {}
+    for name, url in ENDPOINTS:
+        client.get(url)                 # warm the page cache and the latest reading cache
+        latencies = []
+        size = 0
+        for _ in range(repeat):
+            began = time.time()
+            response = client.get(url)
+            size = len(response.get_data())
+            latencies.append((time.time() - began) * 1000)
+        result = percentiles(latencies)
+        result['bytes'] = size
+        results[name] = result
+    return results
+
+
+def bench_convert(frames=10000, samples=5, repeat=5):
+    data = [[{'adc-0': random.randint(220, 260)} for _ in range(samples)] for _ in range(frames)]
+    scalar, batch = [], []
+    for _ in range(repeat):
+        began = time.time()
+        for f in data:
+            convert.get_tempature(f, format="F")
+        scalar.append(time.time() - began)
+        began = time.time()
+        convert.convert_batch(data, format="F")
+        batch.append(time.time() - began)
+    return {'scalar_frames_per_sec': frames / min(scalar), 'batch_frames_per_sec': frames / min(batch)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path, threshold=0.1):
+    """print every number that moved by more than threshold between two result files"""
+    old, new = json.load(open(old_path)), json.load(open(new_path))
+    print "{0} ({1}) -> {2} ({3})".format(old_path, old['meta']['revision'], new_path, new['meta']['revision'])
+    for section in ('ingest', 'ring', 'archive', 'convert', 'endpoints'):
+        flat_old, flat_new = _flatten(old.get(section, {})), _flatten(new.get(section, {}))
+        for key in sorted(set(flat_old) & set(flat_new)):
+            a, b = flat_old[key], flat_new[key]
+            if a and abs(b - a) / float(a) > threshold:
+                print "  {0:<40} {1:>12.3f} -> {2:>12.3f}  {3:+.0%}".format(section + '.' + key, a, b, (b - a) / float(a))
+
+
+def _flatten(d, prefix=''):
+    flat = {}
+    for key, value in d.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, query and render paths against a synthetic database")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--zones", type=int, default=4)
+    parser.add_argument("--interval", type=int, default=16, help="seconds between readings of one zone")
+    parser.add_argument("--flush-rows", type=int, default=20, help="BufferedWriter batch size")
+    parser.add_argument("--keep-days", type=int, default=2, help="days of raw rows left in sqlite once archived, 0 keeps them all")
+    parser.add_argument("--repeat", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic database, ring and archive")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scratch = tempfile.mkdtemp(prefix='tempature-bench-')
+    path = os.path.join(scratch, 'tempature.db')
+    ring_path = os.path.join(scratch, 'tempature.ring')
+    archive_root = os.path.join(scratch, 'archive')
+    try:
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'time': int(time.time()),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'numpy': convert.np is not None,
+                'days': args.days, 'zones': args.zones, 'interval': args.interval,
+                'flush_rows': args.flush_rows, 'keep_days': args.keep_days, 'repeat': args.repeat,
+            },
+        }
+        print "building {days} days x {zones} zones every {interval}s...".format(**vars(args))
+        results['ingest'] = build_database(path, args.days, args.zones, args.interval, args.flush_rows)
+        print "  {rows} rows at {rows_per_sec:.0f} rows/sec, {db_bytes} bytes".format(**results['ingest'])
+
+        results['ring'] = build_ring(path, ring_path)
+        print "ring: {rows} readings, {ring_bytes} bytes".format(**results['ring'])
+        results['archive'] = build_archive(path, archive_root, args.keep_days)
+        print "archive: {rows} rows in {archive_bytes} bytes, {rows_pruned} pruned from sqlite".format(**results['archive'])
+
+        results['convert'] = bench_convert()
+        print "convert: {scalar_frames_per_sec:.0f} frames/sec scalar, {batch_frames_per_sec:.0f} batch".format(**results['convert'])
+
+        results['endpoints'] = bench_endpoints(path, ring_path, archive_root, args.repeat)
+        print "{0:<20} {1:>9} {2:>9} {3:>9} {4:>9} {5:>10}".format('endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'bytes')
+        for name, url in ENDPOINTS:
+            r = results['endpoints'][name]
+            print "{0:<20} {1[p50]:>9.2f} {1[p90]:>9.2f} {1[p99]:>9.2f} {1[max]:>9.2f} {1[bytes]:>10}".format(name, r)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print "results written to %s" % args.output
+    finally:
+        if args.keep:
+            print "database, ring and archive kept in %s" % scratch
+        else:
+            shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""convert.py turns XBee ADC samples into tempatures
+
+    get_tempature converts one frame as it arrives.  convert_batch converts many
+    frames at once for backfills and replays of captured frames: with numpy installed
+    every frame's samples are averaged and converted with a handful of array
+    operations, otherwise a tight pure python loop is used.  Both apply the per zone
+    calibration in CALIBRATION.
+"""
+
+import itertools
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, fall back to pure python
+    np = None
+
+# we are using a 3.3v usb explorer so the formula is slightly different
+MV_PER_COUNT = 3.2258   # millivolts per ADC count
+OFFSET_MV = 500.0       # the sensor outputs 500mv at 0C
+MV_PER_C = 10.0
+
+ADC = 0                 # which XBee ADC the sensor is wired to
+ADC_CHANNEL = 'adc-%d' % ADC    # its key in python-xbee's samples
+
+# zone -> (gain, offset in C), applied to the celsius reading: C * gain + offset
+CALIBRATION = {
+}
+
+
+def get_calibration(zone):
+    return CALIBRATION.get(zone, (1.0, 0.0))
+
+
+def get_tempature(data, format="C", zone=None):
+    """Average one frame's samples and convert them to a tempature"""
+    #iterate over data elements
+    return counts_to_tempature([item.get(ADC_CHANNEL) for item in data], format, zone)
+
+
+def counts_to_tempature(readings, format="C", zone=None):
+    """Average a list of ADC counts and convert them to a tempature"""
+    #start by averaging the data
+    volt_average = sum(readings)/float(len(readings))
+
+    #now calculate the proper mv
+    tempature = ((volt_average*MV_PER_COUNT) - OFFSET_MV) / MV_PER_C
+
+    gain, offset = get_calibration(zone)
+    tempature = tempature * gain + offset
+
+    if format=="F":
+        #convert to farenheit
+        tempature = (tempature * 1.8) + 32
+
+    return tempature
+
+
+def _convert_numpy(frames, gains, offsets, format):
+    lengths = np.fromiter((len(samples) for samples in frames), int, len(frames))
+    counts = np.fromiter((item.get(ADC_CHANNEL) for item in itertools.chain.from_iterable(frames)),
+                         float, int(lengths.sum()))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    # reduceat sums an empty frame's slot as the next frame's first sample, and fails
+    # when the last frame is empty, so only frames with samples are reduced
+    sampled = lengths > 0
+    averages = np.full(len(frames), np.nan)
+    if sampled.any():
+        averages[sampled] = np.add.reduceat(counts, starts[sampled]) / lengths[sampled]
+
+    temps = (averages * MV_PER_COUNT - OFFSET_MV) / MV_PER_C
+    temps = temps * np.asarray(gains, float) + np.asarray(offsets, float)
+    if format == "F":
+        temps = temps * 1.8 + 32
+    return temps.tolist()
+
+
+def _convert_python(frames, gains, offsets, format):
+    # the format branch is decided once, outside the loop
+    if format == "F":
+        scale, shift = 1.8, 32.0
+    else:
+        scale, shift = 1.0, 0.0
+    temps = []
+    for samples, gain, offset in itertools.izip(frames, gains, offsets):
+        if not samples:
+            temps.append(float('nan'))
+            continue
+        average = sum(item.get(ADC_CHANNEL) for item in samples) / float(len(samples))
+        temps.append((((average * MV_PER_COUNT - OFFSET_MV) / MV_PER_C) * gain + offset) * scale + shift)
+    return temps
+
+
+def convert_batch(frames, format="C", zones=None):
+    """convert_batch: list of frame samples, string, list of zones -> list of float
+
+    Convert many frames' samples (each a list of {'adc-0': count} dicts, as in a frame's
+    'samples') in one go.  zones, if given, names the zone of each frame for calibration.
+    A frame without samples converts to nan, so the result still lines up with frames."""
+    if not frames:
+        return []
+    if zones is None:
+        gains, offsets = [1.0] * len(frames), [0.0] * len(frames)
+    else:
+        calibration = [get_calibration(zone) for zone in zones]
+        gains, offsets = [c[0] for c in calibration], [c[1] for c in calibration]
+    if np is not None:
+        return _convert_numpy(frames, gains, offsets, format)
+    return _convert_python(frames, gains, offsets, format)
@@ -0,0 +1,90 @@
+"""downsample.py reduces a time series to a fixed number of points for charting
+
+    Largest-Triangle-Three-Buckets (Steinarsson, 2013) keeps the first and last points
+    and, for each of the buckets in between, the point forming the largest triangle
+    with the point picked for the previous bucket and the average of the next bucket.
+    Peaks and dips survive, unlike plain averaging or every-nth sampling.
+
+    The per-bucket work is done with numpy when it is installed, so the python loop
+    runs once per output point rather than once per input point.
+"""
+
+import itertools
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, fall back to pure python
+    np = None
+
+
+def _bucket_edges(n, threshold):
+    """return the threshold-1 start indices of the buckets between the first and last points"""
+    every = (n - 2) / float(threshold - 2)
+    edges = [int(i * every) + 1 for i in range(threshold - 1)]
+    edges[-1] = n - 1
+    return edges
+
+
+def _lttb_numpy(points, threshold):
+    n = len(points)
+    # fromiter over the flattened pairs is several times quicker than np.asarray on a list of tuples
+    data = np.fromiter(itertools.chain.from_iterable(points), float, 2 * n).reshape(n, 2)
+    x, y = data[:, 0], data[:, 1]
+    edges = np.array(_bucket_edges(n, threshold))
+
+    # average of every bucket, the last point stands in for the bucket after the last one
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:-1], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:-1], edges[:-1]) / counts, y[-1])
+
+    picked = [0]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        # twice the triangle area, the constant factor does not change the argmax
+        areas = np.abs((ax - avg_x[i + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y[i + 1] - ay))
+        a = lo + int(areas.argmax())
+        picked.append(a)
+    picked.append(n - 1)
+    return [points[i] for i in picked]
+
+
+def _lttb_python(points, threshold):
+    n = len(points)
+    edges = _bucket_edges(n, threshold)
+
+    picked = [points[0]]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = points[hi:edges[i + 2]]
+            avg_x = sum(p[0] for p in nxt) / float(len(nxt))
+            avg_y = sum(p[1] for p in nxt) / float(len(nxt))
+        else:
+            avg_x, avg_y = points[-1][0], points[-1][1]
+
+        ax, ay = points[a][0], points[a][1]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        picked.append(points[a])
+    picked.append(points[-1])
+    return picked
+
+
+def lttb(points, threshold):
+    """lttb: sequence of (x, y) sorted by x, int -> list of (x, y)
+
+    Return at most threshold of the given points, chosen to preserve the shape of the series."""
+    if threshold >= len(points):
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:max(threshold, 0)]
+    if np is not None:
+        return _lttb_numpy(points, threshold)
+    return _lttb_python(points, threshold)
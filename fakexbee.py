@@ -0,0 +1,281 @@
+"""fakexbee.py records, simulates and replays the XBee API byte stream
+
+    Nothing in the logger can be exercised without a radio on the serial port, so this
+    module provides:
+
+        RecordingSerial  wraps a serial port and copies every byte read to a capture file
+        simulate()       generates IO sample frames (0x83) for any number of fake sensors
+        FakeSerial       a serial.Serial stand-in that plays a capture back in-process
+        replay_pty()     plays a capture into a pseudo terminal, for unmodified programs
+        replay_clock()   a clock running as fast as a replay, to timestamp what it plays
+
+    A capture file is CAPTURE_MAGIC followed by records of (seconds since the start as a
+    double, length as an unsigned short, the bytes), little endian.
+
+    Usage:
+        python fakexbee.py record capture.bin -p /dev/ttyAMA0 -b 38400 --seconds 600
+        python fakexbee.py simulate capture.bin --sensors 8 --interval 16 --seconds 86400
+        python fakexbee.py replay capture.bin --speed 100
+        python log_temp.py -p /dev/pts/N -d test.db --replay-speed 100   # the pty printed by replay
+
+    The logger stamps a reading with the time it arrives and keeps one per zone per
+    second, so a replay sped up without --replay-speed collapses into a row per zone per
+    second and only measures the decode path.  With it readings are stamped on a clock
+    that runs as fast as the replay, starting now, so they land in the future.
+"""
+
+import os
+import sys
+import time
+import random
+import struct
+import argparse
+import threading
+
+CAPTURE_MAGIC = 'XBCAP1\n'
+RECORD = struct.Struct('<dH')
+
+API_START = 0x7E
+ESCAPED = (0x7E, 0x7D, 0x11, 0x13)      # bytes that must be escaped in API mode 2
+
+
+def api_frame(data, escaped=False):
+    """wrap frame data in the API envelope: start delimiter, length, data, checksum"""
+    data = bytearray(data)
+    body = bytearray(struct.pack('>H', len(data))) + data + bytearray([0xFF - (sum(data) & 0xFF)])
+    if escaped:
+        out = bytearray()
+        for b in body:
+            if b in ESCAPED:
+                out += bytearray([0x7D, b ^ 0x20])
+            else:
+                out.append(b)
+        body = out
+    return str(bytearray([API_START]) + body)
+
+
+def io_sample_frame(addr, counts, rssi=40, escaped=False):
+    """an 0x83 (16 bit address IO sample) frame carrying one ADC0 value per sample"""
+    data = bytearray([0x83]) + bytearray(struct.pack('>H', addr)) + bytearray([rssi, 0, len(counts), 0x02, 0x00])
+    for count in counts:
+        data += bytearray(struct.pack('>H', count))
+    return api_frame(data, escaped)
+
+
+def write_capture(path, records):
+    """write (offset, bytes) records to a capture file, returns the number written"""
+    written = 0
+    with open(path, 'wb') as f:
+        f.write(CAPTURE_MAGIC)
+        for offset, data in records:
+            f.write(RECORD.pack(offset, len(data)))
+            f.write(data)
+            written += 1
+    return written
+
+
+def read_capture(path):
+    """yield the (offset, bytes) records of a capture file"""
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            offset, length = RECORD.unpack(header)
+            yield offset, f.read(length)
+
+
+def simulate(sensors=1, interval=16.0, seconds=3600, samples=5, first_addr=0xAAA1, escaped=False):
+    """yield (offset, frame) for sensors fake radios each reporting every interval seconds
+
+    Each sensor random walks around room tempature, readings are staggered across the interval."""
+    counts = [random.randint(230, 250) for _ in range(sensors)]
+    for tick in range(int(seconds / interval)):
+        for sensor in range(sensors):
+            counts[sensor] = min(max(counts[sensor] + random.randint(-1, 1), 200), 280)
+            noise = [counts[sensor] + random.randint(-2, 2) for _ in range(samples)]
+            offset = tick * interval + sensor * interval / sensors
+            yield offset, io_sample_frame(first_addr + sensor, noise, escaped=escaped)
+
+
+class RecordingSerial(object):
+    """Wraps a serial port, every byte read from it is also appended to a capture file"""
+
+    def __init__(self, ser, path):
+        self.ser = ser
+        self.capture = open(path, 'wb')
+        self.capture.write(CAPTURE_MAGIC)
+        self.started = time.time()
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        if data:
+            self.capture.write(RECORD.pack(time.time() - self.started, len(data)))
+            self.capture.write(data)
+        return data
+
+    def close(self):
+        self.capture.close()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class FakeSerial(object):
+    """A serial.Serial stand-in that plays back (offset, bytes) records
+
+    speed 1 replays in real time, 10 ten times faster, 0 as fast as the reader can go.
+    Once the records run out read() waits like an idle port: up to timeout, or with no
+    timeout until close(), which makes it raise IOError.  Bytes written to it are kept
+    in self.written."""
+
+    def __init__(self, records, speed=1.0, timeout=None):
+        self.records = iter(records)
+        self.speed = float(speed)
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.pending = None             # next record, not due yet
+        self.exhausted = False
+        self.written = bytearray()
+        self.bytes_read = 0
+        self.started = time.time()
+        self.closed = threading.Event()
+
+    def _due(self, offset):
+        return self.speed <= 0 or offset / self.speed <= time.time() - self.started
+
+    def _fill(self):
+        """move every record that is due into the buffer, returns seconds until the next one"""
+        while not self.exhausted:
+            if self.pending is None:
+                try:
+                    self.pending = next(self.records)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+            offset, data = self.pending
+            if not self._due(offset):
+                return offset / self.speed - (time.time() - self.started)
+            self.buffer += data
+            self.pending = None
+        return None
+
+    def inWaiting(self):
+        self._fill()
+        return len(self.buffer)
+
+    in_waiting = property(inWaiting)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while len(self.buffer) < size:
+            wait = self._fill()
+            if len(self.buffer) >= size:
+                break
+            if deadline is not None:
+                wait = deadline - time.time() if wait is None else min(wait, deadline - time.time())
+                if wait <= 0:
+                    break
+            self.closed.wait(wait)      # wait None: nothing more is coming, block until closed
+            if self.closed.is_set():
+                raise IOError("port closed")
+        data = str(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isOpen(self):
+        return not self.closed.is_set()
+
+    def open(self):
+        self.closed.clear()
+
+    def close(self):
+        self.closed.set()
+
+
+def replay_clock(speed, started=None):
+    """return a time.time() stand-in running speed times faster than real time from started"""
+    if started is None:
+        started = time.time()
+    return lambda: started + (time.time() - started) * speed
+
+
+def replay_pty(records, speed=1.0, out=sys.stdout):
+    """Play records into a new pseudo terminal until they run out
+
+    Programs open the slave side, printed on out, exactly like a real serial port."""
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    speed = float(speed)
+    print >>out, "replaying on %s" % os.ttyname(slave)
+    out.flush()
+    started = time.time()
+    sent = 0
+    for offset, data in records:
+        if speed > 0:
+            wait = offset / speed - (time.time() - started)
+            if wait > 0:
+                time.sleep(wait)
+        os.write(master, data)
+        sent += len(data)
+    print >>out, "replayed %d bytes in %.1f seconds" % (sent, time.time() - started)
+    return sent
+
+
+def record(port, baudrate, path, seconds=None):
+    """Copy everything arriving on a serial port into a capture file"""
+    import serial
+    ser = RecordingSerial(serial.Serial(port, baudrate, timeout=0.5), path)
+    started = time.time()
+    try:
+        while seconds is None or time.time() - started < seconds:
+            ser.read(ser.inWaiting() or 1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ser.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record, simulate and replay XBee API traffic for load testing without a radio")
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('record', help="record a serial port into a capture file")
+    p.add_argument('capture')
+    p.add_argument("-p", "--device", default='/dev/ttyAMA0')
+    p.add_argument("-b", "--baudrate", type=int, default=38400)
+    p.add_argument("--seconds", type=float, default=None, help="stop after this long, default is until Ctrl-C")
+
+    p = commands.add_parser('simulate', help="write a capture file of simulated sensors")
+    p.add_argument('capture')
+    p.add_argument("--sensors", type=int, default=4)
+    p.add_argument("--interval", type=float, default=16.0, help="seconds between readings of one sensor")
+    p.add_argument("--seconds", type=float, default=60*60*24)
+    p.add_argument("--samples", type=int, default=5, help="ADC samples per frame")
+    p.add_argument("--escaped", action="store_true", help="use API mode 2 escaping (ATAP 2)")
+
+    p = commands.add_parser('replay', help="replay a capture file on a pseudo terminal")
+    p.add_argument('capture')
+    p.add_argument("--speed", type=float, default=1.0, help="1 is real time, 0 is as fast as possible")
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.device, args.baudrate, args.capture, args.seconds)
+    elif args.command == 'simulate':
+        count = write_capture(args.capture, simulate(args.sensors, args.interval, args.seconds, args.samples, escaped=args.escaped))
+        print "wrote %d frames to %s" % (count, args.capture)
+    else:
+        replay_pty(read_capture(args.capture), args.speed)
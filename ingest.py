@@ -0,0 +1,170 @@
+"""ingest.py runs the logger as a three stage pipeline of threads
+
+    reader  -- waits for XBee frames and timestamps them, never waits on anything else
+    decoder -- turns a frame into a reading (zone, timestamp, tempature)
+    persist -- hands readings to the database writer
+
+    Bounded queues sit between the stages.  The reader must keep draining the serial
+    port, so when the decoder falls behind it drops the frame and counts it rather than
+    blocking; the decoder blocks when the persist stage is behind, which pushes the
+    backlog into the frame queue where it is visible in the counters.
+
+    The persist stage also calls maintain every maintain_interval seconds, between
+    readings, however busy it is, so flushing, archiving and retention never starve.
+    An exception in any stage is counted and logged with its traceback, at most once
+    per ERROR_LOG_SECONDS per kind, and the stage carries on.
+"""
+
+import threading
+import traceback
+import time
+import Queue
+
+_STOP = object()        # sentinel passed down the queues on shutdown
+ERROR_LOG_SECONDS = 60.0
+
+
+class IngestPipeline(object):
+    """read_frame: -> frame, blocking
+    decode: timestamp, frame -> reading, or None to skip the frame
+    persist: reading -> None
+    maintain: called by the persist stage every maintain_interval seconds
+    log: called with a message and traceback when a stage raises
+    clock: -> seconds, stamps each frame as it is read"""
+
+    def __init__(self, read_frame, decode, persist, maintain=None, frame_queue=256, reading_queue=256,
+                 maintain_interval=1.0, log=None, clock=time.time):
+        self.read_frame = read_frame
+        self.clock = clock
+        self.decode = decode
+        self.persist = persist
+        self.maintain = maintain
+        self.maintain_interval = maintain_interval
+        self.log = log
+        self.logged = {}                # error counter -> (time last logged, count then)
+        self.frames = Queue.Queue(frame_queue)
+        self.readings = Queue.Queue(reading_queue)
+        self.stopping = threading.Event()
+        self.threads = []
+
+        # counters, only ever incremented by the stage that owns them
+        self.frames_read = 0
+        self.frames_dropped = 0         # frame queue was full
+        self.frames_decoded = 0
+        self.decode_errors = 0
+        self.readings_persisted = 0
+        self.persist_errors = 0
+        self.maintain_errors = 0
+        self.read_errors = 0
+
+    def start(self):
+        for name, target in (('reader', self._reader), ('decoder', self._decoder), ('persist', self._persist)):
+            thread = threading.Thread(target=target, name='ingest-' + name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def running(self):
+        return all(thread.is_alive() for thread in self.threads)
+
+    def stop(self, timeout=10.0, release=None):
+        """Stop reading and wait for everything already read to be persisted
+
+        The reader may be blocked in read_frame: release, e.g. the serial port's close, is
+        called to free it, and the reader is waited for so a frame it was part way through
+        is not lost.  Without release any frame read after stop is dropped."""
+        self.stopping.set()
+        if release is not None:
+            release()
+            self.threads[0].join(timeout)
+        self.frames.put(_STOP)          # waits for room, the decoder is still draining
+        for thread in self.threads[1:]:
+            thread.join(timeout)
+
+    def _reader(self):
+        while not self.stopping.is_set():
+            try:
+                frame = self.read_frame()
+            except Exception:
+                if self.stopping.is_set():
+                    break
+                self._error('read_errors')
+                time.sleep(0.1)
+                continue
+            self.frames_read += 1
+            try:
+                self.frames.put_nowait((int(self.clock()), frame))
+            except Queue.Full:
+                self.frames_dropped += 1
+
+    def _decoder(self):
+        while True:
+            item = self.frames.get()
+            if item is _STOP:
+                self.readings.put(_STOP)
+                break
+            try:
+                reading = self.decode(*item)
+            except Exception:
+                self._error('decode_errors')
+                continue
+            if reading is not None:
+                self.frames_decoded += 1
+                self.readings.put(reading)      # blocks while the persist stage is behind
+
+    def _persist(self):
+        due = time.time() + self.maintain_interval
+        while True:
+            try:
+                reading = self.readings.get(timeout=max(0, due - time.time()))
+            except Queue.Empty:
+                reading = None
+            if reading is _STOP:
+                break
+            if reading is not None:
+                try:
+                    self.persist(reading)
+                    self.readings_persisted += 1
+                except Exception:
+                    self._error('persist_errors')
+            if time.time() >= due:
+                due = time.time() + self.maintain_interval
+                if self.maintain is not None:
+                    try:
+                        self.maintain()
+                    except Exception:
+                        self._error('maintain_errors')
+
+    def _error(self, counter):
+        """count the exception being handled, and log it unless that counter was logged lately"""
+        count = getattr(self, counter) + 1
+        setattr(self, counter, count)
+        if self.log is None:
+            return
+        now = time.time()
+        last, logged_count = self.logged.get(counter, (None, 0))
+        if last is not None and now - last < ERROR_LOG_SECONDS:
+            return
+        self.logged[counter] = (now, count)
+        suppressed = count - logged_count - 1
+        self.log("{0} #{1}{2}: {3}".format(counter[:-1].replace('_', ' '), count,
+                                           " ({0} more not logged)".format(suppressed) if suppressed else '',
+                                           traceback.format_exc().rstrip()))
+
+    def stats(self):
+        """return a dict of the pipeline counters and queue depths"""
+        return {
+            'frames_read': self.frames_read,
+            'frames_dropped': self.frames_dropped,
+            'frames_decoded': self.frames_decoded,
+            'decode_errors': self.decode_errors,
+            'readings_persisted': self.readings_persisted,
+            'persist_errors': self.persist_errors,
+            'maintain_errors': self.maintain_errors,
+            'read_errors': self.read_errors,
+            'frame_queue': self.frames.qsize(),
+            'reading_queue': self.readings.qsize(),
+        }
+
+    def __str__(self):
+        return ' '.join('{0}={1}'.format(k, v) for k, v in sorted(self.stats().items()))
@@ -0,0 +1,76 @@
+"""latest.py looks up and caches the newest reading of every zone
+
+    The index page and the status endpoints only need one number per zone, so
+    LatestCache keeps those readings in memory.  Within ttl seconds they are served
+    without touching sqlite.  After that the cache asks sqlite for PRAGMA data_version
+    on its own connection, which changes only when another connection (log_temp.py)
+    has committed, and reloads the readings only if it has moved.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+def latest_readings(conn):
+    """return {zone: (timestamp, tempature)} with the latest reading of every zone
+
+    The zones come from the small daily rollup and each zone's newest row is a single
+    lookup on the (room, timestamp) key, so this does not scan tempature_log."""
+    cur = conn.execute("""SELECT l.room, l.timestamp, l.tempature
+FROM (SELECT DISTINCT room FROM tempature_rollup_1d) AS z
+JOIN tempature_log AS l ON l.room = z.room
+AND l.timestamp = (SELECT max(timestamp) FROM tempature_log WHERE room = z.room)""")
+    return dict((row[0], (row[1], row[2])) for row in cur.fetchall())
+
+
+class LatestCache(object):
+    """Process wide cache of latest_readings(), shared by every request thread"""
+
+    def __init__(self, database, ttl=5.0):
+        self.database = database
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = None
+        self.readings = None
+        self.version = None
+        self.checked = 0.0              # when the readings were last known to be current
+
+        self.hits = 0                   # served from memory
+        self.revalidations = 0          # ttl expired but data_version had not changed
+        self.misses = 0                 # reloaded from sqlite
+
+    def _data_version(self):
+        row = self.conn.execute("PRAGMA data_version").fetchone()
+        return row[0] if row else None  # older sqlite has no data_version, reload every ttl
+
+    def get(self):
+        """return {zone: (timestamp, tempature)}, reloading only when the database has changed"""
+        with self.lock:
+            now = time.time()
+            if self.readings is not None and now - self.checked < self.ttl:
+                self.hits += 1
+                return self.readings
+
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.database, check_same_thread=False)
+            version = self._data_version()
+            if self.readings is not None and version is not None and version == self.version:
+                self.revalidations += 1
+            else:
+                self.readings = latest_readings(self.conn)
+                self.version = version
+                self.misses += 1
+            self.checked = now
+            return self.readings
+
+    def stats(self):
+        """return a dict of hit/miss counters"""
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.revalidations) / float(lookups) if lookups else 0.0,
+            'ttl': self.ttl,
+        }
@@ -1,64 +1,229 @@
-import serial, time, datetime, sys
+import serial, time, datetime, sys, os, socket
+import argparse
 from xbee import XBee
 import time
 import sqlite3
+from temp_writer import BufferedWriter
+from schema import migrate
+from retention import Retention
+from ringbuf import RingWriter
+from archive import Archive, Archiver
+from rules import RulesEngine, PrintSink, load_rules
+from pretty import Console, DEBUG, INFO
+from zones import get_zone, zone_for_frame
+from notify import Publisher
+from ingest import IngestPipeline
+from convert import get_tempature, counts_to_tempature, ADC
+from fakexbee import RecordingSerial, replay_clock
+from xbeeframe import FrameReader, IOSample
+import metrics
+from retention import file_size
 
 
-def get_tempature(data, format="C"):
-	#iterate over data elements
-	readings = []
-	for item in data:
-		readings.append(item.get('adc-0'))
-	
-	#start by averaging the data
-	volt_average = sum(readings)/float(len(readings))
-	
-	#now calculate the proper mv
-	#we are using a 3.3v usb explorer so the formula is slightly different
-	tempature = ((volt_average*3.2258) - 500) / 10.0	
+def save_temp_reading (zonestr, temp, timestamp=None):
+    # readings are buffered and written in batches, see temp_writer.py,
+    # and pushed straight to the webserver's live chart, see notify.py
+    if timestamp is None:
+        timestamp = int(time.time())
+    publisher.publish(zonestr, timestamp, temp)
+    if ring is not None:
+        ring.append(zonestr, timestamp, temp)
+    flushes = writer.flushes
+    writer.add(zonestr, temp, timestamp)
+    if writer.flushes != flushes:
+        flushed()
 
-	if format=="F":
-		#convert to farenheit
-		tempature = (tempature * 1.8) + 32
 
-	return tempature
+def flushed():
+    # once per flush, never per frame, so the metrics cost nothing on the hot path
+    insert_latency.observe(writer.last_insert_latency)
+    commit_latency.observe(writer.last_commit_latency)
+    console.info("flushed: {0}".format(writer))
 
 
-def save_temp_reading (zonestr, temp):
-    # I used triple quotes so that I could break this string into
-    # two lines for formatting purposes
-    curs.execute("INSERT INTO tempature_log values( (?), (?), (?) )", (int(time.time()), zonestr,temp))
+def decode_frame(timestamp, response):
+    # decoder stage, runs on its own thread, see ingest.py
+    console.frame(response)
+    if isinstance(response, IOSample):
+        # from the built in parser, see xbeeframe.py
+        zonestr = zone_for_frame(response.source_addr, response.source_addr_long)
+        return (zonestr, timestamp, counts_to_tempature(response.adc(ADC), format="F", zone=zonestr))
+    zonestr = get_zone(response)
+    return (zonestr, timestamp, get_tempature(response['samples'], format="F", zone=zonestr))
 
-    # commit the changes
-    conn.commit()
+
+def persist_reading(reading):
+    # persist stage, the only thread that touches the database
+    zonestr, timestamp, tempature = reading
+
+    #print our timestamp and tempature to standard_out, with --verbose
+    console.debug("{0}, {1}".format(timestamp, tempature))
+
+    #save the tempature to the databse, under the zone of the radio that sent it
+    save_temp_reading(zonestr, tempature, timestamp)
+
+    # only the rules watching this zone are evaluated, see rules.py
+    if engine is not None:
+        engine.evaluate(zonestr, timestamp, tempature)
+
+
+def flush_if_due():
+    # called by the persist stage every second, so old readings do not sit in the buffer
+    # and archiving and retention keep up however many sensors are reporting
+    if writer.due():
+        writer.flush()
+        flushed()
+    elif archiver is not None and archiver.due():
+        # closed days go to the archive before retention can prune them, see archive.py
+        archiver.step()
+        if not archiver.due():
+            console.info("archive: {0}".format(archiver))
+    elif retention is not None and retention.due():
+        # one small batch at a time, see retention.py
+        retention.step()
+        if not retention.due():
+            console.info("retention: {0}".format(retention))
 
 SERIALPORT = "/dev/ttyAMA0"    # the com/serial port the XBee is connected to
 BAUDRATE = 38400      # the baud rate we talk to the xbee
-TEMPSENSE = 0       # which XBee ADC has current draw data
-ROOM = "Room1"  # for now, when we add a second unit we will change this
+FLUSH_ROWS = 20     # write to the database after this many readings...
+FLUSH_SECONDS = 60  # ...or once the oldest buffered reading is this old
+STATS_SECONDS = 300 # how often the pipeline counters are printed
+SAMPLE_SECONDS = 60 # one summary line of the frames received this often, see pretty.Console
+METRICS_PORT = 9101 # where the Prometheus metrics are served, see metrics.py
+METRICS_HOST = '127.0.0.1'  # scrapes from this Pi only, --metrics-host '' to serve every interface
+
+
+def register_metrics(registry, pipeline, reader=None):
+    """Expose the counters the logger already keeps, they are only read when scraped"""
+    stat = lambda obj, key: lambda: obj.stats()[key]
+    registry.callback('tempature_frames_total', "XBee frames by what happened to them", kind='counter', labels=('state', ),
+                      fn=lambda: dict(((state, ), pipeline.stats()[key]) for state, key in (
+                          ('received', 'frames_read'), ('decoded', 'frames_decoded'), ('dropped', 'frames_dropped'),
+                          ('decode_error', 'decode_errors'), ('read_error', 'read_errors'))))
+    registry.callback('tempature_readings_persisted_total', "readings handed to the writer", stat(pipeline, 'readings_persisted'), kind='counter')
+    registry.callback('tempature_persist_errors_total', "readings the writer failed on", stat(pipeline, 'persist_errors'), kind='counter')
+    registry.callback('tempature_maintain_errors_total', "failed flush, archive or retention steps", stat(pipeline, 'maintain_errors'), kind='counter')
+    registry.callback('tempature_queue_depth', "items waiting between pipeline stages", labels=('queue', ),
+                      fn=lambda: {('frame', ): pipeline.frames.qsize(), ('reading', ): pipeline.readings.qsize()})
+    registry.callback('tempature_rows_written_total', "rows written to tempature_log", stat(writer, 'rows_written'), kind='counter')
+    registry.callback('tempature_rows_duplicate_total', "readings dropped because their zone already had one that second", stat(writer, 'rows_duplicate'), kind='counter')
+    registry.callback('tempature_flushes_total', "BufferedWriter transactions", stat(writer, 'flushes'), kind='counter')
+    registry.callback('tempature_rows_buffered', "readings waiting for the next flush", stat(writer, 'rows_buffered'))
+    registry.callback('tempature_db_bytes', "size of the database and its write ahead log", lambda: file_size(args.database))
+    if retention is not None:
+        registry.callback('tempature_rows_pruned_total', "rows deleted by retention", kind='counter', labels=('table', ),
+                          fn=lambda: dict(((table, ), rows) for table, rows in retention.stats()['rows_pruned'].items()))
+        registry.callback('tempature_pages_vacuumed_total', "pages freed by incremental vacuum", stat(retention, 'pages_vacuumed'), kind='counter')
+    if archiver is not None:
+        registry.callback('tempature_rows_archived_total', "rows written to the day archive", stat(archiver, 'rows_archived'), kind='counter')
+        registry.callback('tempature_archive_bytes_total', "bytes written to the day archive", stat(archiver, 'bytes_written'), kind='counter')
+    if engine is not None:
+        rule_stat = lambda key: lambda: dict(((name, ), s[key]) for name, s in engine.stats().items())
+        registry.callback('tempature_rule_evaluations_total', "readings each rule was evaluated against", rule_stat('evaluations'), kind='counter', labels=('rule', ))
+        registry.callback('tempature_rule_fired_total', "times each rule switched on or off", rule_stat('fired'), kind='counter', labels=('rule', ))
+        registry.callback('tempature_rule_eval_seconds_max', "slowest evaluation of each rule", rule_stat('max_eval_time'), labels=('rule', ))
+        registry.callback('tempature_rule_eval_seconds_total', "time spent evaluating each rule", kind='counter', labels=('rule', ),
+                          fn=lambda: dict(((rule.name, ), rule.eval_time) for rule in engine.rules))
+    if reader is not None:
+        registry.callback('tempature_checksum_errors_total', "frames with a bad checksum", lambda: reader.checksum_errors, kind='counter')
+        registry.callback('tempature_short_frames_total', "IO sample frames too short for their header or samples", lambda: reader.decode_errors, kind='counter')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Log XBee tempature readings into the sqlite database")
+    parser.add_argument("-p", "--device", default=SERIALPORT, help="serial port of the XBee, or the pty printed by fakexbee.py replay")
+    parser.add_argument("-b", "--baudrate", type=int, default=BAUDRATE)
+    parser.add_argument("-d", "--database", default='tempature.db')
+    parser.add_argument("--capture", metavar="FILE", help="also record the raw API stream to FILE for replay with fakexbee.py")
+    parser.add_argument("--replay-speed", type=float, default=None,
+                        help="stamp readings on a clock running this many times faster, to match fakexbee.py replay --speed")
+    parser.add_argument("--fast-parser", action="store_true", help="decode IO sample frames with xbeeframe.py instead of python-xbee")
+    parser.add_argument("--escaped", action="store_true", help="the XBee is in API mode 2 (ATAP 2)")
+    parser.add_argument("--ring", metavar="FILE", default=None, help="share recent readings with the webserver through FILE (default: the database name with .ring), '' disables")
+    parser.add_argument("--archive", metavar="DIR", default=None, help="archive closed days into DIR (default: archive beside the database), '' disables")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every frame and reading instead of a summary line every --sample seconds")
+    parser.add_argument("--sample", type=float, default=SAMPLE_SECONDS, help="seconds between frame summary lines")
+    parser.add_argument("--rules", metavar="FILE", help="evaluate the rules in this JSON file against every reading, see rules.py")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics on this port, 0 disables")
+    parser.add_argument("--metrics-host", default=METRICS_HOST, help="address the metrics are served on, '' for every interface")
+    parser.add_argument("--keep-days", type=int, default=0,
+                        help="delete raw readings older than this many days, and old rollups as retention.py does, "
+                             "off by default.  While archiving (on by default) a day is only pruned once archived, without "
+                             "it that history is gone.  The file only "
+                             "shrinks after a one-off python retention.py --convert")
+    args = parser.parse_args()
+
+    # batched output, colorless when redirected to a log, see pretty.py
+    console = Console(level=DEBUG if args.verbose else INFO, sample=args.sample)
 
-conn=sqlite3.connect('tempature.db')
+    # the connection is only used by the persist thread, and by this one after it has stopped
+    conn=sqlite3.connect(args.database, check_same_thread=False)
+    migrate(conn)
 
-curs=conn.cursor()
+    writer = BufferedWriter(conn, max_rows=FLUSH_ROWS, max_age=FLUSH_SECONDS)
+    publisher = Publisher()
+    if args.ring is None:
+        args.ring = os.path.splitext(args.database)[0] + '.ring'
+    # only the persist thread appends, see ringbuf.py
+    ring = RingWriter(args.ring, log=console.warning) if args.ring else None
+    registry = metrics.Registry()
+    insert_latency = registry.histogram('tempature_insert_seconds', "time to insert one batch of readings and update the rollups")
+    commit_latency = registry.histogram('tempature_commit_seconds', "time to commit one batch")
+    engine = RulesEngine(load_rules(args.rules), sink=PrintSink(console.warning)) if args.rules else None
+    if args.archive is None:
+        args.archive = os.path.join(os.path.dirname(args.database), 'archive')
+    archiver = Archiver(conn, args.archive) if args.archive else None
+    if args.keep_days:
+        # raw readings of a day that has not been archived yet are kept until it is
+        retention = Retention(conn, path=args.database, keep_days={'tempature_log': args.keep_days},
+                              keep_from=Archive(args.archive).archived_until if archiver is not None else None)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            console.warning("retention: pruned pages are reused but the file will not shrink, "
+                            "stop the logger and run python retention.py --convert {0}".format(args.database))
+    else:
+        retention = None
 
-ser = serial.Serial(SERIALPORT, BAUDRATE)
+    ser = serial.Serial(args.device, args.baudrate)
+    if args.capture:
+        ser = RecordingSerial(ser, args.capture)
 
-xbee = XBee(ser)
-print 'Starting Up Tempature Monitor'
-# Continuously read and print packets
-while True:
+    if args.fast_parser:
+        xbee = FrameReader(ser, escaped=args.escaped)
+    else:
+        xbee = XBee(ser, escaped=args.escaped)
+    pipeline = IngestPipeline(xbee.wait_read_frame, decode_frame, persist_reading, maintain=flush_if_due, log=console.error,
+                              clock=replay_clock(args.replay_speed) if args.replay_speed else time.time)
+    if args.metrics_port:
+        register_metrics(registry, pipeline, xbee if args.fast_parser else None)
+        try:
+            metrics.serve(registry, args.metrics_port, args.metrics_host)
+        except socket.error as e:
+            # the metrics are not worth losing readings over
+            console.error("metrics: cannot serve on {0}:{1} ({2}), carrying on without them".format(
+                args.metrics_host, args.metrics_port, e))
+    console.info('Starting Up Tempature Monitor')
+    # Continuously read and print packets, the reader thread only drains the serial port
+    pipeline.start()
     try:
-        response = xbee.wait_read_frame()
-        print response
-        tempature = get_tempature(response['samples'], format="F")	
-		
-	#print our timestamp and tempature to standard_out
-	print "{0}, {1}".format(int(time.time()), tempature)
-	
-	#save the tempature to the databse
-	save_temp_reading(ROOM, tempature)
-	
+        last_stats = time.time()
+        while pipeline.running():
+            time.sleep(1)
+            if time.time() - last_stats >= STATS_SECONDS:
+                last_stats = time.time()
+                console.info("pipeline: {0}".format(pipeline))
+                if engine is not None:
+                    console.info("rules: {0}".format(engine.stats()))
     except KeyboardInterrupt:
-        break
-        
-ser.close()
+        pass
+    finally:
+        # stop reading, let the queued frames reach the writer, then flush it
+        pipeline.stop(release=ser.close)
+        console.info("pipeline: {0}".format(pipeline))
+        writer.close()
+        console.info("final: {0}".format(writer))
+        console.close()
+        conn.close()
+        publisher.close()
+        if ring is not None:
+            ring.close()
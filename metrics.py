@@ -0,0 +1,149 @@
+"""metrics.py collects counters and latency histograms and renders them for Prometheus
+
+    Both processes keep a Registry: the webserver serves it at /metrics, log_temp.py
+    with serve() on its own port (127.0.0.1:9101 by default).  Histograms are updated
+    as things happen, under a per metric lock, and should only be touched once per
+    flush, request or query, never per frame.  Counters and gauges are numbers the code
+    already keeps (the IngestPipeline counters, the database file size, ...), registered
+    with callback() and only read when /metrics is scraped, so they cost nothing in
+    between.
+
+    The output is the Prometheus text exposition format, version 0.0.4.
+"""
+
+import bisect
+import threading
+import BaseHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, for flushes, commits and requests on a Pi
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# rows returned by a query
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets and keeps their sum, per combination of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {}                # label values -> [count per bucket..., count above the last, sum]
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(counts)) for key, counts in self.values.items())
+        samples = []
+        for key, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                total += count
+                samples.append((self.name + '_bucket', _format_labels(self.labels, key, 'le="%s"' % _format_value(bound)), total))
+            samples.append((self.name + '_sum', _format_labels(self.labels, key), counts[-1]))
+            samples.append((self.name + '_count', _format_labels(self.labels, key), total))
+        return samples
+
+
+class Callback(object):
+    """A value read from fn() at scrape time.  fn returns a number, or a dict of label
+    values -> number when labels are given; None leaves the metric out."""
+
+    def __init__(self, name, help, fn, kind='gauge', labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not self.labels:
+            return [(self.name, '', value)]
+        return [(self.name, _format_labels(self.labels, key), v)
+                for key, v in sorted(value.items()) if v is not None]
+
+
+class Registry(object):
+    """The metrics of one process, in the order they were registered"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def callback(self, name, help, fn, kind='gauge', labels=()):
+        return self.register(Callback(name, help, fn, kind, labels))
+
+    def render(self):
+        """return every metric in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            lines.extend('%s%s %s' % (name, labels, _format_value(value)) for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def serve(registry, port, host='127.0.0.1'):
+    """Serve registry.render() at http://host:port/metrics from a daemon thread, returns the
+    server.  Raises socket.error when the port cannot be bound."""
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass                        # scrapes would otherwise fill the supervisord log
+
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,144 @@
+"""notify.py pushes new readings from log_temp.py to the webserver as they are logged
+
+    The logger sends every reading as a small JSON datagram to a UDP port on this
+    machine.  Sending never blocks and never fails the logger: if nothing is
+    listening the datagram is simply lost.  In the webserver one Broadcaster thread
+    receives the datagrams and hands each reading to every subscribed queue, so the
+    cost of a new reading does not depend on how many dashboards are open and nobody
+    polls sqlite.
+
+    Only one process can listen on the port.  Any other webserver process (a second
+    WSGI worker) fails to bind it, and its Broadcaster falls back to calling poll,
+    which returns the newest reading of every zone (from the ring buffer or the
+    LatestCache), every poll_interval seconds and passes on the readings that are new.
+"""
+
+import json
+import socket
+import threading
+import Queue
+
+NOTIFY_ADDR = ('127.0.0.1', 47474)
+
+
+class Publisher(object):
+    """Fire-and-forget sender used by the logger"""
+
+    def __init__(self, addr=NOTIFY_ADDR):
+        self.addr = addr
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.sent = 0
+        self.failed = 0
+
+    def publish(self, zone, timestamp, temp):
+        try:
+            self.sock.sendto(json.dumps({'zone': zone, 'timestamp': timestamp, 'tempature': temp}), self.addr)
+            self.sent += 1
+        except socket.error:
+            self.failed += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class Broadcaster(object):
+    """Receives readings from the logger and fans them out to subscriber queues
+
+    poll: -> {zone: (timestamp, tempature)}, read instead when the port is taken
+    log: called with a message when that happens"""
+
+    def __init__(self, addr=NOTIFY_ADDR, queue_size=100, poll=None, poll_interval=1.0, log=None):
+        self.addr = addr
+        self.queue_size = queue_size
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.log = log
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.mode = None                # 'listen' or 'poll' once started, 'off' with nothing to poll
+        self.received = 0
+        self.dropped = 0                # readings a slow subscriber had no room for
+
+    def start(self):
+        """Bind the port, or fall back to polling, and start the receiving thread, once"""
+        with self.lock:
+            if self.mode is not None:
+                return
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind(self.addr)
+            except socket.error as e:
+                sock.close()
+                self.mode = 'poll' if self.poll is not None else 'off'
+                if self.log is not None:
+                    self.log("notify: cannot listen on %s:%d (%s), %s" % (self.addr[0], self.addr[1], e,
+                             'polling for new readings' if self.poll is not None else 'no live readings in this process'))
+                if self.poll is None:
+                    return
+                # what is already there is not new, note it before subscribe() returns so a
+                # reading that lands before the thread first polls is still passed on
+                target, args = self._poll, (self._latest_timestamps(), )
+            else:
+                self.mode = 'listen'
+                target, args = self._run, (sock, )
+            self.thread = threading.Thread(target=target, args=args, name='notify-broadcaster')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self, sock):
+        while True:
+            data = sock.recv(4096)
+            try:
+                reading = json.loads(data)
+            except ValueError:
+                continue
+            self._send(reading)
+
+    def _read_poll(self):
+        try:
+            return self.poll()
+        except Exception:
+            return {}                   # the database or ring is not there yet, try again
+
+    def _latest_timestamps(self):
+        return dict((zone, timestamp) for zone, (timestamp, _) in self._read_poll().items())
+
+    def _poll(self, seen):
+        """seen: zone -> newest timestamp passed on"""
+        while not self.stopped.wait(self.poll_interval):
+            latest = self._read_poll()
+            for zone, (timestamp, temp) in sorted(latest.items()):
+                if zone not in seen or timestamp > seen[zone]:
+                    seen[zone] = timestamp
+                    self._send({'zone': zone, 'timestamp': timestamp, 'tempature': temp})
+
+    def stop(self):
+        """Stop polling and wait for the thread, a listening thread runs until the process exits"""
+        self.stopped.set()
+        if self.mode == 'poll':
+            self.thread.join()
+
+    def _send(self, reading):
+        self.received += 1
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(reading)
+            except Queue.Full:
+                self.dropped += 1
+
+    def subscribe(self):
+        """return a Queue that receives every new reading, starting the thread on first use"""
+        self.start()
+        q = Queue.Queue(self.queue_size)
+        with self.lock:
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
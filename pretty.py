@@ -19,6 +19,8 @@ http://nezzen.net/2008/06/23/colored-text-in-python-using-ansi-escape-sequences/
  
 # imported modules
 import sys
+import time
+import threading
  
 # authorship information
 __author__ = "Jeff Irland"
@@ -43,22 +45,135 @@ colorCodes = {
     'normal':   '0'
 }
  
+# Escape sequences are built once rather than on every call.  When stdout is not a terminal
+# (e.g. redirected to a log by supervisord) color is switched off so no escapes are written.
+RESET = "\033[0m"
+escapes = dict((name, "\033[" + code + "m") for name, code in colorCodes.items())
+useColor = sys.stdout.isatty()
+
+def setColor(enabled):
+    """Turn colored output on or off, by default it is on only when stdout is a terminal"""
+    global useColor
+    useColor = enabled
+
 def printc(text, color):
     """Print in color"""
-    print "\033["+colorCodes[color]+"m"+text+"\033[0m"
+    print stringc(text, color)
  
 def writec(text, color):
     """Write to stdout in color"""
-    sys.stdout.write("\033["+colorCodes[color]+"m"+text+"\033[0m")
+    sys.stdout.write(stringc(text, color))
  
 def switchColor(color):
     """Switch terminal color"""
-    sys.stdout.write("\033["+colorCodes[color]+"m")
+    if useColor:
+        sys.stdout.write(escapes[color])
  
 def stringc(text, color):
     """Return a string with ANSI escape sequences to color text"""
-    return "\033["+colorCodes[color]+"m"+text+"\033[0m"
- 
+    if not useColor:
+        return text
+    return escapes[color] + text + RESET
+
+# Log levels for Console
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+levelNames = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+class Console(object):
+    """Buffered, thread safe console output with log levels and sampled frame lines
+
+    Lines are collected in memory and written to the stream in one write once size bytes
+    are waiting, by a background thread at most interval seconds after they were queued,
+    or on flush().  Colors follow setColor().  level is a number or a name in levelNames.
+    frame() prints every frame at DEBUG level, otherwise one summary line per every
+    frames or per sample seconds, whichever comes first."""
+
+    def __init__(self, stream=None, level=INFO, size=4096, interval=1.0,
+                 sample=5.0, every=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.level = levelNames.get(level, level)
+        self.size = size
+        self.interval = interval
+        self.sample = sample
+        self.every = every
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        self.closed = threading.Event()
+        self.flusher = None             # started with the first buffered line
+
+        self.frames = 0                 # frames seen since the last summary line
+        self.lastSample = time.time()
+        self.totalFrames = 0
+        self.writes = 0
+
+    def line(self, text, color=None, level=INFO):
+        """Queue one line of text"""
+        if level < self.level:
+            return
+        if color is not None:
+            text = stringc(text, color)
+        with self.lock:
+            self.buffer.append(text + '\n')
+            self.buffered += len(text) + 1
+            if self.buffered >= self.size:
+                self._flush()
+            elif self.flusher is None:
+                self.flusher = threading.Thread(target=self._flushEvery, name='console-flush')
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def debug(self, text, color=None):
+        self.line(text, color, DEBUG)
+
+    def info(self, text, color=None):
+        self.line(text, color, INFO)
+
+    def warning(self, text, color='bright yellow'):
+        self.line(text, color, WARNING)
+
+    def error(self, text, color='bright red'):
+        self.line(text, color, ERROR)
+
+    def frame(self, frame, color=None):
+        """Count a frame, printing it or a periodic summary of the frames"""
+        self.totalFrames += 1
+        if self.level <= DEBUG:
+            self.line(str(frame), color, DEBUG)
+            return
+        self.frames += 1
+        now = time.time()
+        if (self.every is not None and self.frames >= self.every) or \
+                (self.sample is not None and now - self.lastSample >= self.sample):
+            self.line("%d frames in %.1fs, last: %s" % (self.frames, now - self.lastSample, frame), color, INFO)
+            self.frames = 0
+            self.lastSample = now
+
+    def flush(self):
+        """Write everything waiting"""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Write everything waiting and stop the background thread"""
+        self.closed.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+
+    def _flushEvery(self):
+        # Event.wait returns False on timeout, True once close() has been called
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.stream.flush()
+            self.writes += 1
+            self.buffer = []
+            self.buffered = 0
+
 # Simple test routine to validate thing are working correctly
 if __name__ == '__main__':
     printc("Welcome to the pretty.py test routine!", 'white')
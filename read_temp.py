@@ -1,5 +1,6 @@
 import serial, time, datetime, sys
 from xbee import XBee
+from pretty import Console, DEBUG
 
 SERIALPORT = "/dev/ttyAMA0"    # the com/serial port the XBee is connected to
 BAUDRATE = 38400      # the baud rate we talk to the xbee
@@ -8,12 +9,13 @@ TEMPSENSE = 0       # which XBee ADC has current draw data
 ser = serial.Serial(SERIALPORT, BAUDRATE)
 
 xbee = XBee(ser)
-print 'Starting Up Tempature Monitor'
+console = Console(level=DEBUG)  # every frame, written in batches at most a second late, see pretty.py
+console.info('Starting Up Tempature Monitor')
 # Continuously read and print packets
 while True:
     try:
         response = xbee.wait_read_frame()
-        print response
+        console.frame(response)
 
 	
 #	test = xbee.find_packet()
@@ -21,4 +23,5 @@ while True:
     except KeyboardInterrupt:
         break
         
+console.close()
 ser.close()
@@ -0,0 +1,207 @@
+"""retention.py keeps tempature.db from growing forever on the Pi's SD card
+
+    Raw readings are kept for KEEP_DAYS['tempature_log'] days and each rollup table for
+    its own, longer, period (see rollups.py), so old history is still charted from the
+    summaries after the raw samples are gone.  Rows are deleted BATCH_ROWS at a time,
+    each batch its own short transaction, so log_temp.py can call step() from its
+    persist thread between readings without holding up the writer.  Once nothing is
+    left to prune, freed pages are handed back to the filesystem VACUUM_PAGES at a
+    time with PRAGMA incremental_vacuum.
+
+    New databases are created with auto_vacuum=INCREMENTAL (see schema.py).  An existing
+    database needs one full VACUUM to switch, run: python retention.py --convert tempature.db
+    Until then the incremental vacuum does nothing, freed pages are reused for new rows
+    but the file never shrinks.
+
+    Nothing is pruned unless asked: log_temp.py only runs retention with --keep-days.
+    The webserver skips a rollup table for windows older than its oldest remaining
+    bucket (see rollups.kept) and reads raw history from the day archive, see archive.py.
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+# table -> (time column, days kept), None keeps the table forever
+KEEP_DAYS = {
+    'tempature_log': ('timestamp', 30),
+    'tempature_rollup_1m': ('bucket', 90),
+    'tempature_rollup_1h': ('bucket', 365*2),
+    'tempature_rollup_1d': ('bucket', None),
+}
+
+BATCH_ROWS = 500        # rows deleted per transaction
+VACUUM_PAGES = 256      # pages released per incremental vacuum step
+INTERVAL = 60*60        # seconds between retention passes in log_temp.py
+
+
+def enable_incremental_vacuum(conn):
+    """Switch a database to auto_vacuum=INCREMENTAL, rewriting it with VACUUM if it already has tables"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None         # VACUUM cannot run inside a transaction
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def file_size(path):
+    """bytes used by the database and its write ahead log"""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+class Retention(object):
+    """Prunes expired rows a batch at a time, then vacuums incrementally"""
+
+    def __init__(self, conn, path=None, keep_days=None, batch_rows=BATCH_ROWS,
+                 vacuum_pages=VACUUM_PAGES, interval=INTERVAL, keep_from=None):
+        self.conn = conn
+        self.path = path                # only used to report the file size
+        self.keep_from = keep_from      # zone -> timestamp its raw readings are kept from whatever their age
+        self.keep_days = dict(KEEP_DAYS)
+        for table, days in (keep_days or {}).items():
+            self.keep_days[table] = (self.keep_days[table][0], days)
+        self.batch_rows = batch_rows
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+        self.pending = []               # (table, column, cutoff, room) still to prune this pass
+        self.vacuuming = False
+        self.last_pass = None           # time the last pass finished
+
+        self.rows_pruned = dict((table, 0) for table in self.keep_days)
+        self.pages_vacuumed = 0
+        self.prune_time = 0.0           # total seconds spent inside delete transactions
+        self.passes = 0
+        self.page_count = None          # as of the end of the last pass
+        self.freelist_count = None
+
+    def due(self):
+        """True while a pass is under way or when the next one should start"""
+        return bool(self.pending) or self.vacuuming or \
+            self.last_pass is None or time.time() - self.last_pass >= self.interval
+
+    def start_pass(self, now=None):
+        """Work out what to prune, one entry per table and zone"""
+        if now is None:
+            now = int(time.time())
+        # every zone has a row in the day rollup, which is tiny, so get the zones from it
+        rooms = [row[0] for row in self.conn.execute("SELECT DISTINCT room FROM tempature_rollup_1d")]
+        self.pending = []
+        for table, (column, days) in sorted(self.keep_days.items()):
+            if days is None:
+                continue
+            for room in rooms:
+                cutoff = now - days*60*60*24
+                if table == 'tempature_log' and self.keep_from is not None:
+                    cutoff = min(cutoff, self.keep_from(room))
+                self.pending.append((table, column, cutoff, room))
+        self.vacuuming = True
+
+    def step(self):
+        """Do one small unit of work: delete a batch, or vacuum a few pages.  Returns the
+        rows deleted or pages freed, 0 when the pass is over."""
+        if not self.pending and not self.vacuuming:
+            self.start_pass()
+        while self.pending:
+            done = self._prune_batch(*self.pending[0])
+            if done:
+                return done
+            self.pending.pop(0)
+        if self.vacuuming:
+            freed = self._vacuum()
+            if freed:
+                return freed
+            self.vacuuming = False
+            self.last_pass = time.time()
+            self.passes += 1
+            self.page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            self.freelist_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return 0
+
+    def run(self, now=None):
+        """Run a whole pass, returns the number of rows pruned"""
+        before = sum(self.rows_pruned.values())
+        self.start_pass(now)
+        while self.step():
+            pass
+        return sum(self.rows_pruned.values()) - before
+
+    def _prune_batch(self, table, column, cutoff, room):
+        # walk the (room, time) primary key to find where this batch ends, so the delete
+        # touches at most batch_rows rows and never scans the table
+        start = time.time()
+        with self.conn:
+            row = self.conn.execute("SELECT {0} FROM {1} WHERE room = ? AND {0} < ? ORDER BY {0} LIMIT 1 OFFSET ?".format(column, table),
+                                    (room, cutoff, self.batch_rows)).fetchone()
+            upto = cutoff if row is None else row[0]
+            deleted = self.conn.execute("DELETE FROM {1} WHERE room = ? AND {0} < ?".format(column, table),
+                                        (room, upto)).rowcount
+        self.prune_time += time.time() - start
+        self.rows_pruned[table] += deleted
+        return deleted
+
+    def _vacuum(self):
+        free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free or self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        self.conn.execute("PRAGMA incremental_vacuum(%d)" % self.vacuum_pages).fetchall()
+        self.conn.commit()
+        freed = free - self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.pages_vacuumed += freed
+        return freed
+
+    def stats(self):
+        """return a dict of counters describing retention, safe to call from any thread"""
+        stats = {
+            'rows_pruned': dict(self.rows_pruned),
+            'pages_vacuumed': self.pages_vacuumed,
+            'prune_time': self.prune_time,
+            'passes': self.passes,
+            'page_count': self.page_count,
+            'freelist_count': self.freelist_count,
+        }
+        if self.path is not None:
+            stats['file_bytes'] = file_size(self.path)
+        return stats
+
+    def __str__(self):
+        s = self.stats()
+        return "pruned={0} vacuumed={1} pages={2} free={3} bytes={4}".format(
+            sum(s['rows_pruned'].values()), s['pages_vacuumed'], s['page_count'],
+            s['freelist_count'], s.get('file_bytes', '?'))
+
+
+if __name__ == '__main__':
+    import schema
+    parser = argparse.ArgumentParser(description="Prune expired readings from tempature.db and vacuum it",
+                                     epilog="Deletes for good, run archive.py first to keep raw history.  Without --convert a "
+                                            "database created before retention existed keeps its size, the freed pages are "
+                                            "only reused.")
+    parser.add_argument("database", nargs="?", default='tempature.db')
+    parser.add_argument("--raw-days", type=int, default=KEEP_DAYS['tempature_log'][1], help="days of raw readings to keep")
+    parser.add_argument("--minute-days", type=int, default=KEEP_DAYS['tempature_rollup_1m'][1], help="days of 1 minute rollups to keep")
+    parser.add_argument("--hour-days", type=int, default=KEEP_DAYS['tempature_rollup_1h'][1], help="days of 1 hour rollups to keep")
+    parser.add_argument("--convert", action="store_true", help="switch the database to incremental vacuum first, needed once for a database created "
+                        "before retention.py or the file never shrinks (rewrites the whole file, stop log_temp.py first)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    schema.migrate(conn)
+    if args.convert:
+        enable_incremental_vacuum(conn)
+    retention = Retention(conn, path=args.database, keep_days={
+        'tempature_log': args.raw_days,
+        'tempature_rollup_1m': args.minute_days,
+        'tempature_rollup_1h': args.hour_days,
+    })
+    print "before: {0}".format(retention)
+    retention.run()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")     # so the size below is the file's real size
+    print "after: {0}".format(retention)
+    for table, rows in sorted(retention.stats()['rows_pruned'].items()):
+        print "  {0:<22} {1:>10} rows pruned".format(table, rows)
+    conn.close()
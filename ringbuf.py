@@ -0,0 +1,289 @@
+"""ringbuf.py shares the most recent readings of every zone through a memory-mapped file
+
+    log_temp.py appends every reading to a fixed size ring per zone in tempature.ring
+    as well as to sqlite.  Webserver processes map the same file read-only and answer
+    the current tempature and recent /get_temps windows from it, so any number of
+    WSGI workers can serve the last day without queueing on the database.
+
+    Layout, all little endian:
+
+        header      magic 'TRING1', capacity, max zones, zones in use     (64 bytes)
+        directory   max zones x 32 byte zone names
+        zone i      readings appended so far (uint64), then capacity slots of
+                    (timestamp int64, tempature float64)
+
+    There is exactly one writer.  It fills the slot first and then bumps the zone's
+    count, so readers never need a lock: a reader notes the count, copies the slots,
+    then reads the count again and drops any slot the writer may have reused while it
+    was copying.  A new zone's name is written before the zones-in-use field.
+
+    A file holds at most max_zones zones.  Once they are all taken the writer logs and
+    skips any further zone, and the webserver answers for zones the ring does not hold,
+    or for every zone at once, from sqlite instead (see RingReader.full).
+"""
+
+import os
+import mmap
+import bisect
+import struct
+import itertools
+
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, fall back to pure python
+    np = None
+
+MAGIC = 'TRING1\0\0'
+CAPACITY = 1 << 15      # readings kept per zone, a day at one reading every 2.6 seconds
+MAX_ZONES = 16
+NAME_SIZE = 32
+
+_HEADER = struct.Struct('<8sIII')
+_COUNT = struct.Struct('<Q')
+_SLOT = struct.Struct('<qd')
+HEADER_SIZE = 64
+
+if np is not None:
+    SLOT_DTYPE = np.dtype([('t', '<i8'), ('y', '<f8')])
+
+
+def _zone_offset(i, capacity, max_zones):
+    return HEADER_SIZE + max_zones * NAME_SIZE + i * (_COUNT.size + capacity * _SLOT.size)
+
+
+def _file_size(capacity, max_zones):
+    return _zone_offset(max_zones, capacity, max_zones)
+
+
+class RingWriter(object):
+    """The logger's side, a single thread appends readings"""
+
+    def __init__(self, path, capacity=CAPACITY, max_zones=MAX_ZONES, log=None):
+        size = _file_size(capacity, max_zones)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            header = os.read(fd, _HEADER.size)
+            if len(header) < _HEADER.size or _HEADER.unpack(header)[:3] != (MAGIC, capacity, max_zones):
+                # new file, or one laid out differently: start again
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, _HEADER.pack(MAGIC, capacity, max_zones, 0))
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        self.max_zones = max_zones
+        self.zones = {}                 # name -> (offset, readings appended so far)
+        for i, name in enumerate(_read_directory(self.map, max_zones)):
+            offset = _zone_offset(i, capacity, max_zones)
+            self.zones[name] = [offset, _COUNT.unpack_from(self.map, offset)[0]]
+        self.log = log                  # told once about each zone that does not fit
+        self.overflow = set()           # zones that did not fit in the file
+        self.dropped = 0                # their readings
+
+    def append(self, zone, timestamp, temp):
+        entry = self.zones.get(zone)
+        if entry is None:
+            entry = self._add_zone(zone)
+            if entry is None:
+                self.dropped += 1
+                if zone not in self.overflow:
+                    self.overflow.add(zone)
+                    if self.log is not None:
+                        self.log("ring: no room for zone %s, all %d are taken, the webserver reads it from sqlite"
+                                 % (zone, self.max_zones))
+                return
+        offset, count = entry
+        _SLOT.pack_into(self.map, offset + _COUNT.size + (count % self.capacity) * _SLOT.size, timestamp, temp)
+        entry[1] = count + 1
+        _COUNT.pack_into(self.map, offset, count + 1)     # publishes the slot
+
+    def _add_zone(self, zone):
+        i = len(self.zones)
+        if i >= self.max_zones:
+            return None
+        self.map[HEADER_SIZE + i * NAME_SIZE:HEADER_SIZE + (i + 1) * NAME_SIZE] = zone[:NAME_SIZE].ljust(NAME_SIZE, '\0')
+        offset = _zone_offset(i, self.capacity, self.max_zones)
+        _COUNT.pack_into(self.map, offset, 0)
+        struct.pack_into('<I', self.map, _HEADER.size - 4, i + 1)
+        entry = self.zones[zone] = [offset, 0]
+        return entry
+
+    def close(self):
+        self.map.close()
+
+
+def _read_directory(buf, max_zones):
+    zones = struct.unpack_from('<I', buf, _HEADER.size - 4)[0]
+    return [str(buf[HEADER_SIZE + i * NAME_SIZE:HEADER_SIZE + (i + 1) * NAME_SIZE]).rstrip('\0')
+            for i in range(min(zones, max_zones))]
+
+
+class _Timestamps(object):
+    """The timestamps a zone holds, oldest first, read from the map on access so bisect
+    can search them without copying the ring"""
+
+    __slots__ = ('map', 'base', 'first', 'held', 'capacity')
+
+    def __init__(self, buf, base, count, capacity):
+        self.map = buf
+        self.base = base
+        self.first = count - min(count, capacity)
+        self.held = min(count, capacity)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.held
+
+    def __getitem__(self, i):
+        return _SLOT.unpack_from(self.map, self.base + ((self.first + i) % self.capacity) * _SLOT.size)[0]
+
+
+class RingReader(object):
+    """A webserver process's read-only view of the rings"""
+
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, self.capacity, self.max_zones, _ = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or len(self.map) < _file_size(self.capacity, self.max_zones):
+            self.map.close()
+            raise ValueError("%s is not a reading ring buffer" % path)
+        self.offsets = {}
+
+    def zones(self):
+        """return the names of the zones in the file"""
+        names = _read_directory(self.map, self.max_zones)
+        if len(names) != len(self.offsets):
+            self.offsets = dict((name, _zone_offset(i, self.capacity, self.max_zones)) for i, name in enumerate(names))
+        return names
+
+    def _offset(self, zone):
+        if zone not in self.offsets:
+            self.zones()
+        return self.offsets.get(zone)
+
+    def _timestamps(self, offset, count):
+        return _Timestamps(self.map, offset + _COUNT.size, count, self.capacity)
+
+    def readings(self, zone, start=None, end=None, inclusive=False):
+        """return (timestamps, tempatures) of the readings of zone after start (from start if
+        inclusive) up to end, every reading held by default, oldest first and one per second
+        like tempature_log, as numpy arrays when numpy is installed
+
+        Only the slots in the window are copied out of the map."""
+        offset = self._offset(zone)
+        if offset is None:
+            return ([], []) if np is None else (np.empty(0, int), np.empty(0, float))
+        count = _COUNT.unpack_from(self.map, offset)[0]
+        held = min(count, self.capacity)
+        timestamps = self._timestamps(offset, count)
+        lo = 0 if start is None else (bisect.bisect_left if inclusive else bisect.bisect_right)(timestamps, start)
+        hi = held if end is None else bisect.bisect_right(timestamps, end)
+        if hi < lo:
+            hi = lo                     # the writer wrapped onto the slots being searched
+        # the window as up to two runs of physical slots
+        first = (count - held + lo) % self.capacity
+        runs = [(first, min(first + hi - lo, self.capacity))]
+        if first + hi - lo > self.capacity:
+            runs.append((0, first + hi - lo - self.capacity))
+        base = offset + _COUNT.size
+        if np is not None:
+            slots = np.frombuffer(self.map, SLOT_DTYPE, self.capacity, base)
+            data = np.concatenate([slots[a:b] for a, b in runs])
+        else:
+            data = []
+            for a, b in runs:
+                values = struct.unpack_from('<' + 'qd' * (b - a), self.map, base + a * _SLOT.size)
+                data.extend(zip(values[0::2], values[1::2]))
+        # anything the writer has since wrapped round onto was overwritten while copying
+        overwritten = _COUNT.unpack_from(self.map, offset)[0] - self.capacity - (count - held + lo)
+        if overwritten > 0:
+            data = data[overwritten:]
+        if np is not None:
+            t, y = data['t'], data['y']
+            keep = np.append(True, t[1:] != t[:-1])[:len(t)]   # the first reading of each second wins, as in sqlite
+            return t[keep], y[keep]
+        t, y = [], []
+        for timestamp, temp in data:
+            if not t or t[-1] != timestamp:
+                t.append(timestamp)
+                y.append(temp)
+        return t, y
+
+    def oldest(self, zone):
+        """the timestamp of the oldest reading held for zone, None if there is none"""
+        offset = self._offset(zone)
+        count = _COUNT.unpack_from(self.map, offset)[0] if offset is not None else 0
+        if not count:
+            return None
+        # if the writer overwrites this slot meanwhile the answer is only ever too new
+        slot = count % self.capacity if count > self.capacity else 0
+        return _SLOT.unpack_from(self.map, offset + _COUNT.size + slot * _SLOT.size)[0]
+
+    def newest(self, zone, end=None):
+        """the timestamp of the newest reading of zone at or before end, None if there is none"""
+        if end is None:
+            return self.latest().get(zone, (None, ))[0]
+        offset = self._offset(zone)
+        if offset is None:
+            return None
+        count = _COUNT.unpack_from(self.map, offset)[0]
+        timestamps = self._timestamps(offset, count)
+        i = bisect.bisect_right(timestamps, end)
+        return timestamps[i - 1] if i else None
+
+    def full(self):
+        """True when every zone slot is taken, so the logger may have zones the ring does not hold"""
+        return len(self.zones()) >= self.max_zones
+
+    def latest(self):
+        """return {zone: (timestamp, tempature)} with the newest reading of every zone"""
+        latest = {}
+        for zone in self.zones():
+            offset = self.offsets[zone]
+            count = _COUNT.unpack_from(self.map, offset)[0]
+            if count:
+                t, y = _SLOT.unpack_from(self.map, offset + _COUNT.size + ((count - 1) % self.capacity) * _SLOT.size)
+                latest[zone] = (t, y)
+        return latest
+
+    def covers(self, start, zone=None):
+        """True if the ring holds every reading after start (of zone, or of every zone)"""
+        zones = [zone] if zone is not None else self.zones()
+        if not zones or (zone is None and self.full()):
+            return False
+        for z in zones:
+            oldest = self.oldest(z)
+            if oldest is None or oldest > start:
+                return False
+        return True
+
+    def window(self, zone, start, end, inclusive=False):
+        """return the (timestamps, tempatures) of zone after start (from start if inclusive) up to end"""
+        return self.readings(zone, start, end, inclusive)
+
+    def close(self):
+        self.map.close()
+
+
+def bucketize(t, y, bucket, agg='avg', offset=0):
+    """Group readings into buckets of bucket seconds aligned offset seconds from UTC, like
+    query_temps does in sqlite.  Returns [(bucket start + offset, aggregate), ...]"""
+    if not len(t):
+        return []
+    if np is not None and isinstance(t, np.ndarray):
+        keys = (t + offset) - (t + offset) % bucket
+        edges = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        if agg == 'avg':
+            values = np.add.reduceat(y, edges) / np.diff(np.append(edges, len(y)))
+        else:
+            values = (np.minimum if agg == 'min' else np.maximum).reduceat(y, edges)
+        return zip(keys[edges].tolist(), values.tolist())
+    fn = {'avg': lambda v: sum(v) / float(len(v)), 'min': min, 'max': max}[agg]
+    return [(key, fn([v for _, v in group]))
+            for key, group in itertools.groupby(itertools.izip(t, y), key=lambda p: (p[0] + offset) - (p[0] + offset) % bucket)]
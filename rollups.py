@@ -0,0 +1,116 @@
+"""rollups.py keeps min/max/avg/count summaries of tempature_log at several resolutions
+
+    Every flush of raw readings also updates one row per (room, bucket) in each rollup
+    table, so charting a week, month or year reads a few hundred summary rows instead
+    of every raw sample.  The average is stored as total/count so buckets can be
+    updated incrementally.
+
+    retention.py may prune the finer tables sooner than the coarse ones, so a window
+    reaching back further than a table's oldest bucket is never read from it.
+"""
+
+# (table, seconds per bucket), finest first
+RESOLUTIONS = [
+    ('tempature_rollup_1m', 60),
+    ('tempature_rollup_1h', 60*60),
+    ('tempature_rollup_1d', 60*60*24),
+]
+
+DAY = 60*60*24
+
+# a chart needs at least this many points before a coarser resolution is used
+MIN_POINTS = 100
+
+# agg -> (SQL aggregate over tempature_log, SQL aggregate over a rollup table)
+AGGREGATES = {
+    'avg': ('avg(tempature)', 'sum(total) / sum(count)'),
+    'min': ('min(tempature)', 'min(min)'),
+    'max': ('max(tempature)', 'max(max)'),
+}
+
+
+def create_tables(conn):
+    """Create the rollup tables and fill them from whatever is already in tempature_log"""
+    for table, seconds in RESOLUTIONS:
+        conn.execute("""CREATE TABLE IF NOT EXISTS %s(
+bucket INT NOT NULL,
+room TEXT NOT NULL,
+min REAL NOT NULL,
+max REAL NOT NULL,
+total REAL NOT NULL,
+count INT NOT NULL,
+PRIMARY KEY (room, bucket))""" % table)
+        conn.execute("""INSERT OR REPLACE INTO %s
+SELECT timestamp - timestamp %% %d, room, min(tempature), max(tempature), sum(tempature), count(*)
+FROM tempature_log GROUP BY 1, 2""" % (table, seconds))
+
+
+def update(conn, rows):
+    """Fold (timestamp, room, tempature) rows into every rollup table
+
+    Rows are summarised per bucket in python first so a batch costs two statements
+    per touched bucket rather than two per reading.  Call inside the transaction that
+    inserts the raw rows."""
+    for table, seconds in RESOLUTIONS:
+        buckets = {}
+        for timestamp, room, temp in rows:
+            key = (timestamp - timestamp % seconds, room)
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [temp, temp, temp, 1]
+            else:
+                b[0] = min(b[0], temp)
+                b[1] = max(b[1], temp)
+                b[2] += temp
+                b[3] += 1
+
+        conn.executemany("INSERT OR IGNORE INTO %s VALUES (?, ?, ?, ?, 0, 0)" % table,
+                         [(bucket, room, b[0], b[1]) for (bucket, room), b in buckets.iteritems()])
+        conn.executemany("""UPDATE %s SET min = min(min, ?), max = max(max, ?), total = total + ?, count = count + ?
+WHERE room = ? AND bucket = ?""" % table,
+                         [(b[0], b[1], b[2], b[3], room, bucket) for (bucket, room), b in buckets.iteritems()])
+
+
+def oldest_buckets(conn):
+    """return {table: its oldest bucket, None when it is empty} for every rollup table"""
+    # one indexed lookup per zone and table, min(bucket) over a whole table would scan it
+    rooms = [row[0] for row in conn.execute("SELECT DISTINCT room FROM %s" % RESOLUTIONS[-1][0])]
+    oldest = {}
+    for table, seconds in RESOLUTIONS:
+        firsts = [conn.execute("SELECT min(bucket) FROM %s WHERE room = ?" % table, (room, )).fetchone()[0]
+                  for room in rooms]
+        firsts = [first for first in firsts if first is not None]
+        oldest[table] = min(firsts) if firsts else None
+    return oldest
+
+
+def kept(table, start, oldest=None):
+    """True if table still holds every bucket from start, going by oldest as returned by
+    oldest_buckets(), or if nothing was ever pruned from it"""
+    if start is None or oldest is None:
+        return True
+    first, everything = oldest.get(table), oldest.get(RESOLUTIONS[-1][0])
+    if first is None:
+        return everything is None
+    return first <= start or first - first % DAY <= everything
+
+
+def pick_resolution(span, min_points=MIN_POINTS, start=None, oldest=None):
+    """return the (table, seconds) of the coarsest rollup giving at least min_points
+    buckets over span seconds and still holding the rows from start (see kept), or
+    (None, None) when raw readings should be used"""
+    for table, seconds in reversed(RESOLUTIONS):
+        if span / float(seconds) >= min_points and kept(table, start, oldest):
+            return table, seconds
+    return None, None
+
+
+def pick_table(bucket, offset=0, start=None, oldest=None):
+    """return the (table, seconds) of the coarsest rollup whose buckets fit exactly into
+    buckets of bucket seconds aligned offset seconds from UTC midnight and which still
+    holds the rows from start, or (None, None) when they can only be built from raw
+    readings"""
+    for table, seconds in reversed(RESOLUTIONS):
+        if bucket % seconds == 0 and offset % seconds == 0 and kept(table, start, oldest):
+            return table, seconds
+    return None, None
@@ -0,0 +1,194 @@
+"""rules.py turns readings into thermostat actions as they are logged
+
+    A Rule watches one zone (or every zone) and switches on and off with hysteresis:
+    an 'above' rule turns on when the value reaches on and off again only once it
+    has fallen to off, so a tempature hovering at the threshold does not flap.  The
+    value is the latest reading, the moving average over window seconds, or the rate
+    of change in degrees per hour over window seconds.  A rule can be limited to some
+    hours of the (local) day, outside them it turns off.
+
+    The RulesEngine keeps one RollingWindow per zone and window length, updated in
+    O(1) per reading, and an index from zone to the rules watching it, so a reading
+    only evaluates the rules of its own zone.  Every change of a rule's state is sent
+    to the sink as an Action.  The sink is anything with emit(action); PrintSink just
+    prints, a real one would drive the thermostat.
+
+    Rules are loaded from a JSON list, for example:
+
+        [{"name": "cool bedroom", "zone": "Room1", "when": "above", "on": 78, "off": 76,
+          "value": "avg", "window": 600, "hours": [22, 7], "action": "cool"}]
+"""
+
+import json
+import time
+from collections import deque, namedtuple
+
+Action = namedtuple('Action', 'rule zone timestamp action state value')
+
+VALUES = ('last', 'avg', 'rate')
+
+
+class RollingWindow(object):
+    """The readings of the last seconds seconds with their running sum"""
+
+    __slots__ = ('seconds', 'points', 'total')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.points = deque()
+        self.total = 0.0
+
+    def add(self, timestamp, value):
+        points = self.points
+        points.append((timestamp, value))
+        self.total += value
+        cutoff = timestamp - self.seconds
+        while len(points) > 1 and points[0][0] <= cutoff:
+            self.total -= points.popleft()[1]
+        if len(points) == 1:
+            self.total = points[0][1]   # do not let rounding errors build up forever
+
+    def last(self):
+        return self.points[-1][1]
+
+    def avg(self):
+        return self.total / len(self.points)
+
+    def rate(self):
+        """degrees per hour between the oldest and newest readings in the window"""
+        (t0, v0), (t1, v1) = self.points[0], self.points[-1]
+        return (v1 - v0) * 3600.0 / (t1 - t0) if t1 > t0 else 0.0
+
+
+class Rule(object):
+    """A hysteresis switch over one value of a zone's readings"""
+
+    def __init__(self, name, zone=None, when='above', on=None, off=None, value='last', window=300,
+                 hours=None, action=None):
+        if when not in ('above', 'below'):
+            raise ValueError("rule %r: when must be 'above' or 'below'" % name)
+        if value not in VALUES:
+            raise ValueError("rule %r: value must be one of %s" % (name, ', '.join(VALUES)))
+        if on is None:
+            raise ValueError("rule %r needs an 'on' threshold" % name)
+        self.name = name
+        self.zone = zone                # None watches every zone
+        self.when = when
+        self.on = on
+        self.off = on if off is None else off
+        self.value = value
+        self.window = window if value != 'last' else 0
+        self.hours = hours              # (from, to) local hours, may wrap past midnight
+        self.action = action or name
+        self.active = {}                # zone -> bool
+
+        self.evaluations = 0
+        self.fired = 0
+        self.eval_time = 0.0            # total seconds spent in evaluate
+        self.max_eval_time = 0.0
+
+    def in_hours(self, timestamp):
+        if self.hours is None:
+            return True
+        start, end = self.hours
+        hour = time.localtime(timestamp).tm_hour
+        return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+    def evaluate(self, zone, timestamp, window):
+        """return the new state if it changed, else None"""
+        value = getattr(window, self.value)()
+        active = self.active.get(zone, False)
+        if not self.in_hours(timestamp):
+            state = False
+        elif self.when == 'above':
+            state = value >= self.on if not active else value > self.off
+        else:
+            state = value <= self.on if not active else value < self.off
+        if state == active:
+            return None
+        self.active[zone] = state
+        return state, value
+
+    def stats(self):
+        return {
+            'evaluations': self.evaluations,
+            'fired': self.fired,
+            'avg_eval_time': self.eval_time / self.evaluations if self.evaluations else 0.0,
+            'max_eval_time': self.max_eval_time,
+            'active': sorted(zone for zone, active in self.active.items() if active),
+        }
+
+
+class PrintSink(object):
+    """Stand-in for a thermostat, prints every action, or hands the line to out"""
+
+    def __init__(self, out=None):
+        self.out = out
+
+    def emit(self, action):
+        line = "rule {0.rule}: {0.action} {1} in {0.zone} at {0.timestamp} (value {0.value:.2f})".format(
+            action, 'on' if action.state else 'off')
+        if self.out is not None:
+            self.out(line)
+        else:
+            print line
+
+
+class RulesEngine(object):
+    """Evaluates the rules affected by each reading and sends state changes to sink"""
+
+    def __init__(self, rules=(), sink=None):
+        self.sink = sink if sink is not None else PrintSink()
+        self.rules = []
+        self.by_zone = {}               # zone -> rules watching it, None -> rules watching every zone
+        self.windows = {}               # (zone, seconds) -> RollingWindow
+        self.readings = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        self.rules.append(rule)
+        self.by_zone.setdefault(rule.zone, []).append(rule)
+
+    def _window(self, zone, seconds):
+        window = self.windows.get((zone, seconds))
+        if window is None:
+            window = self.windows[(zone, seconds)] = RollingWindow(seconds)
+        return window
+
+    def evaluate(self, zone, timestamp, temp):
+        """feed one reading, returns the actions it caused"""
+        self.readings += 1
+        rules = self.by_zone.get(zone, []) + self.by_zone.get(None, [])
+        if not rules:
+            return []
+        # update every window these rules read, once, before any rule looks at them
+        windows = {}
+        for rule in rules:
+            if rule.window not in windows:
+                windows[rule.window] = self._window(zone, rule.window)
+                windows[rule.window].add(timestamp, temp)
+        actions = []
+        for rule in rules:
+            start = time.time()
+            changed = rule.evaluate(zone, timestamp, windows[rule.window])
+            elapsed = time.time() - start
+            rule.evaluations += 1
+            rule.eval_time += elapsed
+            if elapsed > rule.max_eval_time:
+                rule.max_eval_time = elapsed
+            if changed is not None:
+                rule.fired += 1
+                action = Action(rule.name, zone, timestamp, rule.action, changed[0], changed[1])
+                actions.append(action)
+                self.sink.emit(action)
+        return actions
+
+    def stats(self):
+        return dict((rule.name, rule.stats()) for rule in self.rules)
+
+
+def load_rules(path):
+    """return the Rules described in a JSON file"""
+    with open(path) as f:
+        return [Rule(**dict((str(k), v) for k, v in spec.items())) for spec in json.load(f)]
@@ -0,0 +1,93 @@
+"""schema.py creates and upgrades the tempature.db schema
+
+    Both log_temp.py and the webserver call migrate() at startup.  The schema version
+    is kept in sqlite's PRAGMA user_version and every migration in MIGRATIONS whose
+    version is greater than it is applied, in order, inside one transaction.  Add new
+    migrations to the end of the list, never edit one that has shipped.
+"""
+
+import sqlite3
+import rollups
+
+# WITHOUT ROWID tables need sqlite 3.8.2 or newer
+WITHOUT_ROWID = " WITHOUT ROWID" if sqlite3.sqlite_version_info >= (3, 8, 2) else ""
+
+
+def _create_log(conn):
+    """version 1: the original table, for a brand new database"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS tempature_log(
+timestamp INT PRIMARY KEY NOT NULL,
+room TEXT NOT NULL,
+tempature REAL NOT NULL)""")
+
+
+def _key_log_by_room(conn):
+    """version 2: key the log on (room, timestamp) and index timestamp for range queries"""
+    conn.execute("""CREATE TABLE tempature_log_new(
+timestamp INT NOT NULL,
+room TEXT NOT NULL,
+tempature REAL NOT NULL,
+PRIMARY KEY (room, timestamp))""" + WITHOUT_ROWID)
+    conn.execute("INSERT OR REPLACE INTO tempature_log_new SELECT timestamp, room, tempature FROM tempature_log")
+    conn.execute("DROP TABLE tempature_log")
+    conn.execute("ALTER TABLE tempature_log_new RENAME TO tempature_log")
+    conn.execute("CREATE INDEX IF NOT EXISTS tempature_log_timestamp ON tempature_log(timestamp)")
+
+
+def _create_rollups(conn):
+    """version 3: 1 minute / 1 hour / 1 day summary tables, see rollups.py"""
+    rollups.create_tables(conn)
+
+
+# (version, function) pairs, applied in order
+MIGRATIONS = [
+    (1, _create_log),
+    (2, _key_log_by_room),
+    (3, _create_rollups),
+]
+
+VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the database up to VERSION and switch it to WAL mode, returns the new version
+
+    WAL lets the webserver read while log_temp.py is writing.  The migrations run under
+    BEGIN IMMEDIATE so a logger and webserver starting together do not both apply them."""
+    if not conn.execute("SELECT count(*) FROM sqlite_master").fetchone()[0]:
+        # only takes effect before the first table is created, see retention.py
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")     # safe with WAL, and far fewer fsyncs
+
+    # the sqlite3 module commits before DDL on its own, so manage the transaction by hand
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_version(conn)
+            for number, step in MIGRATIONS:
+                if number > version:
+                    step(conn)
+                    version = number
+            conn.execute("PRAGMA user_version = %d" % version)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else 'tempature.db'
+    conn = sqlite3.connect(path)
+    print "{0} is at schema version {1}".format(path, migrate(conn))
+    conn.close()
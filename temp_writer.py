@@ -0,0 +1,129 @@
+"""temp_writer.py buffers tempature readings and writes them to sqlite in batches
+
+    Committing every reading means an fsync per sample on the Pi's SD card.  The
+    BufferedWriter keeps readings in memory and flushes them with executemany in a
+    single transaction once max_rows readings are waiting or the oldest buffered
+    reading is max_age seconds old.  Call close() on shutdown so nothing is lost.
+    The rollup tables are updated in the same transaction, see rollups.py.
+
+    tempature_log holds one reading per zone and second.  The first one written is
+    kept, and a reading for a (zone, second) that is already stored is dropped before
+    the insert, so it is never counted in the rollups twice.
+"""
+
+import time
+import rollups
+
+
+class BufferedWriter(object):
+    """Collects (timestamp, zone, tempature) rows and flushes them in one transaction"""
+
+    INSERT_SQL = "INSERT OR IGNORE INTO tempature_log values( (?), (?), (?) )"
+
+    def __init__(self, conn, max_rows=20, max_age=60.0, rollup=True):
+        self.conn = conn
+        self.rollup = rollup            # also maintain the rollup tables
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.buffer = []
+        self.oldest = None              # time the oldest buffered row was added
+
+        # counters used to tune max_rows / max_age
+        self.rows_written = 0
+        self.rows_duplicate = 0         # readings dropped because their zone and second were taken
+        self.flushes = 0
+        self.flush_time = 0.0           # total seconds spent flushing
+        self.last_flush_latency = 0.0
+        self.last_insert_latency = 0.0
+        self.last_commit_latency = 0.0
+        self.started = time.time()
+
+    def add(self, zonestr, temp, timestamp=None):
+        """Buffer a reading, flushing if the size or age threshold has been reached"""
+        if timestamp is None:
+            timestamp = int(time.time())
+        if not self.buffer:
+            self.oldest = time.time()
+        self.buffer.append((timestamp, zonestr, temp))
+        if self.due():
+            self.flush()
+
+    def due(self):
+        """True when the buffer is full or its oldest reading is too old"""
+        if not self.buffer:
+            return False
+        return len(self.buffer) >= self.max_rows or time.time() - self.oldest >= self.max_age
+
+    def flush(self):
+        """Write every buffered row in a single transaction, returns the number of rows written"""
+        if not self.buffer:
+            return 0
+        start = time.time()
+        try:
+            rows = self.new_rows(self.buffer)
+            self.conn.executemany(self.INSERT_SQL, rows)
+            if self.rollup:
+                rollups.update(self.conn, rows)
+            inserted = time.time()
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        done = time.time()
+        self.last_insert_latency = inserted - start
+        self.last_commit_latency = done - inserted     # the fsync, on an SD card usually the larger part
+        self.last_flush_latency = done - start
+        self.flush_time += self.last_flush_latency
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self.rows_duplicate += len(self.buffer) - len(rows)
+        self.buffer = []
+        self.oldest = None
+        return len(rows)
+
+    def new_rows(self, rows):
+        """return the rows whose (zone, second) is neither earlier in rows nor already in
+        tempature_log, the first of each wins"""
+        seen = set()
+        spans = {}                      # zone -> [first, last] timestamp in rows
+        for timestamp, zone, temp in rows:
+            span = spans.get(zone)
+            if span is None:
+                spans[zone] = [timestamp, timestamp]
+            else:
+                span[0] = min(span[0], timestamp)
+                span[1] = max(span[1], timestamp)
+        # a batch covers a few seconds per zone, so this is a short walk of the primary key
+        for zone, (first, last) in spans.iteritems():
+            seen.update((timestamp, zone) for timestamp, in self.conn.execute(
+                "SELECT timestamp FROM tempature_log WHERE room = ? AND timestamp BETWEEN ? AND ?", (zone, first, last)))
+        new = []
+        for row in rows:
+            key = row[:2]
+            if key not in seen:
+                seen.add(key)
+                new.append(row)
+        return new
+
+    def close(self):
+        """Flush anything still buffered"""
+        return self.flush()
+
+    def stats(self):
+        """return a dict of counters describing the writer"""
+        elapsed = time.time() - self.started
+        return {
+            'rows_buffered': len(self.buffer),
+            'rows_written': self.rows_written,
+            'rows_duplicate': self.rows_duplicate,
+            'flushes': self.flushes,
+            'last_flush_latency': self.last_flush_latency,
+            'avg_flush_latency': self.flush_time / self.flushes if self.flushes else 0.0,
+            'rows_per_sec': self.rows_written / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def __str__(self):
+        s = self.stats()
+        return "buffered={rows_buffered} written={rows_written} flushes={flushes} " \
+               "last_flush={last_flush_latency:.4f}s avg_flush={avg_flush_latency:.4f}s " \
+               "rows/sec={rows_per_sec:.2f}".format(**s)
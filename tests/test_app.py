@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import datetime
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+import schema
+from temp_writer import BufferedWriter
+from archive import Archiver
+from retention import Retention
+from ringbuf import RingWriter, RingReader
+
+DAY = 60*60*24
+DAYS = 120
+INTERVAL = 900          # seconds between readings of one zone
+ZONES = ('Room1', 'Room2')
+NOW = int(time.time())
+NOW -= NOW % INTERVAL
+
+scratch = None
+app = None
+
+
+def setUpModule():
+    """a database of DAYS days, archived and then pruned as log_temp.py --keep-days 30 would,
+    with the minute rollup cut to 45 days as retention.py --minute-days 45 would"""
+    global scratch, app
+    scratch = tempfile.mkdtemp(prefix='tempature-test-')
+    path = os.path.join(scratch, 'tempature.db')
+    conn = sqlite3.connect(path)
+    schema.migrate(conn)
+    writer = BufferedWriter(conn, max_rows=500, max_age=float('inf'))
+    for timestamp in xrange(NOW - DAYS * DAY, NOW + 1, INTERVAL):
+        for i, zone in enumerate(ZONES):
+            writer.add(zone, 60.0 + i + (timestamp // INTERVAL) % 20 / 4.0, timestamp)
+    writer.close()
+    Archiver(conn, os.path.join(scratch, 'archive')).run()
+    Retention(conn, keep_days={'tempature_log': 30, 'tempature_rollup_1m': 45}).run()
+    conn.close()
+
+    os.environ['TEMPATURE_DB'] = path
+    os.environ['TEMPATURE_RING'] = os.path.join(scratch, 'tempature.ring')     # never written
+    os.environ['TEMPATURE_ARCHIVE'] = os.path.join(scratch, 'archive')
+    os.environ['TEMPATURE_UTC_OFFSET'] = '0'
+    sys.path.insert(0, os.path.join(ROOT, 'webserver'))
+    import app
+
+
+def tearDownModule():
+    shutil.rmtree(scratch)
+
+
+def expected_raw(start, end):
+    """the number of readings per zone after start up to end"""
+    return len([t for t in xrange(NOW - DAYS * DAY, NOW + 1, INTERVAL) if start < t <= end])
+
+
+class GetTempsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def get(self, **args):
+        query = '&'.join('%s=%s' % item for item in sorted(args.items()))
+        response = self.client.get('/get_temps?' + query)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data())
+
+    def test_recent_window(self):
+        temps = self.get(start=NOW - DAY, end=NOW, raw=1)
+        self.assertEqual(sorted(temps), list(ZONES))
+        self.assertEqual(len(temps['Room1']), expected_raw(NOW - DAY, NOW))
+
+    def test_window_older_than_minute_rollup(self):
+        temps = self.get(start=NOW - 100 * DAY, end=NOW + DAY)
+        self.assertEqual(sorted(temps), list(ZONES))
+        self.assertTrue(temps['Room1'][0]['x'] < NOW - 99 * DAY)
+
+    def test_day_older_than_minute_rollup(self):
+        start = NOW - 95 * DAY
+        temps = self.get(start=start, end=start + DAY)
+        self.assertEqual(sorted(temps), list(ZONES))
+        self.assertEqual(sum(1 for point in temps['Room1'] if start <= point['x'] <= start + DAY), len(temps['Room1']))
+
+    def test_day_older_than_pruned_minute_rollup(self):
+        # older than the minute rollup reaches back to, younger than retention.KEEP_DAYS says
+        start = NOW - 60 * DAY
+        temps = self.get(start=start, end=start + DAY)
+        self.assertEqual(sorted(temps), list(ZONES))
+        self.assertEqual(len(temps['Room1']), expected_raw(start - 1, start + DAY))     # in minute buckets, from start
+
+    def test_raw_window_across_the_archive(self):
+        temps = self.get(start=NOW - 40 * DAY, end=NOW, raw=1)
+        self.assertEqual(len(temps['Room2']), expected_raw(NOW - 40 * DAY, NOW))
+
+    def test_stream_matches(self):
+        for args in ({'start': NOW - 40 * DAY, 'end': NOW, 'raw': 1},
+                     {'start': NOW - 100 * DAY, 'end': NOW - 99 * DAY, 'raw': 1},
+                     {'start': NOW - 95 * DAY, 'end': NOW - 94 * DAY},
+                     {'start': NOW - 2 * DAY, 'end': NOW, 'zone': 'Room2'}):
+            temps = self.get(**args)
+            self.assertTrue(temps)
+            self.assertEqual(self.get(stream=1, **args), temps)
+
+    def test_bad_arguments(self):
+        for query in ('max_points=0', 'max_points=-5', 'bucket=0', 'agg=median'):
+            self.assertEqual(self.client.get('/get_temps?range=3600&' + query).status_code, 400, query)
+        self.assertEqual(len(self.get(start=NOW - DAY, end=NOW, raw=1, max_points=10)['Room1']), 10)
+
+    def test_stream_gzip(self):
+        import zlib
+        args = 'start=%d&end=%d&raw=1&stream=1' % (NOW - 40 * DAY, NOW)
+        response = self.client.get('/get_temps?' + args, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        temps = json.loads(zlib.decompress(response.get_data(), 31))
+        self.assertEqual(temps, self.get(start=NOW - 40 * DAY, end=NOW, raw=1))
+
+
+class RingOverflowTest(unittest.TestCase):
+    """a ring with room for Room1 only, the logger drops Room2 from it"""
+
+    def setUp(self):
+        path = os.path.join(scratch, 'overflow.ring')
+        self.writer = RingWriter(path, capacity=64, max_zones=1)
+        for timestamp in xrange(NOW - 10 * INTERVAL, NOW + 1, INTERVAL):
+            for i, zone in enumerate(ZONES):
+                self.writer.append(zone, timestamp, 60.0 + i + (timestamp // INTERVAL) % 20 / 4.0)
+        app._ring = RingReader(path)
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        app._ring.close()
+        app._ring = None
+        self.writer.close()
+        os.remove(os.path.join(scratch, 'overflow.ring'))
+
+    def test_latest_has_every_zone(self):
+        self.assertEqual(sorted(app.get_latest()), list(ZONES))
+
+    def test_window_has_every_zone(self):
+        response = self.client.get('/get_temps?start=%d&end=%d&raw=1' % (NOW - 5 * INTERVAL, NOW))
+        temps = json.loads(response.get_data())
+        self.assertEqual(sorted(temps), list(ZONES))
+        self.assertEqual(len(temps['Room2']), 5)
+        with app.app.app_context():
+            self.assertEqual(app.newest_timestamp(), NOW)
+
+
+class PartialRingTest(unittest.TestCase):
+    """a ring with room to spare that has only heard from Room1 since the logger started"""
+
+    def setUp(self):
+        self.path = os.path.join(scratch, 'partial.ring')
+        self.writer = RingWriter(self.path, capacity=64, max_zones=4)
+        self.writer.append('Room1', NOW, 70.0)
+        app._ring = RingReader(self.path)
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        app._ring.close()
+        app._ring = None
+        self.writer.close()
+        os.remove(self.path)
+
+    def test_latest_has_every_zone(self):
+        latest = app.get_latest()
+        self.assertEqual(sorted(latest), list(ZONES))
+        self.assertEqual(latest['Room1'], (NOW, 70.0))
+        current = json.loads(self.client.get('/current').get_data())
+        self.assertEqual(sorted(current), list(ZONES))
+
+
+class ValidatorsTest(unittest.TestCase):
+    """a ring holding one reading per zone the logger has not flushed to sqlite yet"""
+
+    def setUp(self):
+        self.path = os.path.join(scratch, 'validators.ring')
+        self.writer = RingWriter(self.path, capacity=64, max_zones=4)
+        for timestamp in xrange(NOW - 10 * INTERVAL, NOW + INTERVAL + 1, INTERVAL):
+            for zone in ZONES:
+                self.writer.append(zone, timestamp, 70.0)
+        app._ring = RingReader(self.path)
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        app._ring.close()
+        app._ring = None
+        self.writer.close()
+        os.remove(self.path)
+
+    def test_not_modified(self):
+        url = '/get_temps?range=3600&raw=1'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        since = {'If-Modified-Since': response.headers['Last-Modified']}
+        self.assertEqual(self.client.get(url, headers=since).status_code, 304)
+        # another window is another body
+        self.assertEqual(self.client.get('/get_temps?range=7200&raw=1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_since(self):
+        temps = json.loads(self.client.get('/get_temps?range=3600&raw=1').get_data())
+        x = temps['Room1'][-3]['x']
+        newer = json.loads(self.client.get('/get_temps?since=%d' % x).get_data())
+        self.assertEqual(newer['Room1'], temps['Room1'][-2:])
+
+    def test_validators_follow_the_body(self):
+        ring = self.client.get('/get_temps?range=3600&raw=1')
+        self.assertEqual(json.loads(ring.get_data())['Room1'][-1]['x'], NOW + INTERVAL)
+        self.assertEqual(ring.last_modified, datetime.datetime.utcfromtimestamp(NOW + INTERVAL))
+        # streamed from sqlite, which has not got the newest reading yet
+        stream = self.client.get('/get_temps?range=3600&raw=1&stream=1')
+        self.assertEqual(json.loads(stream.get_data())['Room1'][-1]['x'], NOW)
+        self.assertEqual(stream.last_modified, datetime.datetime.utcfromtimestamp(NOW))
+        # the same validators sqlite alone gives, which change once the reading is flushed
+        app._ring.close()
+        app._ring = None
+        app._ring_tried = time.time()
+        self.assertEqual(self.client.get('/get_temps?range=3600&raw=1&stream=1',
+                                         headers={'If-None-Match': stream.headers['ETag']}).status_code, 304)
+        app._ring = RingReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
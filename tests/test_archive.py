@@ -0,0 +1,88 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+import archive
+from archive import Archive, Archiver, encode, decode, DAY
+from temp_writer import BufferedWriter
+
+START = 1500000000 - 1500000000 % DAY       # midnight UTC
+
+
+def as_lists(t, y):
+    return [int(v) for v in t], [float(v) for v in y]
+
+
+class ArchiveTest(unittest.TestCase):
+
+    numpy = True
+
+    def setUp(self):
+        self.np = archive.np
+        if not self.numpy:
+            archive.np = None
+        self.scratch = tempfile.mkdtemp(prefix='archive-test-')
+        self.root = os.path.join(self.scratch, 'archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+        archive.np = self.np
+
+    def test_encode_decode(self):
+        timestamps = [START, START + 16, START + 33, START + 33 + 3600, START + DAY - 1]
+        temps = [70.25, 70.3, -4.01, 101.99, 70.25]
+        data = encode(timestamps, temps)
+        self.assertEqual(as_lists(*decode(data)), (timestamps, temps))
+        self.assertEqual(as_lists(*decode(encode([START], [71.5]))), ([START], [71.5]))
+        self.assertRaises(ValueError, decode, 'TCA0' + data[4:])
+
+    def test_numpy_and_pure_python_agree(self):
+        if archive.np is None:
+            return
+        timestamps = range(START, START + DAY, 17)
+        temps = [(6000 + t % 900) / 100.0 for t in timestamps]
+        data = encode(timestamps, temps)
+        decoded = as_lists(*decode(data))
+        archive.np = None
+        self.assertEqual(encode(timestamps, temps), data)
+        self.assertEqual(as_lists(*decode(data)), decoded)
+        self.assertEqual(decoded, (timestamps, temps))
+
+    def test_archiver_and_window(self):
+        conn = sqlite3.connect(os.path.join(self.scratch, 'tempature.db'))
+        schema.migrate(conn)
+        writer = BufferedWriter(conn, max_rows=500, max_age=float('inf'))
+        readings = range(START, START + 3 * DAY, 600)
+        for timestamp in readings:
+            writer.add('Room 1/2', 70.0 + (timestamp % 7200) / 1000.0, timestamp)
+        writer.close()
+        archiver = Archiver(conn, self.root)
+        self.assertEqual(archiver.run(now=START + 2 * DAY + 6 * 60), 2 * DAY / 600)  # today is still open
+        self.assertEqual(archiver.run(now=START + 2 * DAY + 6 * 60), 0)
+        self.assertEqual(archiver.prune(batch_rows=50), 2 * DAY / 600)
+        conn.close()
+
+        days = Archive(self.root)
+        self.assertEqual(days.zones(), ['Room 1/2'])
+        self.assertEqual(days.days('Room 1/2'), [START, START + DAY])
+        self.assertEqual(days.newest_day(), START + DAY)
+        start, end = START + DAY - 1800, START + DAY + 1200
+        t, y = as_lists(*days.window('Room 1/2', start, end))
+        self.assertEqual(t, [x for x in readings if start < x <= end])
+        self.assertEqual(y, [70.0 + (x % 7200) / 1000.0 for x in t])
+        self.assertEqual(as_lists(*days.window('Room 1/2', start, end, inclusive=True))[0][0], start)
+        self.assertEqual(as_lists(*days.window('Room2', start, end)), ([], []))
+
+
+class PurePythonArchiveTest(ArchiveTest):
+
+    numpy = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import math
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import convert
+from convert import convert_batch, get_tempature
+
+
+def frame(*counts):
+    return [{convert.ADC_CHANNEL: count} for count in counts]
+
+
+class ConvertBatchTest(unittest.TestCase):
+
+    numpy = True
+
+    def setUp(self):
+        self.np = convert.np
+        if not self.numpy:
+            convert.np = None
+
+    def tearDown(self):
+        convert.np = self.np
+
+    def assertTemps(self, actual, expected):
+        self.assertEqual(len(actual), len(expected))
+        for a, e in zip(actual, expected):
+            if e is None:
+                self.assertTrue(math.isnan(a), a)
+            else:
+                self.assertAlmostEqual(a, e)
+
+    def test_matches_get_tempature(self):
+        frames = [frame(240, 241, 242), frame(300), frame(255, 256)]
+        expected = [get_tempature(f, format="F") for f in frames]
+        self.assertTemps(convert_batch(frames, format="F"), expected)
+
+    def test_calibration(self):
+        convert.CALIBRATION['Room2'] = (2.0, -1.0)
+        try:
+            frames = [frame(240), frame(240)]
+            temps = convert_batch(frames, zones=['Room1', 'Room2'])
+            self.assertTemps(temps, [get_tempature(frames[0]), get_tempature(frames[0]) * 2.0 - 1.0])
+        finally:
+            del convert.CALIBRATION['Room2']
+
+    def test_frames_without_samples(self):
+        frames = [frame(), frame(240, 242), frame(), frame(), frame(300), frame()]
+        self.assertTemps(convert_batch(frames), [None, get_tempature(frame(241)), None, None,
+                                                 get_tempature(frame(300)), None])
+        self.assertTemps(convert_batch([frame(), frame()]), [None, None])
+        self.assertEqual(convert_batch([]), [])
+
+
+class PurePythonConvertBatchTest(ConvertBatchTest):
+
+    numpy = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import math
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import downsample
+from downsample import lttb
+
+
+def wave(n):
+    return [(i * 16, 70.0 + 5 * math.sin(i / 50.0)) for i in range(n)]
+
+
+class LttbTest(unittest.TestCase):
+
+    numpy = True
+
+    def setUp(self):
+        self.np = downsample.np
+        if not self.numpy:
+            downsample.np = None
+
+    def tearDown(self):
+        downsample.np = self.np
+
+    def test_short_series_unchanged(self):
+        points = wave(10)
+        self.assertEqual(lttb(points, 10), points)
+        self.assertEqual(lttb(points, 540), points)
+        self.assertEqual(lttb(points, 2), [points[0], points[-1]])
+        self.assertEqual(lttb(points, 0), [])
+
+    def test_keeps_ends_and_order(self):
+        points = wave(5000)
+        picked = lttb(points, 100)
+        self.assertEqual(len(picked), 100)
+        self.assertEqual(picked[0], points[0])
+        self.assertEqual(picked[-1], points[-1])
+        self.assertEqual(picked, sorted(picked))
+        self.assertTrue(set(picked) <= set(points))
+
+    def test_keeps_a_spike(self):
+        points = [(i, 70.0) for i in range(1000)]
+        points[437] = (437, 90.0)
+        points[800] = (800, 50.0)
+        picked = lttb(points, 20)
+        self.assertTrue((437, 90.0) in picked and (800, 50.0) in picked)
+
+    def test_numpy_matches_pure_python(self):
+        if downsample.np is None:
+            return
+        points = wave(3001)
+        for threshold in (3, 4, 99, 540, 3000):
+            numpy_picked = lttb(points, threshold)
+            downsample.np = None
+            try:
+                self.assertEqual(numpy_picked, lttb(points, threshold), threshold)
+            finally:
+                downsample.np = self.np
+
+
+class PurePythonLttbTest(LttbTest):
+
+    numpy = False
+
+
+if __name__ == '__main__':
+    unittest.main()
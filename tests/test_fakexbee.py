@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fakexbee import FakeSerial, io_sample_frame, simulate, write_capture, read_capture, replay_clock
+from xbeeframe import FrameReader
+from ingest import IngestPipeline
+
+
+class FakeSerialTest(unittest.TestCase):
+
+    def test_plays_back_in_order(self):
+        records = [(0.0, 'ab'), (0.0, 'cd'), (0.05, 'ef')]
+        ser = FakeSerial(records, speed=1.0, timeout=1.0)
+        self.assertEqual(ser.read(4), 'abcd')
+        began = time.time()
+        self.assertEqual(ser.read(2), 'ef')
+        self.assertTrue(time.time() - began < 0.5)
+        ser.write('ATRE\r')
+        self.assertEqual(str(ser.written), 'ATRE\r')
+
+    def test_timeout_once_exhausted(self):
+        ser = FakeSerial([(0.0, 'ab')], speed=0, timeout=0.05)
+        self.assertEqual(ser.read(3), 'ab')
+        began = time.time()
+        self.assertEqual(ser.read(1), '')
+        self.assertTrue(time.time() - began >= 0.04)
+
+    def test_blocks_until_closed_once_exhausted(self):
+        ser = FakeSerial([(0.0, io_sample_frame(0xAAA1, [240]))], speed=0)
+        reader = FrameReader(ser)
+        self.assertEqual(reader.wait_read_frame().adc(0), [240])
+        reads = []
+        original = ser.read
+
+        def counted(size=1):
+            reads.append(size)
+            return original(size)
+        ser.read = counted
+        errors = []
+
+        def wait():
+            try:
+                reader.wait_read_frame()
+            except IOError as e:
+                errors.append(e)
+        thread = threading.Thread(target=wait)
+        thread.start()
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(len(reads), 1)            # waiting, not spinning
+        ser.close()
+        thread.join(1.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='fakexbee-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_capture_round_trip(self):
+        path = os.path.join(self.scratch, 'capture.bin')
+        records = list(simulate(sensors=3, interval=16, seconds=160))
+        self.assertEqual(write_capture(path, records), 30)
+        self.assertEqual(list(read_capture(path)), records)
+
+    def test_sped_up_replay_keeps_every_reading(self):
+        # 2 sensors every 16 seconds for 80 seconds, played back in 0.8 seconds
+        ser = FakeSerial(simulate(sensors=2, interval=16, seconds=80), speed=100)
+        persisted = []
+        pipeline = IngestPipeline(FrameReader(ser).wait_read_frame, lambda t, f: (f.source_addr, t),
+                                  persisted.append, clock=replay_clock(100))
+        pipeline.start()
+        time.sleep(1.2)
+        pipeline.stop()
+        ser.close()
+        self.assertEqual(len(persisted), 10)
+        self.assertEqual(len(set(persisted)), 10)   # no two readings of a zone share a second
+        stamps = sorted(t for addr, t in persisted if addr == '\xaa\xa1')
+        self.assertTrue(all(12 <= b - a <= 20 for a, b in zip(stamps, stamps[1:])), stamps)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import unittest
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ingest import IngestPipeline
+
+
+class Frames(object):
+    """read_frame for a list of frames, then blocks until closed like a serial port"""
+
+    def __init__(self, frames, delay=0.0):
+        self.frames = list(frames)
+        self.delay = delay
+        self.closed = Queue.Queue()
+
+    def __call__(self):
+        if self.frames:
+            time.sleep(self.delay)
+            return self.frames.pop(0)
+        self.closed.get()
+        raise IOError("port closed")
+
+
+class IngestPipelineTest(unittest.TestCase):
+
+    def run_pipeline(self, frames, decode=lambda t, f: f, persist=None, maintain=None, wait=0.5, **kwargs):
+        persisted = []
+        logged = []
+        source = Frames(frames, kwargs.pop('delay', 0.0))
+        pipeline = IngestPipeline(source, decode, persist or persisted.append, maintain=maintain,
+                                  log=logged.append, **kwargs)
+        pipeline.start()
+        time.sleep(wait)
+        self.assertTrue(pipeline.running())
+        pipeline.stop(release=lambda: source.closed.put(None))   # as closing the serial port releases the reader
+        return pipeline, persisted, logged
+
+    def test_frames_reach_persist_in_order(self):
+        pipeline, persisted, logged = self.run_pipeline(range(100), decode=lambda t, f: None if f % 10 == 0 else f)
+        self.assertEqual(persisted, [f for f in range(100) if f % 10])
+        self.assertEqual(pipeline.frames_read, 100)
+        self.assertEqual(pipeline.frames_decoded, 90)
+        self.assertEqual(logged, [])
+
+    def test_errors_are_counted_and_logged_once(self):
+        def persist(reading):
+            raise IOError("disk full")
+        pipeline, persisted, logged = self.run_pipeline(range(5), persist=persist)
+        self.assertEqual(pipeline.persist_errors, 5)
+        self.assertEqual(len(logged), 1)
+        self.assertTrue('persist error #1' in logged[0] and 'IOError: disk full' in logged[0])
+
+    def test_maintain_errors_do_not_stop_the_pipeline(self):
+        calls = []
+
+        def maintain():
+            calls.append(time.time())
+            raise ValueError("database is locked")
+        pipeline, persisted, logged = self.run_pipeline(range(3), maintain=maintain, maintain_interval=0.05)
+        self.assertTrue(len(calls) >= 3)
+        self.assertEqual(pipeline.maintain_errors, len(calls))
+        self.assertEqual(persisted, [0, 1, 2])
+        self.assertEqual(len(logged), 1)
+
+    def test_maintain_runs_while_busy(self):
+        calls = []
+        # a reading every 10ms never leaves the persist stage idle for maintain_interval
+        pipeline, persisted, logged = self.run_pipeline(range(60), maintain=lambda: calls.append(1),
+                                                        maintain_interval=0.1, delay=0.01, wait=0.7)
+        self.assertEqual(len(persisted), 60)
+        self.assertTrue(len(calls) >= 4)
+
+
+    def test_frame_read_while_stopping_is_kept(self):
+        persisted = []
+        closed = Queue.Queue()
+
+        def read_frame():
+            if not pipeline.stopping.is_set():
+                pipeline.stopping.wait()
+                time.sleep(0.05)        # the frame was part read when stop was called
+                return 'last'
+            closed.get()
+            raise IOError("port closed")
+        pipeline = IngestPipeline(read_frame, lambda t, f: f, persisted.append)
+        pipeline.start()
+        pipeline.stop(release=lambda: closed.put(None))
+        self.assertEqual(persisted, ['last'])
+        self.assertEqual(pipeline.stats()['frame_queue'], 0)
+        self.assertFalse(any(thread.is_alive() for thread in pipeline.threads))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import socket
+import urllib2
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.flushes = self.registry.histogram('tempature_flush_seconds', "time per flush", buckets=(0.1, 1.0))
+        self.rows = {'Room1': 3}
+        self.registry.callback('tempature_rows_total', "rows by zone", kind='counter', labels=('zone', ),
+                               fn=lambda: dict(((zone, ), n) for zone, n in self.rows.items()))
+
+    def test_render(self):
+        self.flushes.observe(0.05)
+        self.flushes.observe(2.0)
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP tempature_flush_seconds time per flush',
+            '# TYPE tempature_flush_seconds histogram',
+            'tempature_flush_seconds_bucket{le="0.1"} 1',
+            'tempature_flush_seconds_bucket{le="1.0"} 1',
+            'tempature_flush_seconds_bucket{le="+Inf"} 2',
+            'tempature_flush_seconds_sum 2.05',
+            'tempature_flush_seconds_count 2',
+            '# HELP tempature_rows_total rows by zone',
+            '# TYPE tempature_rows_total counter',
+            'tempature_rows_total{zone="Room1"} 3',
+        ])
+
+    def test_serve(self):
+        server = metrics.serve(self.registry, 0)
+        try:
+            host, port = server.server_address
+            self.assertEqual(host, '127.0.0.1')
+            body = urllib2.urlopen('http://127.0.0.1:%d/metrics' % port).read()
+            self.assertTrue('tempature_rows_total{zone="Room1"} 3' in body)
+            # a second exporter on the same port fails where the caller can catch it
+            self.assertRaises(socket.error, metrics.serve, self.registry, port)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
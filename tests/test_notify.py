@@ -0,0 +1,69 @@
+import os
+import sys
+import socket
+import unittest
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from notify import Publisher, Broadcaster
+
+
+def free_addr():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    addr = sock.getsockname()
+    sock.close()
+    return addr
+
+
+class BroadcasterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addr = free_addr()
+        self.publisher = Publisher(self.addr)
+
+    def tearDown(self):
+        self.publisher.close()
+
+    def test_listen(self):
+        broadcaster = Broadcaster(self.addr)
+        q = broadcaster.subscribe()
+        self.assertEqual(broadcaster.mode, 'listen')
+        self.publisher.publish('Room1', 100, 70.5)
+        self.assertEqual(q.get(timeout=5), {'zone': 'Room1', 'timestamp': 100, 'tempature': 70.5})
+
+    def test_second_process_polls(self):
+        first = Broadcaster(self.addr)
+        first.start()
+        latest = {'Room1': (100, 70.0), 'Room2': (100, 60.0)}
+        messages = []
+        polls = []
+
+        def poll():
+            polls.append(1)
+            return dict(latest)
+        second = Broadcaster(self.addr, poll=poll, poll_interval=0.01, log=messages.append)
+        q = second.subscribe()
+        self.assertEqual(second.mode, 'poll')
+        self.assertTrue(polls)          # the readings already there were noted before subscribe returned
+        self.assertEqual(len(messages), 1)
+        second.subscribe()              # does not try the port again
+        self.assertEqual(len(messages), 1)
+
+        latest['Room2'] = (116, 61.0)
+        self.assertEqual(q.get(timeout=5), {'zone': 'Room2', 'timestamp': 116, 'tempature': 61.0})
+        latest['Room3'] = (120, 50.0)
+        self.assertEqual(q.get(timeout=5)['zone'], 'Room3')
+        self.assertRaises(Queue.Empty, q.get, timeout=0.1)
+        second.stop()
+        self.assertFalse(second.thread.is_alive())
+
+    def test_port_taken_nothing_to_poll(self):
+        Broadcaster(self.addr).start()
+        broadcaster = Broadcaster(self.addr)
+        broadcaster.subscribe()
+        self.assertEqual(broadcaster.mode, 'off')
+
+
+if __name__ == '__main__':
+    unittest.main()
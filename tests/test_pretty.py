@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pretty
+from pretty import Console, DEBUG, INFO
+
+
+class ConsoleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO()
+        self.color = pretty.useColor
+
+    def tearDown(self):
+        pretty.setColor(self.color)
+
+    def test_written_within_interval(self):
+        console = Console(self.stream, level=DEBUG, interval=0.05)
+        console.frame('frame 1')
+        console.frame('frame 2')
+        self.assertEqual(self.stream.getvalue(), '')
+        time.sleep(0.3)
+        self.assertEqual(self.stream.getvalue(), 'frame 1\nframe 2\n')
+        self.assertEqual(console.writes, 1)
+        console.close()
+
+    def test_written_when_full(self):
+        console = Console(self.stream, size=10, interval=60)
+        console.info('12345')
+        self.assertEqual(self.stream.getvalue(), '')
+        console.info('67890')
+        self.assertEqual(self.stream.getvalue(), '12345\n67890\n')
+        console.close()
+
+    def test_close_writes_everything(self):
+        console = Console(self.stream, interval=60)
+        console.info('last words')
+        console.close()
+        self.assertEqual(self.stream.getvalue(), 'last words\n')
+
+    def test_levels(self):
+        console = Console(self.stream, level='warning')
+        console.debug('debug')
+        console.info('info')
+        console.warning('warning', color=None)
+        console.error('error', color=None)
+        console.close()
+        self.assertEqual(self.stream.getvalue(), 'warning\nerror\n')
+
+    def test_follows_set_color(self):
+        console = Console(self.stream)
+        pretty.setColor(True)
+        console.info('on', 'red')
+        pretty.setColor(False)
+        console.info('off', 'red')
+        console.close()
+        self.assertEqual(self.stream.getvalue(), pretty.escapes['red'] + 'on' + pretty.RESET + '\noff\n')
+
+    def test_frame_summary(self):
+        console = Console(self.stream, level=INFO, sample=None, every=3)
+        for i in range(7):
+            console.frame('frame %d' % i)
+        console.close()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('3 frames') and lines[0].endswith('frame 2'))
+        self.assertEqual(console.totalFrames, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+from archive import Archive, Archiver, DAY
+from retention import Retention
+from temp_writer import BufferedWriter
+
+START = 1500000000 - 1500000000 % DAY       # midnight UTC
+
+
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='retention-test-')
+        self.conn = sqlite3.connect(os.path.join(self.scratch, 'tempature.db'))
+        schema.migrate(self.conn)
+        writer = BufferedWriter(self.conn, max_rows=500, max_age=float('inf'))
+        for timestamp in range(START, START + 4 * DAY, 600):
+            for zone in ('Room1', 'Room2'):
+                writer.add(zone, 70.0, timestamp)
+        writer.close()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.scratch)
+
+    def oldest(self, zone):
+        return self.conn.execute("SELECT min(timestamp) FROM tempature_log WHERE room = ?", (zone, )).fetchone()[0]
+
+    def test_prunes_raw_readings(self):
+        retention = Retention(self.conn, keep_days={'tempature_log': 1})
+        self.assertEqual(retention.run(now=START + 4 * DAY), 2 * 3 * DAY / 600)
+        self.assertEqual(self.oldest('Room1'), START + 3 * DAY)
+        self.assertEqual(retention.run(now=START + 4 * DAY), 0)
+
+    def test_keeps_what_is_not_archived(self):
+        root = os.path.join(self.scratch, 'archive')
+        # the archiver's last pass ran before day 2 closed, only days 0 and 1 are archived
+        Archiver(self.conn, root).run(now=START + 2 * DAY + 10 * 60)
+        retention = Retention(self.conn, keep_days={'tempature_log': 1}, keep_from=Archive(root).archived_until)
+        retention.run(now=START + 4 * DAY)
+        self.assertEqual(self.oldest('Room1'), START + 2 * DAY)
+        self.assertEqual(self.oldest('Room2'), START + 2 * DAY)
+
+        # a zone with nothing archived keeps all of its readings
+        shutil.rmtree(os.path.join(root, 'Room2'))
+        self.conn.execute("INSERT INTO tempature_log VALUES (?, 'Room2', 70.0)", (START, ))
+        self.conn.commit()
+        retention.run(now=START + 4 * DAY)
+        self.assertEqual(self.oldest('Room2'), START)
+
+
+if __name__ == '__main__':
+    unittest.main()
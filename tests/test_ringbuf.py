@@ -0,0 +1,110 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ringbuf
+from ringbuf import RingWriter, RingReader, bucketize
+
+
+def as_lists(t, y):
+    return [int(v) for v in t], [float(v) for v in y]
+
+
+class RingTest(unittest.TestCase):
+
+    numpy = True
+
+    def setUp(self):
+        self.np = ringbuf.np
+        if not self.numpy:
+            ringbuf.np = None
+        self.scratch = tempfile.mkdtemp(prefix='ringbuf-test-')
+        self.path = os.path.join(self.scratch, 'tempature.ring')
+        self.log = []
+        self.writer = RingWriter(self.path, capacity=16, max_zones=2, log=self.log.append)
+        self.reader = RingReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.scratch)
+        ringbuf.np = self.np
+
+    def fill(self, zone, timestamps):
+        for timestamp in timestamps:
+            self.writer.append(zone, timestamp, timestamp / 10.0)
+
+    def test_round_trip(self):
+        self.fill('Room1', range(100, 110))
+        self.assertEqual(self.reader.zones(), ['Room1'])
+        self.assertEqual(as_lists(*self.reader.readings('Room1')), (range(100, 110), [t / 10.0 for t in range(100, 110)]))
+        self.assertEqual(self.reader.oldest('Room1'), 100)
+        self.assertEqual(self.reader.latest(), {'Room1': (109, 10.9)})
+        self.assertEqual(as_lists(*self.reader.readings('Room2')), ([], []))
+
+    def test_wraps_around(self):
+        self.fill('Room1', range(100, 140))
+        t, y = as_lists(*self.reader.readings('Room1'))
+        self.assertEqual(t, range(124, 140))
+        self.assertEqual(self.reader.oldest('Room1'), 124)
+        self.assertTrue(self.reader.covers(124, 'Room1'))
+        self.assertFalse(self.reader.covers(123, 'Room1'))
+
+    def test_window(self):
+        self.fill('Room1', range(100, 140, 2))     # wrapped, 108 to 138
+        self.assertEqual(as_lists(*self.reader.window('Room1', 120, 130))[0], [122, 124, 126, 128, 130])
+        self.assertEqual(as_lists(*self.reader.window('Room1', 120, 130, inclusive=True))[0], [120, 122, 124, 126, 128, 130])
+        self.assertEqual(as_lists(*self.reader.window('Room1', 0, 111))[0], [108, 110])
+        self.assertEqual(as_lists(*self.reader.window('Room1', 200, 300))[0], [])
+        self.assertEqual(self.reader.newest('Room1', 125), 124)
+        self.assertEqual(self.reader.newest('Room1', 100), None)
+        self.assertEqual(self.reader.newest('Room1'), 138)
+
+    def test_first_reading_of_a_second_wins(self):
+        self.writer.append('Room1', 100, 1.0)
+        self.writer.append('Room1', 100, 2.0)
+        self.writer.append('Room1', 101, 3.0)
+        self.assertEqual(as_lists(*self.reader.readings('Room1')), ([100, 101], [1.0, 3.0]))
+        self.assertEqual(as_lists(*self.reader.window('Room1', 99, 100)), ([100], [1.0]))
+
+    def test_zones_that_do_not_fit(self):
+        self.fill('Room1', [100])
+        self.assertFalse(self.reader.full())
+        self.fill('Room2', [100])
+        self.fill('Room3', [100, 101])
+        self.fill('Room4', [100])
+        self.assertEqual(self.reader.zones(), ['Room1', 'Room2'])
+        self.assertTrue(self.reader.full())
+        self.assertEqual(self.writer.dropped, 3)
+        self.assertEqual(len(self.log), 2)
+        self.assertTrue('Room3' in self.log[0])
+        # the ring cannot answer for every zone once some are missing
+        self.assertFalse(self.reader.covers(100))
+        self.assertTrue(self.reader.covers(100, 'Room1'))
+
+    def test_reopen_keeps_readings(self):
+        self.fill('Room1', range(100, 105))
+        self.writer.close()
+        self.writer = RingWriter(self.path, capacity=16, max_zones=2)
+        self.fill('Room1', range(105, 110))
+        self.assertEqual(as_lists(*self.reader.readings('Room1'))[0], range(100, 110))
+
+    def test_bucketize(self):
+        t, y = self.reader.readings('Room1')
+        self.assertEqual(bucketize(t, y, 60), [])
+        self.fill('Room1', [0, 30, 60, 90, 119, 120])
+        t, y = self.reader.readings('Room1')
+        self.assertEqual(bucketize(t, y, 60), [(0, 1.5), (60, (6.0 + 9.0 + 11.9) / 3), (120, 12.0)])
+        self.assertEqual(bucketize(t, y, 60, 'max', offset=30), [(0, 0.0), (60, 6.0), (120, 12.0)])
+
+
+class PurePythonRingTest(RingTest):
+
+    numpy = False
+
+
+if __name__ == '__main__':
+    unittest.main()
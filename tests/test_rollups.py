@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+import rollups
+
+DAY = 60*60*24
+
+
+class PickResolutionTest(unittest.TestCase):
+
+    def test_short_windows_are_raw(self):
+        self.assertEqual(rollups.pick_resolution(60*60), (None, None))
+
+    def test_coarsest_with_enough_points(self):
+        self.assertEqual(rollups.pick_resolution(DAY), ('tempature_rollup_1m', 60))
+        self.assertEqual(rollups.pick_resolution(7 * DAY), ('tempature_rollup_1h', 60*60))
+        self.assertEqual(rollups.pick_resolution(365 * DAY), ('tempature_rollup_1d', DAY))
+        self.assertEqual(rollups.pick_resolution(DAY, min_points=24), ('tempature_rollup_1h', 60*60))
+
+    def test_skips_pruned_tables(self):
+        now = int(time.time())
+        first = now - 400 * DAY
+        # the minute rollup pruned to 30 days, the hour and day rollups untouched
+        oldest = {'tempature_rollup_1m': now - 30 * DAY, 'tempature_rollup_1h': first - first % 3600,
+                  'tempature_rollup_1d': first - first % DAY}
+        self.assertEqual(rollups.pick_resolution(DAY, start=now - 2 * DAY, oldest=oldest)[0], 'tempature_rollup_1m')
+        # a day long window older than the minute rollup goes back: too few hours, so raw
+        self.assertEqual(rollups.pick_resolution(DAY, start=now - 60 * DAY, oldest=oldest), (None, None))
+        # a week that old still has enough hours
+        self.assertEqual(rollups.pick_resolution(7 * DAY, start=now - 60 * DAY, oldest=oldest)[0], 'tempature_rollup_1h')
+        self.assertEqual(rollups.pick_table(60, start=now - 60 * DAY, oldest=oldest), (None, None))
+        self.assertEqual(rollups.pick_table(60*60, start=now - 60 * DAY, oldest=oldest), ('tempature_rollup_1h', 60*60))
+
+    def test_unpruned_tables_reach_back_before_the_first_reading(self):
+        now = int(time.time())
+        first = now - 200 * DAY + 1234
+        oldest = {'tempature_rollup_1m': first - first % 60, 'tempature_rollup_1h': first - first % 3600,
+                  'tempature_rollup_1d': first - first % DAY}
+        self.assertEqual(rollups.pick_resolution(DAY, start=now - 300 * DAY, oldest=oldest)[0], 'tempature_rollup_1m')
+        self.assertEqual(rollups.pick_table(60, start=now - 150 * DAY, oldest=oldest)[0], 'tempature_rollup_1m')
+        empty = dict((table, None) for table, seconds in rollups.RESOLUTIONS)
+        self.assertEqual(rollups.pick_resolution(DAY, start=now - 300 * DAY, oldest=empty)[0], 'tempature_rollup_1m')
+
+    def test_pick_table(self):
+        self.assertEqual(rollups.pick_table(60), ('tempature_rollup_1m', 60))
+        self.assertEqual(rollups.pick_table(15 * 60), ('tempature_rollup_1m', 60))
+        self.assertEqual(rollups.pick_table(2 * DAY), ('tempature_rollup_1d', DAY))
+        self.assertEqual(rollups.pick_table(DAY, offset=-6 * 60*60), ('tempature_rollup_1h', 60*60))
+        self.assertEqual(rollups.pick_table(90), (None, None))
+        self.assertEqual(rollups.pick_table(60, offset=30), (None, None))
+
+    def test_oldest_buckets(self):
+        conn = sqlite3.connect(':memory:')
+        schema.migrate(conn)
+        self.assertEqual(rollups.oldest_buckets(conn), dict((table, None) for table, seconds in rollups.RESOLUTIONS))
+        rollups.update(conn, [(10 * DAY + 125, 'Room1', 70.0), (12 * DAY, 'Room2', 60.0)])
+        conn.execute("DELETE FROM tempature_rollup_1m WHERE bucket < ?", (11 * DAY, ))
+        self.assertEqual(rollups.oldest_buckets(conn), {'tempature_rollup_1m': 12 * DAY,
+                                                        'tempature_rollup_1h': 10 * DAY,
+                                                        'tempature_rollup_1d': 10 * DAY})
+
+
+class UpdateTest(unittest.TestCase):
+
+    def test_update_matches_create(self):
+        rows = [(t, 'Room%d' % (t % 2), 60 + (t % 13) / 4.0) for t in range(0, 3 * DAY, 45)]
+        incremental = sqlite3.connect(':memory:')
+        schema.migrate(incremental)
+        for i in range(0, len(rows), 50):
+            rollups.update(incremental, rows[i:i + 50])
+
+        bulk = sqlite3.connect(':memory:')
+        bulk.executescript("CREATE TABLE tempature_log(timestamp INT, room TEXT, tempature REAL)")
+        bulk.executemany("INSERT INTO tempature_log VALUES (?, ?, ?)", rows)
+        rollups.create_tables(bulk)
+
+        for table, seconds in rollups.RESOLUTIONS:
+            sql = "SELECT bucket, room, min, max, round(total, 6), count FROM %s ORDER BY room, bucket" % table
+            self.assertEqual(incremental.execute(sql).fetchall(), bulk.execute(sql).fetchall())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rules import RollingWindow, Rule, RulesEngine, load_rules
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.actions = []
+
+    def emit(self, action):
+        self.actions.append(action)
+
+
+class RollingWindowTest(unittest.TestCase):
+
+    def test_average_and_rate(self):
+        window = RollingWindow(300)
+        for timestamp, value in [(0, 70.0), (100, 71.0), (200, 72.0), (300, 73.0)]:
+            window.add(timestamp, value)
+        # the reading at 0 is 300 seconds old and has left the window
+        self.assertEqual(window.avg(), 72.0)
+        self.assertEqual(window.last(), 73.0)
+        self.assertEqual(window.rate(), 2.0 * 3600 / 200)
+        window.add(10000, 60.0)
+        self.assertEqual((window.avg(), window.rate()), (60.0, 0.0))
+
+
+class RuleTest(unittest.TestCase):
+
+    def feed(self, engine, zone, values, start=1000, step=60):
+        return [engine.evaluate(zone, start + i * step, value) for i, value in enumerate(values)]
+
+    def test_hysteresis(self):
+        sink = Sink()
+        engine = RulesEngine([Rule('cool', zone='Room1', when='above', on=78, off=76)], sink)
+        fired = self.feed(engine, 'Room1', [75, 78, 77, 79, 76.5, 76, 77, 78])
+        self.assertEqual([[a.state for a in actions] for actions in fired],
+                         [[], [True], [], [], [], [False], [], [True]])
+        self.assertEqual(sink.actions[0][:5], ('cool', 'Room1', 1060, 'cool', True))
+        self.assertEqual(engine.stats()['cool']['fired'], 3)
+
+    def test_below_on_the_average(self):
+        engine = RulesEngine([Rule('heat', when='below', on=65, off=67, value='avg', window=180)], Sink())
+        fired = self.feed(engine, 'Room2', [66, 64, 64, 64, 66, 68, 68])
+        # the average falls to 65 with the second reading, and climbs past 67 only once the 64s age out
+        self.assertEqual([[a.state for a in actions] for actions in fired],
+                         [[], [True], [], [], [], [], [False]])
+
+    def test_only_the_zone_rules_run(self):
+        rule = Rule('cool', zone='Room1', on=78)
+        engine = RulesEngine([rule], Sink())
+        self.feed(engine, 'Room2', [90, 91])
+        self.assertEqual(rule.evaluations, 0)
+        self.assertEqual(engine.readings, 2)
+
+    def test_hours(self):
+        now = int(time.time())
+        hour = time.localtime(now).tm_hour
+        rule = Rule('night', on=70, hours=(hour, (hour + 1) % 24))
+        engine = RulesEngine([rule], Sink())
+        self.assertEqual(len(engine.evaluate('Room1', now, 75)), 1)
+        # two hours later the rule is out of its hours and turns off whatever the reading
+        self.assertEqual([a.state for a in engine.evaluate('Room1', now + 7200, 75)], [False])
+        self.assertTrue(Rule('wraps', on=70, hours=(22, 7)).in_hours(time.mktime((2020, 1, 1, 3, 0, 0, 0, 0, -1))))
+
+    def test_bad_rules(self):
+        self.assertRaises(ValueError, Rule, 'x', when='sideways', on=1)
+        self.assertRaises(ValueError, Rule, 'x', value='median', on=1)
+        self.assertRaises(ValueError, Rule, 'x')
+
+
+class LoadRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='rules-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def test_docstring_example(self):
+        path = os.path.join(self.scratch, 'rules.json')
+        with open(path, 'w') as f:
+            json.dump([{"name": "cool bedroom", "zone": "Room1", "when": "above", "on": 78, "off": 76,
+                        "value": "avg", "window": 600, "hours": [22, 7], "action": "cool"}], f)
+        rule, = load_rules(path)
+        self.assertEqual((rule.name, rule.zone, rule.on, rule.off, rule.window, rule.action),
+                         ('cool bedroom', 'Room1', 78, 76, 600, 'cool'))
+        self.assertEqual(list(rule.hours), [22, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
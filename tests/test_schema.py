@@ -0,0 +1,71 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='schema-test-')
+        self.conn = sqlite3.connect(os.path.join(self.scratch, 'tempature.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.scratch)
+
+    def tables(self):
+        return set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')"))
+
+    def test_new_database(self):
+        self.assertEqual(schema.migrate(self.conn), schema.VERSION)
+        self.assertEqual(schema.get_version(self.conn), schema.VERSION)
+        self.assertTrue(set(['tempature_log', 'tempature_log_timestamp', 'tempature_rollup_1m',
+                             'tempature_rollup_1h', 'tempature_rollup_1d']) <= self.tables())
+        self.assertEqual(self.conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(self.conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
+    def test_upgrades_the_original_table(self):
+        # tempature.db as the first release of log_temp.py created it, keyed on timestamp alone
+        schema._create_log(self.conn)
+        self.conn.executemany("INSERT INTO tempature_log VALUES (?, ?, ?)",
+                              [(100, 'Room1', 70.0), (101, 'Room2', 60.0), (102, 'Room1', 70.5)])
+        self.conn.commit()
+        self.assertEqual(schema.get_version(self.conn), 0)
+
+        self.assertEqual(schema.migrate(self.conn), schema.VERSION)
+        self.assertEqual(self.conn.execute("SELECT timestamp, room, tempature FROM tempature_log ORDER BY timestamp").fetchall(),
+                         [(100, 'Room1', 70.0), (101, 'Room2', 60.0), (102, 'Room1', 70.5)])
+        # two zones can now log in the same second
+        self.conn.execute("INSERT INTO tempature_log VALUES (100, 'Room2', 61.0)")
+        self.assertRaises(sqlite3.IntegrityError, self.conn.execute, "INSERT INTO tempature_log VALUES (100, 'Room2', 62.0)")
+        self.assertTrue('tempature_rollup_1m' in self.tables())
+
+    def test_migrate_twice(self):
+        schema.migrate(self.conn)
+        self.conn.execute("INSERT INTO tempature_log VALUES (100, 'Room1', 70.0)")
+        self.conn.commit()
+        self.assertEqual(schema.migrate(self.conn), schema.VERSION)
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM tempature_log").fetchone()[0], 1)
+
+    def test_failed_migration_rolls_back(self):
+        def broken(conn):
+            conn.execute("CREATE TABLE half_done(x INT)")
+            raise sqlite3.OperationalError("disk I/O error")
+        migrations = schema.MIGRATIONS
+        schema.MIGRATIONS = migrations + [(schema.VERSION + 1, broken)]
+        try:
+            self.assertRaises(sqlite3.OperationalError, schema.migrate, self.conn)
+        finally:
+            schema.MIGRATIONS = migrations
+        self.assertEqual(schema.get_version(self.conn), 0)
+        self.assertFalse('half_done' in self.tables() or 'tempature_log' in self.tables())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+import rollups
+from temp_writer import BufferedWriter
+
+
+def rollup_matches_log(conn):
+    """return the (table, room, bucket) of every rollup row that disagrees with tempature_log"""
+    wrong = []
+    for table, seconds in rollups.RESOLUTIONS:
+        raw = dict(((row[0], row[1]), row[2:]) for row in conn.execute(
+            "SELECT room, timestamp - timestamp % ?, min(tempature), max(tempature), sum(tempature), count(*) "
+            "FROM tempature_log GROUP BY 1, 2", (seconds, )))
+        rolled = dict(((row[0], row[1]), row[2:]) for row in conn.execute(
+            "SELECT room, bucket, min, max, total, count FROM %s" % table))
+        for key in set(raw) | set(rolled):
+            a, b = raw.get(key), rolled.get(key)
+            if a is None or b is None or a[3] != b[3] or any(abs(x - y) > 1e-9 for x, y in zip(a[:3], b[:3])):
+                wrong.append((table, ) + key)
+    return wrong
+
+
+class BufferedWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        schema.migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def rows(self):
+        return self.conn.execute("SELECT timestamp, room, tempature FROM tempature_log ORDER BY room, timestamp").fetchall()
+
+    def test_flushes_when_full(self):
+        writer = BufferedWriter(self.conn, max_rows=3, max_age=float('inf'))
+        writer.add('Room1', 70.0, 100)
+        writer.add('Room1', 71.0, 101)
+        self.assertEqual(writer.flushes, 0)
+        writer.add('Room1', 72.0, 102)
+        self.assertEqual(writer.flushes, 1)
+        self.assertEqual(len(self.rows()), 3)
+
+    def test_close_flushes(self):
+        writer = BufferedWriter(self.conn, max_rows=100, max_age=float('inf'))
+        writer.add('Room1', 70.0, 100)
+        writer.close()
+        self.assertEqual(self.rows(), [(100, 'Room1', 70.0)])
+
+    def test_duplicates_in_one_batch(self):
+        writer = BufferedWriter(self.conn, max_rows=100, max_age=float('inf'))
+        for temp in (70.0, 90.0, 50.0):
+            writer.add('Room1', temp, 100)
+        writer.add('Room2', 60.0, 100)
+        writer.close()
+        self.assertEqual(self.rows(), [(100, 'Room1', 70.0), (100, 'Room2', 60.0)])
+        self.assertEqual(writer.stats()['rows_duplicate'], 2)
+        self.assertEqual(rollup_matches_log(self.conn), [])
+
+    def test_duplicates_across_batches(self):
+        writer = BufferedWriter(self.conn, max_rows=4, max_age=float('inf'))
+        for batch in range(5):
+            for timestamp in (100, 101, 160, 161):
+                writer.add('Room1', 70.0 + batch, timestamp)
+        writer.close()
+        self.assertEqual(len(self.rows()), 4)
+        self.assertEqual(writer.stats()['rows_duplicate'], 16)
+        self.assertEqual(rollup_matches_log(self.conn), [])
+        total, count = self.conn.execute("SELECT sum(total), sum(count) FROM tempature_rollup_1h").fetchone()
+        self.assertEqual((total, count), (280.0, 4))
+
+    def test_rollups_match_log(self):
+        writer = BufferedWriter(self.conn, max_rows=7, max_age=float('inf'))
+        for timestamp in range(0, 2 * 60*60*24, 97):
+            writer.add('Room%d' % (timestamp % 3), 60 + timestamp % 17 / 2.0, timestamp)
+        writer.close()
+        self.assertEqual(rollup_matches_log(self.conn), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
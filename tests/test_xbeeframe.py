@@ -0,0 +1,112 @@
+import os
+import sys
+import struct
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import zones
+from fakexbee import api_frame, io_sample_frame
+from xbeeframe import FrameReader
+
+ADDR64 = '\x00\x13\xa2\x00\x40\x8b\x12\x34'
+
+
+def zigbee_sample_frame(addr64, addr16, counts, escaped=False):
+    """an 0x92 frame with one sample of the given ADC channels"""
+    data = bytearray([0x92]) + bytearray(addr64) + bytearray(struct.pack('>H', addr16))
+    data += bytearray([0x01, 1]) + bytearray(struct.pack('>HB', 0, (1 << len(counts)) - 1))
+    for count in counts:
+        data += bytearray(struct.pack('>H', count))
+    return api_frame(data, escaped)
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def read(self, stream, escaped=False):
+        reader = FrameReader(None, escaped=escaped)
+        reader._append(stream)
+        frames = []
+        while True:
+            record = reader._next_frame()
+            if record is None:
+                return reader, frames
+            frames.append(record)
+
+    def test_series1_frame(self):
+        reader, frames = self.read(io_sample_frame(0xAAA1, [240, 241, 242]))
+        self.assertEqual(len(frames), 1)
+        frame = frames[0]
+        self.assertEqual(frame.source_addr, '\xaa\xa1')
+        self.assertEqual(frame.source_addr_long, None)
+        self.assertEqual(frame.adc(0), [240, 241, 242])
+        self.assertEqual(frame.to_dict()['samples'], [{'adc-0': 240}, {'adc-0': 241}, {'adc-0': 242}])
+
+    def test_escaped_stream_split_anywhere(self):
+        stream = ''.join(io_sample_frame(0x7D11, [0x7E, 0x13], escaped=True) for _ in range(3))
+        for split in range(1, len(stream)):
+            reader = FrameReader(None, escaped=True)
+            reader._append(stream[:split])
+            frames = []
+            record = reader._next_frame()
+            while record is not None:
+                frames.append(record)
+                record = reader._next_frame()
+            reader._append(stream[split:])
+            record = reader._next_frame()
+            while record is not None:
+                frames.append(record)
+                record = reader._next_frame()
+            self.assertEqual([f.adc(0) for f in frames], [[0x7E, 0x13]] * 3, split)
+            self.assertEqual(frames[0].source_addr, '\x7d\x11')
+
+    def test_zigbee_frame(self):
+        reader, frames = self.read(zigbee_sample_frame(ADDR64, 0x1234, [500, 600]))
+        frame = frames[0]
+        self.assertEqual(frame.source_addr_long, ADDR64)
+        self.assertEqual(frame.channels, (0, 1))
+        self.assertEqual(frame.adc(1), [600])
+
+    def test_bad_checksum_resynchronises(self):
+        good = io_sample_frame(0xAAA1, [240])
+        bad = good[:-1] + chr((ord(good[-1]) + 1) & 0xFF)
+        reader, frames = self.read(bad + good)
+        self.assertEqual(len(frames), 1)
+        self.assertTrue(reader.checksum_errors >= 1)
+
+    def test_short_frames_are_decode_errors(self):
+        good = io_sample_frame(0xAAA1, [240])
+        stream = ''.join([
+            api_frame(bytearray([0x83, 0xAA, 0xA1, 40])),                   # cut inside the header
+            api_frame(bytearray([0x92]) + bytearray(ADDR64)),               # cut inside the header
+            api_frame(bytearray([0x83, 0xAA, 0xA1, 40, 0, 3, 0x02, 0x00, 0x00, 0xF0])),   # 1 of 3 samples
+            good,
+        ])
+        reader, frames = self.read(stream)
+        self.assertEqual(reader.decode_errors, 3)
+        self.assertEqual([f.adc(0) for f in frames], [[240]])
+
+    def test_other_frames_are_skipped(self):
+        reader, frames = self.read(api_frame(bytearray([0x8A, 0x00])) + io_sample_frame(0xAAA1, [240]))
+        self.assertEqual(reader.skipped, 1)
+        self.assertEqual(len(frames), 1)
+
+
+class ZoneTest(unittest.TestCase):
+
+    def test_series1_by_16_bit_address(self):
+        self.assertEqual(zones.zone_for_frame('\xaa\xa1'), 'Room1')
+        self.assertEqual(zones.zone_for_frame('\xbb\xb2'), 'BBB2')
+
+    def test_zigbee_by_64_bit_address(self):
+        key = ADDR64.encode('hex').upper()
+        self.assertEqual(zones.zone_for_frame('\x12\x34', ADDR64), key)
+        self.assertEqual(zones.zone_for_frame('\xff\xfe', ADDR64), key)        # after a rejoin
+        self.assertEqual(zones.get_zone({'source_addr': '\x56\x78', 'source_addr_long': ADDR64}), key)
+
+    def test_unknown_address(self):
+        self.assertEqual(zones.zone_for_frame('\xff\xfe'), zones.DEFAULT_ZONE)
+        self.assertEqual(zones.zone_for_frame(None), zones.DEFAULT_ZONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
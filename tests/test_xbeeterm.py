@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import random
+import shutil
+import threading
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from XBeeTerm import Provisioner, Dispatch, XBeeShell, watch_options
+
+# the example session from the XBeeTerm.py docstring
+EXAMPLE = """baudrate 9600        # (XBeeTerm command) set the baudrate used to comm. with the XBee
+serial /dev/ttyUSB0  # (XBeeTerm command) serial device which has the XBee radio
++++                  # (XBee command) enter AT command mode on the XBee
+ATRE                 # (XBee command) restore XBee to factory settings
+ATAP 2               # (XBee command) enable API mode with escaped control characters
+ATMY AAA1            # (XBee command) set the address of this radio to eight byte hex
+ATID B000            # (XBee command) Set the PAN ID to eight byte hex
+ATWR                 # (XBee command) write all the changes to the XBee non-volatile memory
+
+exit                 # (XBeeTerm command) exit python shell
+"""
+
+
+class ProvisionerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix='xbeeterm-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def script(self, text):
+        path = os.path.join(self.scratch, 'config.txt')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_load_docstring_example(self):
+        commands, baudrate = Provisioner.load(self.script(EXAMPLE))
+        self.assertEqual(baudrate, 9600)
+        self.assertEqual(commands, ['+++', 'ATRE', 'ATAP 2', 'ATMY AAA1', 'ATID B000', 'ATWR'])
+
+    def test_load_rejects_other_commands(self):
+        path = self.script("+++\nATRE\nwatch\n")
+        try:
+            Provisioner.load(path)
+        except ValueError, e:
+            self.assertTrue(str(e).startswith('%s:3: ' % path), str(e))
+        else:
+            self.fail("watch was accepted")
+        self.assertRaises(ValueError, Provisioner.load, self.script("baudrate fast\n"))
+
+    def test_batches(self):
+        commands = ['+++', 'ATRE', 'ATAP 2', 'ATID B000', 'ATWR']
+        self.assertEqual(Provisioner(commands).batches(),
+                         [('+++', ['+++']), ('ATRE,AP 2,ID B000,WR', commands[1:])])
+        self.assertEqual(len(Provisioner(commands, pipeline=False).batches()), 5)
+        long_script = ['ATNI %s' % ('x' * 30)] * 4
+        for line, batch in Provisioner(long_script).batches():
+            self.assertTrue(len(line) <= Provisioner.MAX_LINE)
+
+    def test_bad_script_exits_with_one_line(self):
+        path = self.script("+++\nterm\n")
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'XBeeTerm.py'), '-d', '/dev/null', path],
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(process.returncode, 2)
+        self.assertTrue('Traceback' not in output and "%s:2: 'term'" % path in output, output)
+
+
+class WatchTest(unittest.TestCase):
+
+    def test_options(self):
+        self.assertEqual(watch_options(''), (False, False))
+        self.assertEqual(watch_options('fast'), (True, False))
+        self.assertEqual(watch_options(' fast  escaped '), (True, True))
+        self.assertEqual(watch_options('escaped'), (False, True))
+        self.assertRaises(ValueError, watch_options, 'fats')
+
+
+def packet(source, n=0, channel='adc-0'):
+    return {'id': 'rx_io_data', 'source_addr': source, 'samples': [{channel: n}], 'n': n}
+
+
+class DispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def record(self, name, packet):
+        self.calls.append((name, packet['n']))
+
+    def test_routing_and_fallback(self):
+        dispatch = Dispatch()
+        dispatch.register('radio1', self.record, key=('source_addr', '\x00\x01'))
+        dispatch.register('adc1', self.record, key=('channel', 'adc-1'))
+        dispatch.register('odd', self.record, lambda packet: packet['n'] % 2, key=('id', 'rx_io_data'))
+        dispatch.register('all', self.record, lambda packet: True)
+        for n, (source, channel) in enumerate([('\x00\x01', 'adc-0'), ('\x00\x02', 'adc-1'), ('\x00\x02', 'adc-0')]):
+            dispatch.dispatch(packet(source, n, channel))
+        dispatch.dispatch({'id': 'status', 'status': '\x00', 'n': 3})
+        self.assertEqual(self.calls, [('radio1', 0), ('all', 0),
+                                      ('adc1', 1), ('odd', 1), ('all', 1),
+                                      ('all', 2),
+                                      ('all', 3)])
+        self.assertRaises(ValueError, dispatch.register, 'all', self.record)
+        self.assertRaises(ValueError, dispatch.register, 'rssi', self.record, key=('rssi', 40))
+
+    def test_per_source_ordering(self):
+        dispatch = Dispatch(workers=3, queue_size=4)
+        seen = {}
+
+        def slow(name, packet):
+            time.sleep(random.random() / 1000)
+            seen.setdefault(packet['source_addr'], []).append(packet['n'])
+
+        dispatch.register('slow', slow, key=('id', 'rx_io_data'))
+        sources = ['\x00%c' % i for i in range(8)]
+        for n in range(50):
+            for source in sources:
+                dispatch.dispatch(packet(source, n))
+        dispatch.close()
+        self.assertEqual(sorted(seen), sources)
+        for source in sources:
+            self.assertEqual(seen[source], range(50))
+        self.assertEqual(dispatch.stats()['slow']['calls'], 400)
+
+    def test_drop_oldest(self):
+        dispatch = Dispatch(workers=1, queue_size=2, overflow='drop-oldest')
+        busy, release = threading.Event(), threading.Event()
+
+        def stuck(name, packet):
+            busy.set()
+            release.wait(5)
+            self.record(name, packet)
+
+        dispatch.register('stuck', stuck)
+        dispatch.dispatch(packet('\x00\x01', 0))
+        busy.wait(5)                # the worker holds packet 0, the queue is empty
+        for n in range(1, 6):
+            dispatch.dispatch(packet('\x00\x01', n))
+        self.assertEqual(dispatch.stats()['stuck']['dropped'], 3)
+        self.assertEqual(dispatch.stats()['stuck']['queued'], 2)
+        release.set()
+        dispatch.close()
+        self.assertEqual(self.calls, [('stuck', 0), ('stuck', 4), ('stuck', 5)])
+        self.assertRaises(ValueError, Dispatch, overflow='drop-newest')
+
+    def test_worker_errors_are_logged(self):
+        logged = []
+        dispatch = Dispatch(workers=1, log=logged.append)
+
+        def broken(name, packet):
+            raise KeyError(packet['n'])
+
+        dispatch.register('broken', broken)
+        for n in range(3):
+            dispatch.dispatch(packet('\x00\x01', n))
+        dispatch.close()
+        self.assertEqual(dispatch.stats()['broken']['errors'], 3)
+        self.assertEqual(len(logged), 1)
+        self.assertTrue("'broken'" in logged[0] and 'Traceback' in logged[0] and 'KeyError: 0' in logged[0], logged[0])
+
+
+class FakePort(object):
+    """hands out chunks of an XBee's answer, one per read, and nothing after the last"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.timeout = None
+        self.reads = 0
+
+    def inWaiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        self.reads += 1
+        if self.chunks:
+            return self.chunks.pop(0)
+        time.sleep(self.timeout)
+        return ''
+
+
+class ReadResponseTest(unittest.TestCase):
+
+    def shell(self, *chunks):
+        shell = XBeeShell()
+        shell.serial = FakePort(chunks)
+        return shell
+
+    def test_returns_once_answered(self):
+        shell = self.shell('O', 'K\r', 'late\r')
+        start = time.time()
+        self.assertEqual(shell.read_response(timeout=5), 'OK\r')
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(shell.serial.timeout, None)     # restored
+
+    def test_count(self):
+        shell = self.shell('OK\r', '0\r', 'OK\r', 'spare\r')
+        self.assertEqual(shell.read_response(count=3, timeout=5), 'OK\r0\rOK\r')
+        self.assertEqual(shell.serial.chunks, ['spare\r'])
+
+    def test_times_out(self):
+        shell = self.shell('O')
+        start = time.time()
+        self.assertEqual(shell.read_response(timeout=0.2), 'O')
+        self.assertTrue(0.2 <= time.time() - start < 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,29 @@
-from flask import Flask, Response, g, render_template
+from flask import Flask, Response, abort, g, render_template, request, stream_with_context
 import sqlite3
 import json
 import time
+import zlib
+import hashlib
+import itertools
+from operator import itemgetter
+import os
+import sys
+try:
+    import numpy as np
+except ImportError:     # numpy is optional, archive.py and ringbuf.py fall back to pure python
+    np = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import schema
+import rollups
+import downsample
+import ringbuf
+import archive
+from latest import LatestCache
+from notify import Broadcaster
+from retention import file_size
+import metrics
+import Queue
 
 
 app = Flask(__name__)
@@ -11,7 +33,61 @@ app.config.update(
     PROPAGATE_EXCEPTIONS=True
 )
 
-DATABASE = '../tempature.db'
+DATABASE = os.environ.get('TEMPATURE_DB', '../tempature.db')
+RING = os.environ.get('TEMPATURE_RING', '../tempature.ring')     # written by log_temp.py, see ringbuf.py
+ARCHIVE = os.environ.get('TEMPATURE_ARCHIVE', '../archive')   # closed days, see archive.py
+RING_RETRY = 10.0       # seconds between attempts to open RING while it does not exist
+OLDEST_TTL = 60.0       # seconds the oldest bucket of each rollup table is cached, retention prunes hourly
+STREAM_CHUNK = 1000     # rows fetched per chunk when streaming /get_temps
+LATEST_TTL = 5.0        # seconds the latest readings are served without asking sqlite
+KEEPALIVE = 15          # seconds between comments on an idle /stream connection
+
+# The chart shows timestamps as if they were UTC, so every x value sent to the browser is
+# shifted by this many seconds, once, as it leaves the database.  Buckets are aligned to
+# local midnight the same way.  A request may pass its own utc_offset.
+UTC_OFFSET = int(os.environ.get('TEMPATURE_UTC_OFFSET', -60*60*6))
+
+
+def init_db():
+    # create or upgrade the schema once, before any request is served
+    db = sqlite3.connect(DATABASE)
+    schema.migrate(db)
+    db.close()
+
+init_db()
+
+latest_cache = LatestCache(DATABASE, ttl=LATEST_TTL)
+day_archive = archive.Archive(ARCHIVE)
+# started by the first /stream client, polls get_latest() if another worker has the port
+broadcaster = Broadcaster(poll=lambda: get_latest(), log=app.logger.warning)
+
+registry = metrics.Registry()
+request_latency = registry.histogram('tempature_http_request_seconds', "time to build each response, streamed bodies excluded",
+                                     labels=('route', 'status'))
+rows_returned = registry.histogram('tempature_query_rows', "rows returned per /get_temps query",
+                                   buckets=metrics.ROW_BUCKETS, labels=('source', 'stream'))
+registry.callback('tempature_db_bytes', "size of the database and its write ahead log", lambda: file_size(DATABASE))
+registry.callback('tempature_latest_cache_total', "latest reading lookups by outcome", kind='counter', labels=('outcome', ),
+                  fn=lambda: dict(((k, ), v) for k, v in latest_cache.stats().items() if k in ('hits', 'revalidations', 'misses')))
+registry.callback('tempature_stream_clients', "connected /stream clients", lambda: len(broadcaster.subscribers))
+registry.callback('tempature_stream_readings_total', "readings received from log_temp.py", lambda: broadcaster.received, kind='counter')
+registry.callback('tempature_stream_dropped_total', "readings dropped for slow /stream clients", lambda: broadcaster.dropped, kind='counter')
+
+
+_ring = None
+_ring_tried = 0.0
+
+
+def get_ring():
+    """return a RingReader on the logger's ring buffer, None while there is none to read"""
+    global _ring, _ring_tried
+    if _ring is None and time.time() - _ring_tried >= RING_RETRY:
+        _ring_tried = time.time()
+        try:
+            _ring = ringbuf.RingReader(RING)
+        except (OSError, IOError, ValueError):
+            pass
+    return _ring
 
 
 def get_db():
@@ -21,18 +97,48 @@ def get_db():
     return db
 
 
-def get_current_temp():
+_oldest = None
+_oldest_checked = 0.0
 
-    cur = get_db().cursor()
-    cur.execute("select * from tempature_log order by timestamp desc limit 1")
 
-    rows = cur.fetchall()
+def oldest_buckets():
+    """return rollups.oldest_buckets() for the database, looked up at most every OLDEST_TTL seconds"""
+    global _oldest, _oldest_checked
+    if _oldest is None or time.time() - _oldest_checked >= OLDEST_TTL:
+        _oldest = rollups.oldest_buckets(get_db())
+        _oldest_checked = time.time()
+    return _oldest
+
+
+def get_latest():
+    """return {zone: (timestamp, tempature)} with the latest reading of every zone, from the
+    ring buffer, or the cache for zones the ring does not hold"""
+    ring = get_ring()
+    readings = ring.latest() if ring is not None else {}
+    for zone, reading in latest_cache.get().items():
+        readings.setdefault(zone, reading)
+    return readings
+
 
-    for row in rows:
-    	timestamp = row[0] - (60*60*6)
-        temp = row[2]
-    
-    return temp
+def get_current_temps():
+    """get_latest() with the timestamps shifted for the chart"""
+    current = {}
+    for zone, (timestamp, temp) in get_latest().items():
+        current[zone] = (timestamp + UTC_OFFSET, temp)
+
+    return current
+
+
+@app.before_request
+def start_timer():
+    g._started = time.time()
+
+
+@app.after_request
+def record_latency(response):
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_latency.observe(time.time() - g._started, (rule, response.status_code))
+    return response
 
 
 @app.teardown_appcontext
@@ -44,28 +150,319 @@ def close_connection(exception):
 
 @app.route('/', methods=['GET'])
 def get_index():
-	return render_template('index.html', current_temp = get_current_temp())
+	return render_template('index.html', current_temps = sorted(get_current_temps().items()))
+
+
+@app.route('/current', methods=['GET'])
+def get_current_json():
+    current = get_current_temps()
+    return Response(json.dumps(dict((zone, {'x': x, 'y': y}) for zone, (x, y) in current.items())),
+                    mimetype='application/json')
+
+
+@app.route('/status', methods=['GET'])
+def get_status_json():
+    status = {
+        'latest_cache': latest_cache.stats(),
+        'stream': {'clients': len(broadcaster.subscribers), 'received': broadcaster.received, 'dropped': broadcaster.dropped,
+                   'mode': broadcaster.mode},
+    }
+    return Response(json.dumps(status), mimetype='application/json')
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint, see metrics.py"""
+    return Response(registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def query_temps(start, end, zone=None, raw=False, bucket=None, agg='avg', offset=UTC_OFFSET):
+    """return a cursor over (room, x, tempature) rows between start and end ordered by room
+    then time, x being the timestamp shifted by offset seconds.  Every zone is returned
+    unless one is given.
+
+    Readings are grouped into buckets of bucket seconds (aligned to midnight offset
+    seconds from UTC) and aggregated with agg, one of rollups.AGGREGATES, all inside
+    sqlite.  The coarsest rollup table that fits the buckets is read rather than
+    tempature_log unless raw is set.  Without a bucket, raw readings are returned for
+    short windows and rollup sized buckets for longer ones."""
+    if bucket is None and not raw:
+        bucket = rollups.pick_resolution(end - start, start=start, oldest=oldest_buckets())[1]
+    params = {'start': start, 'end': end, 'offset': offset, 'bucket': bucket, 'zone': zone}
+    if bucket is None:
+        sql = "SELECT room, timestamp + :offset, tempature FROM tempature_log WHERE timestamp > :start AND timestamp <= :end"
+    else:
+        table = None if raw else rollups.pick_table(bucket, offset, start, oldest_buckets())[0]
+        raw_agg, rollup_agg = rollups.AGGREGATES[agg]
+        column, aggregate = ('timestamp', raw_agg) if table is None else ('bucket', rollup_agg)
+        sql = "SELECT room, ({0} + :offset) - ({0} + :offset) % :bucket, {1} FROM {2} WHERE {0} >= :start AND {0} <= :end".format(
+            column, aggregate, table or 'tempature_log')
+        params['start'] = start - (start + offset) % bucket    # include the whole of the first bucket
+    if zone is not None:
+        sql += " AND room = :zone"
+    if bucket is not None:
+        sql += " GROUP BY 1, 2"
+
+    cur = get_db().cursor()
+    cur.execute(sql + " ORDER BY 1, 2", params)
+    return cur
+
+
+def ring_temps(ring, start, end, zone=None, raw=False, bucket=None, agg='avg', offset=UTC_OFFSET):
+    """query_temps() answered from the logger's ring buffer, returns a list of (room, x, tempature)
+    rows.  Only use it when ring.covers(start, zone)."""
+    if bucket is None and not raw:
+        bucket = rollups.pick_resolution(end - start, start=start, oldest=oldest_buckets())[1]
+    if bucket is not None:
+        start -= (start + offset) % bucket
+    rows = []
+    for z in sorted([zone] if zone is not None else ring.zones()):
+        t, y = ring.window(z, start, end, inclusive=bucket is not None)
+        if bucket is not None:
+            points = ringbuf.bucketize(t, y, bucket, agg, offset)
+        elif ringbuf.np is not None:
+            points = zip((t + offset).tolist(), y.tolist())
+        else:
+            points = [(timestamp + offset, temp) for timestamp, temp in zip(t, y)]
+        rows.extend((z, x, temp) for x, temp in points)
+    return rows
+
+
+def reads_log(start, end, raw=False, bucket=None, offset=UTC_OFFSET):
+    """True if query_temps() would read tempature_log rather than a rollup table"""
+    if raw:
+        return True
+    if bucket is None:
+        return rollups.pick_resolution(end - start, start=start, oldest=oldest_buckets())[1] is None
+    return rollups.pick_table(bucket, offset, start, oldest_buckets())[0] is None
+
+
+def archive_split(start):
+    """return where a window starting at start should switch from the day archive to
+    tempature_log, the end of the newest archived day, or None when sqlite still holds
+    every raw reading from start or nothing has been archived"""
+    oldest = get_db().execute("SELECT min(timestamp) FROM tempature_log").fetchone()[0]
+    if oldest is not None and oldest <= start:
+        return None
+    newest = day_archive.newest_day()
+    return None if newest is None else newest + archive.DAY
+
+
+def archive_temps(start, end, split, zone=None, raw=False, bucket=None, agg='avg', offset=UTC_OFFSET):
+    """query_temps() for a window reaching back before split: readings before split come
+    from the day archive, the rest from tempature_log, and are bucketed together.  Returns a
+    list of (room, x, tempature) rows."""
+    if bucket is None and not raw:
+        # bucketed here from raw readings, so as fine as the window would be without retention
+        bucket = rollups.pick_resolution(end - start)[1]
+    inclusive = bucket is not None
+    if bucket is not None:
+        start -= (start + offset) % bucket
+
+    recent = {}
+    if end >= split:
+        cur = query_temps(max(start, split) - 1, end, zone=zone, raw=True, offset=0)
+        for room, rows in itertools.groupby(cur.fetchall(), key=itemgetter(0)):
+            recent[room] = [row[1:] for row in rows]
+
+    result = []
+    for z in sorted(set([zone] if zone is not None else day_archive.zones()) | set(recent)):
+        t, y = day_archive.window(z, start, min(end, split - 1), inclusive)
+        newer = recent.get(z, [])
+        if archive.np is not None:
+            t = np.concatenate((t, np.array([row[0] for row in newer], np.int64)))
+            y = np.concatenate((y, np.array([row[1] for row in newer], float)))
+        else:
+            t = t + [row[0] for row in newer]
+            y = y + [row[1] for row in newer]
+        if bucket is not None:
+            points = ringbuf.bucketize(t, y, bucket, agg, offset)
+        else:
+            points = [(timestamp + offset, temp) for timestamp, temp in zip(t, y)]
+        result.extend((z, x, temp) for x, temp in points)
+    return result
+
+
+def stream_temps(cur, compress=False, source='sqlite'):
+    """Yield the rows of cur, a cursor or a list, as a JSON object of arrays keyed by zone,
+    STREAM_CHUNK rows at a time, optionally gzipped"""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None     # wbits 31 writes a gzip header
+    if isinstance(cur, list):
+        batches = (cur[i:i + STREAM_CHUNK] for i in xrange(0, len(cur), STREAM_CHUNK))
+    else:
+        batches = iter(lambda: cur.fetchmany(STREAM_CHUNK), [])
+
+    def chunks():
+        yield '{'
+        current = None
+        count = 0
+        for rows in batches:
+            count += len(rows)
+            for zone, points in itertools.groupby(rows, key=itemgetter(0)):
+                body = json.dumps([{'x': row[1], 'y': row[2]} for row in points])[1:-1]
+                if zone == current:
+                    yield ',' + body
+                else:
+                    # a new zone, close the previous array and open this one
+                    yield ('' if current is None else '],') + json.dumps(zone) + ':[' + body
+                    current = zone
+        yield '}' if current is None else ']}'
+        rows_returned.observe(count, (source, '1'))
+
+    for chunk in chunks():
+        if gz is None:
+            yield chunk
+        else:
+            chunk = gz.compress(chunk)
+            if chunk:
+                yield chunk
+    if gz is not None:
+        yield gz.flush()
+
+
+def newest_timestamp(zone=None, end=None, use_ring=True):
+    """return the timestamp of the newest reading (of zone, at or before end), None if there is
+    none.  Readings only in the ring, not yet flushed to sqlite, count unless use_ring is False."""
+    ring = get_ring() if use_ring else None
+    if ring is not None and (end is None or ring.covers(end, zone)) and (zone is not None or not ring.full()):
+        newest = [ring.newest(z, end) for z in ([zone] if zone is not None else ring.zones())]
+        newest = [timestamp for timestamp in newest if timestamp is not None]
+        if newest:
+            return max(newest)
+    sql = "SELECT max(timestamp) FROM tempature_log WHERE 1"
+    params = []
+    if zone is not None:
+        sql += " AND room = ?"
+        params.append(zone)
+    if end is not None:
+        sql += " AND timestamp <= ?"
+        params.append(end)
+    return get_db().execute(sql, params).fetchone()[0]
+
+
+def request_window(newest, end=None, offset=UTC_OFFSET):
+    """return the (start, end) of the /get_temps window, which ends at newest unless the
+    request gives an end"""
+    if end is None:
+        end = newest if newest is not None else int(time.time())
+    start = request.args.get('start', end - request.args.get('range', 60*60*24, type=int), type=int)
+    # since=<x> returns only the raw points after an x value from a previous response,
+    # so a client can append new points instead of reloading the whole window
+    since = request.args.get('since', type=int)
+    if since is not None:
+        start = since - offset
+    return start, end
+
+
+def set_validators(response, etag, last_modified):
+    """Add the caching headers, the browser must revalidate but may then reuse its copy"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/get_temps', methods=['GET'])
 def get_temp_json():
 
-	return_array = []
+    return_dict = {}
+
+    zone = request.args.get('zone')
+    max_points = request.args.get('max_points', type=int)
+    raw = request.args.get('raw', 0, type=int)
+    stream = request.args.get('stream', 0, type=int)
+    bucket = request.args.get('bucket', type=int)
+    agg = request.args.get('agg', 'avg')
+    offset = request.args.get('utc_offset', UTC_OFFSET, type=int)
+    if agg not in rollups.AGGREGATES:
+        abort(400, 'agg must be one of %s' % ', '.join(sorted(rollups.AGGREGATES)))
+    if bucket is not None and bucket <= 0:
+        abort(400, 'bucket must be a positive number of seconds')
+    if max_points is not None and max_points < 1:
+        abort(400, 'max_points must be a positive number of points')
+    compress = stream and 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    # Without an explicit end the window ends at the newest reading rather than now, so the
+    # body only changes when a reading arrives and the ETag below stays valid until then.
+    end_arg = request.args.get('end', type=int)
+    newest = newest_timestamp(zone, end_arg)
+    start, end = request_window(newest, end_arg, offset)
+    if request.args.get('since', type=int) is not None:
+        raw, bucket = True, None
+
+    ring = get_ring()
+    from_ring = not stream and ring is not None and ring.covers(start, zone)
+    if ring is not None and not from_ring:
+        # the body comes from sqlite, which lacks what the ring holds until the logger's next
+        # flush, so neither the window nor the validators may count those readings
+        newest = newest_timestamp(zone, end_arg, use_ring=False)
+        start, end = request_window(newest, end_arg, offset)
+
+    etag = hashlib.md5('%s|%s|%d' % (newest, sorted(request.args.items(multi=True)), compress)).hexdigest()
+    conditional = set_validators(Response(), etag, newest)
+    conditional.make_conditional(request)
+    if conditional.status_code == 304:
+        return conditional
+
+    cur = None
+    if from_ring:
+        # recent windows come from the logger's shared memory, see ringbuf.py
+        rows, source = ring_temps(ring, start, end, zone=zone, raw=raw, bucket=bucket, agg=agg, offset=offset), 'ring'
+    else:
+        split = archive_split(start) if reads_log(start, end, raw, bucket, offset) else None
+        if split is not None and start < split:
+            # older than the raw rows left in sqlite, read the day files, see archive.py
+            rows, source = archive_temps(start, end, split, zone=zone, raw=raw, bucket=bucket, agg=agg, offset=offset), 'archive'
+        else:
+            cur, source = query_temps(start, end, zone=zone, raw=raw, bucket=bucket, agg=agg, offset=offset), 'sqlite'
+
+    if stream:
+        # large exports, rows go out as they are read instead of being built up in memory,
+        # except the archived part, which is decoded a whole day file at a time anyway
+        response = Response(stream_with_context(stream_temps(cur if cur is not None else rows, compress, source)),
+                            mimetype='application/json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+        return set_validators(response, etag, newest)
+
+    # one query for every zone, split into a series per zone
+    if cur is not None:
+        rows = cur.fetchall()
+    rows_returned.observe(len(rows), (source, '0'))
+    for zone, rows in itertools.groupby(rows, key=itemgetter(0)):
+        rows = [row[1:] for row in rows]
+        if max_points:
+            # shape preserving downsample so the chart gets at most max_points points
+            rows = downsample.lttb(rows, max_points)
+        return_dict[zone] = [{'x': x, 'y': temp} for x, temp in rows]
+
+    response = Response(json.dumps(return_dict))
+    return set_validators(response, etag, newest)
+
 
-	time_range = int(time.time()) - (60*60*24.0)
-	cur = get_db().cursor()
-    	cur.execute("SELECT * FROM tempature_log WHERE timestamp > ?", (time_range, ))
+@app.route('/stream', methods=['GET'])
+def get_stream():
+    """Server-Sent Events, one 'reading' event per reading as log_temp.py logs it"""
+    q = broadcaster.subscribe()
 
-    	rows = cur.fetchall()
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    reading = q.get(timeout=KEEPALIVE)
+                except Queue.Empty:
+                    yield ': keepalive\n\n'     # lets proxies and the browser see the connection is alive
+                    continue
+                data = {'zone': reading['zone'], 'x': reading['timestamp'] + UTC_OFFSET, 'y': reading['tempature']}
+                yield 'event: reading\ndata: %s\n\n' % json.dumps(data)
+        finally:
+            broadcaster.unsubscribe(q)
 
-    	for row in rows:
-		timestamp = row[0] - (60*60*6)
-        	temp = row[2]
-		return_array.append({'x': timestamp, 'y': temp})
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-	response = Response(json.dumps(return_array))
-	return response
-	
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=80, debug=True)
+    app.run(host='0.0.0.0', port=80, debug=True, threaded=True)
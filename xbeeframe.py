@@ -0,0 +1,215 @@
+"""xbeeframe.py is a lean parser for the XBee IO sample frames the sensors send
+
+    python-xbee builds a dict per frame and a dict per sample, which is a lot of
+    allocation on a Pi Zero for frames that only ever carry a few ADC counts.
+    FrameReader reads whatever the serial port has waiting into one bytearray,
+    removes API mode 2 escaping as the bytes arrive, checks each frame's checksum and
+    decodes the two IO sample frames we receive straight into a slotted IOSample:
+
+        0x83  802.15.4 (Series 1) IO sample, 16 bit source address
+        0x92  ZigBee (Series 2) IO sample indicator, 64 + 16 bit source address
+
+    Any other frame is counted and skipped, as is an IO sample frame too short for
+    its header or the samples it claims.  FrameReader.wait_read_frame() blocks
+    like XBee.wait_read_frame(), so either can be handed to Dispatch or IngestPipeline.
+"""
+
+import struct
+
+API_START = 0x7E
+ESCAPE = 0x7D
+
+_U16 = struct.Struct('>H')
+
+
+class IOSample(object):
+    """One IO sample frame.  analog holds a tuple of counts per sample, one per enabled
+    ADC channel in channel order; digital holds the DIO bit field of each sample."""
+
+    __slots__ = ('api_id', 'source_addr', 'source_addr_long', 'rssi', 'options',
+                 'dio_mask', 'aio_mask', 'channels', 'digital', 'analog')
+
+    @property
+    def id(self):
+        """the python-xbee name of the frame"""
+        return 'rx_io_data' if self.api_id == 0x83 else 'rx_io_data_long_addr'
+
+    def channel_names(self):
+        """the enabled channels, named like python-xbee's sample keys"""
+        names = ['adc-%d' % c for c in self.channels]
+        names.extend('dio-%d' % bit for bit in range(16) if self.dio_mask & (1 << bit))
+        return names
+
+    def adc(self, channel=0):
+        """return the counts of one ADC channel, one per sample"""
+        i = self.channels.index(channel)
+        return [sample[i] for sample in self.analog]
+
+    def to_dict(self):
+        """the same dict python-xbee would have produced, for printing and old handlers"""
+        frame = {'id': self.id,
+                 'source_addr': self.source_addr, 'options': chr(self.options)}
+        if self.source_addr_long is not None:
+            frame['source_addr_long'] = self.source_addr_long
+        if self.rssi is not None:
+            frame['rssi'] = chr(self.rssi)
+        samples = []
+        for n, counts in enumerate(self.analog):
+            sample = dict(('adc-%d' % c, v) for c, v in zip(self.channels, counts))
+            if self.dio_mask:
+                for bit in range(16):
+                    if self.dio_mask & (1 << bit):
+                        sample['dio-%d' % bit] = bool(self.digital[n] & (1 << bit))
+            samples.append(sample)
+        frame['samples'] = samples
+        return frame
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def _channels(mask, count):
+    return tuple(bit for bit in range(count) if mask & (1 << bit))
+
+
+def _decode_samples(record, buf, pos, end, sample_count, dio_mask, channels):
+    record.dio_mask = dio_mask
+    record.channels = channels
+    per_sample = '>' + ('H' if dio_mask else '') + 'H' * len(channels)
+    size = struct.calcsize(per_sample)
+    if pos + size * sample_count > end:
+        raise ValueError("IO sample frame 0x%02X has %d bytes for %d samples of %d" % (
+            record.api_id, end - pos, sample_count, size))
+    digital, analog = [], []
+    for _ in range(sample_count):
+        values = struct.unpack_from(per_sample, buf, pos)
+        pos += size
+        if dio_mask:
+            digital.append(values[0])
+            analog.append(values[1:])
+        else:
+            analog.append(values)
+    record.digital = digital
+    record.analog = analog
+    return record
+
+
+# API id -> bytes of an IO sample frame up to the first sample, the API id included
+_HEADER_SIZE = {0x83: 8, 0x92: 16}
+
+
+def decode_io_sample(buf, pos, end):
+    """decode the frame data in buf[pos:end] (starting at the API id), None if it is not an
+    IO sample, ValueError if it is one but cut short"""
+    api_id = buf[pos]
+    if api_id in _HEADER_SIZE and pos + _HEADER_SIZE[api_id] > end:
+        raise ValueError("IO sample frame 0x%02X of %d bytes is shorter than its header" % (api_id, end - pos))
+    record = IOSample()
+    record.api_id = api_id
+    if api_id == 0x83:
+        # addr(2) rssi(1) options(1) count(1) channel indicator(2): adc0-5 in bits 9-14, dio0-8 in bits 0-8
+        record.source_addr = str(buf[pos + 1:pos + 3])
+        record.source_addr_long = None
+        record.rssi = buf[pos + 3]
+        record.options = buf[pos + 4]
+        count = buf[pos + 5]
+        indicator = _U16.unpack_from(buf, pos + 6)[0]
+        return _decode_samples(record, buf, pos + 8, end, count,
+                               indicator & 0x01FF, _channels(indicator >> 9, 7))
+    if api_id == 0x92:
+        # addr64(8) addr16(2) options(1) count(1) digital mask(2) analog mask(1)
+        record.source_addr_long = str(buf[pos + 1:pos + 9])
+        record.source_addr = str(buf[pos + 9:pos + 11])
+        record.rssi = None
+        record.options = buf[pos + 11]
+        count = buf[pos + 12]
+        dio_mask = _U16.unpack_from(buf, pos + 13)[0]
+        return _decode_samples(record, buf, pos + 16, end, count,
+                               dio_mask, _channels(buf[pos + 15], 8))
+    return None
+
+
+class FrameReader(object):
+    """Reads IO sample frames from a serial port without python-xbee"""
+
+    COMPACT_AT = 4096       # drop consumed bytes from the front of the buffer past this
+
+    def __init__(self, ser, escaped=False):
+        self.serial = ser
+        self.escaped = escaped
+        self.buffer = bytearray()
+        self.pos = 0                    # start of the unparsed bytes in buffer
+        self.pending_escape = False     # the last byte read was an escape character
+
+        self.frames = 0
+        self.skipped = 0                # valid frames that are not IO samples
+        self.checksum_errors = 0
+        self.decode_errors = 0          # IO sample frames cut short
+
+    def _append(self, data):
+        if not self.escaped:
+            self.buffer += data
+            return
+        data = bytearray(data)
+        start = 0
+        if self.pending_escape and data:
+            self.buffer.append(data[0] ^ 0x20)
+            self.pending_escape = False
+            start = 1
+        while True:
+            i = data.find(b'\x7d', start)
+            if i < 0:
+                self.buffer += data[start:]
+                return
+            self.buffer += data[start:i]
+            if i + 1 == len(data):
+                self.pending_escape = True
+                return
+            self.buffer.append(data[i + 1] ^ 0x20)
+            start = i + 2
+
+    def _next_frame(self):
+        """return the next IO sample in the buffer, None if more bytes are needed"""
+        buf = self.buffer
+        while True:
+            start = buf.find(b'\x7e', self.pos)
+            if start < 0:
+                self.pos = len(buf)
+                return None
+            if start + 3 > len(buf):
+                self.pos = start
+                return None
+            length = _U16.unpack_from(buf, start + 1)[0]
+            end = start + 3 + length
+            if end >= len(buf):
+                self.pos = start
+                return None
+            if (sum(buf[start + 3:end + 1]) & 0xFF) != 0xFF:
+                # not a frame after all, resynchronise on the next start delimiter
+                self.checksum_errors += 1
+                self.pos = start + 1
+                continue
+            self.pos = end + 1
+            try:
+                record = decode_io_sample(buf, start + 3, end) if length else None
+            except ValueError:
+                self.decode_errors += 1
+                continue
+            if record is None:
+                self.skipped += 1
+                continue
+            self.frames += 1
+            return record
+
+    def wait_read_frame(self):
+        """wait_read_frame: None -> IOSample
+
+        Block until the next IO sample frame has arrived"""
+        while True:
+            record = self._next_frame()
+            if self.pos > self.COMPACT_AT:
+                del self.buffer[:self.pos]
+                self.pos = 0
+            if record is not None:
+                return record
+            self._append(self.serial.read(self.serial.inWaiting() or 1))
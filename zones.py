@@ -0,0 +1,39 @@
+"""zones.py maps XBee radios to the zone (room) their readings are logged under
+
+    Frames are matched on the radio's 64 bit serial number whenever they carry it, as
+    ZigBee (0x92) frames do, since a ZigBee radio's 16 bit address is handed out by the
+    network, changes when it rejoins and is FFFE while unknown.  Series 1 (0x83)
+    frames only have the 16 bit source address, as set with ATMY (see XBeeTerm.py).
+    Radios that are not listed in ZONES are logged under their hex address so a new
+    sensor shows up on the chart straight away and can be named later.
+"""
+
+import binascii
+
+# 64 bit serial number or 16 bit source address of the radio, in hex -> zone name
+ZONES = {
+    'AAA1': 'Room1',
+}
+
+DEFAULT_ZONE = 'Room1'  # for frames that carry no source address
+UNKNOWN_ADDR = '\xff\xfe'  # 16 bit address of a radio that has not been given one
+
+
+def get_zone(frame):
+    """get_zone: XBee data dict -> string
+
+    return the zone a frame's readings belong to"""
+    return zone_for_frame(frame.get('source_addr'), frame.get('source_addr_long'))
+
+
+def zone_for_frame(source_addr, source_addr_long=None):
+    """zone_for_frame: binary 16 bit address, binary 64 bit address or None -> string"""
+    return zone_for_addr(source_addr_long or source_addr)
+
+
+def zone_for_addr(addr):
+    """zone_for_addr: binary address string -> string"""
+    if not addr or addr == UNKNOWN_ADDR:
+        return DEFAULT_ZONE
+    key = binascii.hexlify(addr).upper()
+    return ZONES.get(key, key)